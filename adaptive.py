@@ -0,0 +1,119 @@
+"""
+Adaptive practice for Maths Generator App
+Per-user Elo-style mastery per topic, updated on each graded answer and used to pick the next topic and difficulty
+"""
+
+import os
+import math
+import random
+import threading
+import time
+
+from models import PerformanceAggregate
+from state_store import store
+
+# Chance of a correct answer the scheduler aims for
+ADAPTIVE_TARGET = float(os.environ.get("ADAPTIVE_TARGET", 0.7))
+ADAPTIVE_K = float(os.environ.get("ADAPTIVE_K", 0.4))
+ADAPTIVE_EXPLORATION = float(os.environ.get("ADAPTIVE_EXPLORATION", 0.3))
+ADAPTIVE_TTL = int(os.environ.get("ADAPTIVE_TTL", 30 * 24 * 3600))
+MAX_ADAPTIVE_TOPICS = 50
+# Attempts after which a topic's rating moves at half the initial step
+K_HALF_LIFE = 20
+MAX_RATING = 4.0
+
+# Rating at which a student has an even chance at each difficulty
+DIFFICULTY_LEVELS = {"easy": -1.0, "medium": 0.0, "challenging": 1.0}
+
+def expected(rating, difficulty):
+    """Chance of a correct answer at a difficulty for a topic rating"""
+    return 1 / (1 + math.exp(DIFFICULTY_LEVELS.get(difficulty, 0.0) - rating))
+
+def _clip(rating):
+    return max(-MAX_RATING, min(MAX_RATING, rating))
+
+def seed_rating(levels):
+    """Starting rating from (difficulty, attempts, correct) totals, weighted by attempts"""
+    total = sum(attempts for _, attempts, _ in levels)
+    if not total:
+        return 0.0
+    rating = 0.0
+    for difficulty, attempts, correct in levels:
+        # Smoothed accuracy, so 0/1 and 1/1 do not map to infinite ratings
+        accuracy = (correct + 1) / (attempts + 2)
+        rating += attempts * (DIFFICULTY_LEVELS.get(difficulty, 0.0) + math.log(accuracy / (1 - accuracy)))
+    return _clip(rating / total)
+
+class MasteryModel:
+    """Topic ratings per user in the shared store, as {topic: [rating, attempts]}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"selections": 0, "select_seconds_total": 0.0, "updates": 0, "loads": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _key(self, user_id):
+        return f"mastery:{user_id}"
+
+    def ratings(self, user_id):
+        """Return {topic: (rating, attempts)}, seeding from the aggregates once; must run inside an app context"""
+        key = self._key(user_id)
+        if store.set(f"{key}:loaded", True, ttl=ADAPTIVE_TTL, only_if_absent=True):
+            self._seed(user_id)
+        return {topic: tuple(value) for topic, value in store.hgetall(key).items()}
+
+    def _seed(self, user_id):
+        """Ratings from PerformanceAggregate: one row per topic x difficulty, not the answer history"""
+        levels = {}
+        for row in PerformanceAggregate.query.filter_by(user_id=user_id).all():
+            levels.setdefault(row.topic, []).append((row.difficulty, row.attempts, row.correct))
+        if levels:
+            store.hset(self._key(user_id), {
+                topic: [round(seed_rating(rows), 4), sum(attempts for _, attempts, _ in rows)]
+                for topic, rows in levels.items()
+            })
+            store.expire(self._key(user_id), ADAPTIVE_TTL)
+        self._count("loads")
+
+    def record(self, user_id, topic, difficulty, correct):
+        """Move the topic rating towards the result by how surprising it was"""
+        rating, attempts = self.ratings(user_id).get(topic, (0.0, 0))
+        step = ADAPTIVE_K / (1 + attempts / K_HALF_LIFE)
+        rating = _clip(rating + step * ((1.0 if correct else 0.0) - expected(rating, difficulty)))
+        store.hset(self._key(user_id), {topic: [round(rating, 4), attempts + 1]})
+        for key in (self._key(user_id), f"{self._key(user_id)}:loaded"):
+            store.expire(key, ADAPTIVE_TTL)
+        self._count("updates")
+
+    def choose(self, user_id, topics):
+        """Pick a topic, weighted towards those most in need of practice, and the difficulty nearest ADAPTIVE_TARGET"""
+        started = time.perf_counter()
+        ratings = self.ratings(user_id)
+        total = sum(attempts for topic, (_, attempts) in ratings.items() if topic in topics)
+
+        needs = []
+        for topic in topics:
+            rating, attempts = ratings.get(topic, (0.0, 0))
+            # Weak topics first; rarely practised ones get a bonus so every topic is visited
+            need = 1 - expected(rating, "medium")
+            need += ADAPTIVE_EXPLORATION * math.sqrt(math.log(total + 2) / (attempts + 1))
+            needs.append(need)
+        # Sampling by need, rather than always taking the weakest topic, keeps topics interleaved
+        best = random.choices(topics, weights=needs)[0]
+
+        rating = ratings.get(best, (0.0, 0))[0]
+        difficulty = min(DIFFICULTY_LEVELS, key=lambda d: abs(expected(rating, d) - ADAPTIVE_TARGET))
+        self._count("selections")
+        self._count("select_seconds_total", time.perf_counter() - started)
+        return best, difficulty
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["select_seconds_avg"] = stats["select_seconds_total"] / stats["selections"] if stats["selections"] else 0.0
+        return stats
+
+mastery = MasteryModel()
@@ -0,0 +1,89 @@
+"""
+Performance aggregates for Maths Generator App
+Keeps per-user/topic/difficulty totals up to date so summaries never rescan Performance
+"""
+
+from sqlalchemy import func, case, delete, insert
+
+from models import db, Performance, PerformanceAggregate
+
+def increment_totals(model, keys, columns, rows):
+    """Sum rows (dicts) by the keys columns and add the sums to model's rows in the current transaction"""
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(tuple(row[key] for key in keys), [0] * len(columns))
+        for i, column in enumerate(columns):
+            total[i] += row[column]
+
+    # One statement per key in the batch, not per row
+    for key, sums in totals.items():
+        match = dict(zip(keys, key))
+        values = dict(zip(columns, sums))
+        # Increment in SQL so concurrent writers cannot lose updates
+        updated = model.query.filter_by(**match).update(
+            {getattr(model, column): getattr(model, column) + value for column, value in values.items()},
+            synchronize_session=False
+        )
+        if not updated:
+            db.session.add(model(**match, **values))
+
+def apply_performance_rows(rows):
+    """Add Performance rows (as dicts) to their aggregates in the current transaction"""
+    increments = []
+    for row in rows:
+        time_taken = row.get("time_taken")
+        has_time = time_taken is not None
+        increments.append({
+            "user_id": row["user_id"],
+            "topic": row["topic"],
+            "difficulty": row["difficulty"],
+            "attempts": 1,
+            "correct": 1 if row["is_correct"] else 0,
+            "time_count": 1 if has_time else 0,
+            "time_sum": time_taken if has_time else 0.0,
+            "time_sumsq": time_taken * time_taken if has_time else 0.0
+        })
+    increment_totals(
+        PerformanceAggregate,
+        ("user_id", "topic", "difficulty"),
+        ("attempts", "correct", "time_count", "time_sum", "time_sumsq"),
+        increments
+    )
+
+def rebuild_aggregates():
+    """Recompute every aggregate from the Performance table with one GROUP BY"""
+    select = db.select(
+        Performance.user_id,
+        Performance.topic,
+        Performance.difficulty,
+        func.count(),
+        func.sum(case((Performance.is_correct, 1), else_=0)),
+        func.count(Performance.time_taken),
+        func.coalesce(func.sum(Performance.time_taken), 0.0),
+        func.coalesce(func.sum(Performance.time_taken * Performance.time_taken), 0.0),
+    ).group_by(Performance.user_id, Performance.topic, Performance.difficulty)
+
+    db.session.execute(delete(PerformanceAggregate))
+    db.session.execute(insert(PerformanceAggregate).from_select(
+        ["user_id", "topic", "difficulty", "attempts", "correct", "time_count", "time_sum", "time_sumsq"],
+        select
+    ))
+    db.session.commit()
+    return PerformanceAggregate.query.count()
+
+def summarize(aggregates):
+    """Combine aggregate rows into overall and per-topic statistics"""
+    total = {"total": 0, "correct": 0, "time_count": 0, "time_sum": 0.0}
+    topics = {}
+    for agg in aggregates:
+        for stats in (total, topics.setdefault(agg.topic, {"total": 0, "correct": 0, "time_count": 0, "time_sum": 0.0})):
+            stats["total"] += agg.attempts
+            stats["correct"] += agg.correct
+            stats["time_count"] += agg.time_count
+            stats["time_sum"] += agg.time_sum
+
+    for stats in [total] + list(topics.values()):
+        stats["accuracy"] = stats["correct"] / stats["total"] * 100 if stats["total"] else 0
+        stats["average_time"] = stats["time_sum"] / stats["time_count"] if stats["time_count"] else 0
+        del stats["time_count"], stats["time_sum"]
+    return total, topics
@@ -0,0 +1,225 @@
+"""
+Class analytics for Maths Generator App
+Cohort accuracy, median times, per-question difficulty and trends computed in the database, cached until new answers arrive
+"""
+
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, case
+
+from models import db, User, Performance, PerformanceAggregate
+from state_store import store
+
+ANALYTICS_CACHE_TTL = int(os.environ.get("ANALYTICS_CACHE_TTL", 600))
+ANALYTICS_MIN_ATTEMPTS = int(os.environ.get("ANALYTICS_MIN_ATTEMPTS", 5))
+ANALYTICS_TREND_DAYS = int(os.environ.get("ANALYTICS_TREND_DAYS", 30))
+ANALYTICS_QUESTION_LIMIT = 50
+# Buckets in the rolling accuracy of the trend series
+TREND_WINDOW = 7
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def _version(topic=None):
+    """Changes whenever answers for topic (or any topic) are committed; read from the aggregates so every worker agrees"""
+    query = db.session.query(func.sum(PerformanceAggregate.attempts), func.max(PerformanceAggregate.updated_at))
+    if topic:
+        query = query.filter(PerformanceAggregate.topic == topic)
+    attempts, updated_at = query.one()
+    return f"{attempts or 0}:{updated_at.isoformat() if updated_at else ''}"
+
+def _cohort(query):
+    """Restrict a Performance query to students, so teachers trying questions do not skew results"""
+    return query.join(User, User.id == Performance.user_id).filter(User.role == 'student')
+
+def _filters(topic, difficulty, since, until):
+    conditions = []
+    if topic:
+        conditions.append(Performance.topic == topic)
+    if difficulty:
+        conditions.append(Performance.difficulty == difficulty)
+    if since:
+        conditions.append(Performance.created_at >= since)
+    if until:
+        conditions.append(Performance.created_at < until)
+    return conditions
+
+def _median_times(conditions):
+    """Median time_taken per topic/difficulty, using row_number() instead of loading the times"""
+    partition = (Performance.topic, Performance.difficulty)
+    ranked = _cohort(db.session.query(
+        Performance.topic,
+        Performance.difficulty,
+        Performance.time_taken,
+        func.row_number().over(partition_by=partition, order_by=Performance.time_taken).label("rn"),
+        func.count().over(partition_by=partition).label("n")
+    )).filter(Performance.time_taken.isnot(None), *conditions).subquery()
+
+    # The middle row, or the mean of the two middle rows for an even count
+    rows = db.session.query(ranked.c.topic, ranked.c.difficulty, func.avg(ranked.c.time_taken)).filter(
+        ranked.c.rn >= ranked.c.n / 2.0, ranked.c.rn <= ranked.c.n / 2.0 + 1
+    ).group_by(ranked.c.topic, ranked.c.difficulty).all()
+    return {(topic, difficulty): median for topic, difficulty, median in rows}
+
+def accuracy_by_topic(topic=None, difficulty=None, since=None, until=None):
+    """Attempts, accuracy, mean and median time per topic x difficulty across the cohort"""
+    if since or until:
+        conditions = _filters(topic, difficulty, since, until)
+        rows = _cohort(db.session.query(
+            Performance.topic,
+            Performance.difficulty,
+            func.count(func.distinct(Performance.user_id)),
+            func.count(),
+            func.sum(case((Performance.is_correct, 1), else_=0)),
+            func.avg(Performance.time_taken)
+        )).filter(*conditions).group_by(Performance.topic, Performance.difficulty).all()
+    else:
+        # Without a date range the running aggregates already hold the totals
+        conditions = _filters(topic, difficulty, None, None)
+        query = db.session.query(
+            PerformanceAggregate.topic,
+            PerformanceAggregate.difficulty,
+            func.count(),
+            func.sum(PerformanceAggregate.attempts),
+            func.sum(PerformanceAggregate.correct),
+            func.sum(PerformanceAggregate.time_sum) / func.nullif(func.sum(PerformanceAggregate.time_count), 0)
+        ).join(User, User.id == PerformanceAggregate.user_id).filter(User.role == 'student')
+        if topic:
+            query = query.filter(PerformanceAggregate.topic == topic)
+        if difficulty:
+            query = query.filter(PerformanceAggregate.difficulty == difficulty)
+        rows = query.group_by(PerformanceAggregate.topic, PerformanceAggregate.difficulty).all()
+
+    medians = _median_times(conditions)
+    result = []
+    for row_topic, row_difficulty, students, attempts, correct, mean_time in rows:
+        attempts, correct = int(attempts or 0), int(correct or 0)
+        median = medians.get((row_topic, row_difficulty))
+        result.append({
+            "topic": row_topic,
+            "difficulty": row_difficulty,
+            "students": int(students),
+            "attempts": attempts,
+            "correct": correct,
+            "accuracy": round(correct / attempts * 100, 2) if attempts else 0.0,
+            "mean_time": round(mean_time, 2) if mean_time is not None else None,
+            "median_time": round(median, 2) if median is not None else None
+        })
+    return sorted(result, key=lambda row: (row["topic"], row["difficulty"]))
+
+def question_difficulty(topic=None, difficulty=None, since=None, until=None,
+                        min_attempts=ANALYTICS_MIN_ATTEMPTS, limit=ANALYTICS_QUESTION_LIMIT):
+    """Per-question p-value (share answered correctly), hardest first, for questions with enough attempts"""
+    correct = func.sum(case((Performance.is_correct, 1), else_=0))
+    attempts = func.count()
+    p_value = correct * 1.0 / attempts
+    rows = _cohort(db.session.query(
+        Performance.topic,
+        Performance.difficulty,
+        Performance.question_text,
+        attempts,
+        correct,
+        p_value,
+        func.avg(Performance.time_taken),
+        func.rank().over(partition_by=Performance.topic, order_by=p_value)
+    )).filter(*_filters(topic, difficulty, since, until)).group_by(
+        Performance.topic, Performance.difficulty, Performance.question_text
+    ).having(attempts >= min_attempts).order_by(p_value, attempts.desc()).limit(limit).all()
+
+    return [
+        {
+            "topic": row_topic,
+            "difficulty": row_difficulty,
+            "question_text": text,
+            "attempts": int(row_attempts),
+            "correct": int(row_correct),
+            "p_value": round(float(row_p), 3),
+            "mean_time": round(mean_time, 2) if mean_time is not None else None,
+            "rank_in_topic": int(rank)
+        }
+        for row_topic, row_difficulty, text, row_attempts, row_correct, row_p, mean_time, rank in rows
+    ]
+
+def _bucket(column, bucket):
+    """Truncate a timestamp to its day or week (Monday) as a string, on SQLite or PostgreSQL"""
+    if db.engine.dialect.name == "sqlite":
+        if bucket == "week":
+            return func.strftime("%Y-%m-%d", column, "weekday 0", "-6 days")
+        return func.strftime("%Y-%m-%d", column)
+    return func.to_char(func.date_trunc(bucket, column), "YYYY-MM-DD")
+
+def trends(topic=None, difficulty=None, since=None, until=None, bucket="day"):
+    """Attempts and accuracy per topic per day or week, with a rolling accuracy over TREND_WINDOW buckets"""
+    if bucket not in ("day", "week"):
+        raise ValueError(f"Unknown bucket {bucket!r}; use 'day' or 'week'")
+    since = since or datetime.utcnow() - timedelta(days=ANALYTICS_TREND_DAYS)
+    period = _bucket(Performance.created_at, bucket)
+    per_bucket = _cohort(db.session.query(
+        period.label("period"),
+        Performance.topic.label("topic"),
+        func.count().label("attempts"),
+        func.sum(case((Performance.is_correct, 1), else_=0)).label("correct")
+    )).filter(*_filters(topic, difficulty, since, until)).group_by(period, Performance.topic).subquery()
+
+    window = {
+        "partition_by": per_bucket.c.topic,
+        "order_by": per_bucket.c.period,
+        "rows": (-(TREND_WINDOW - 1), 0)
+    }
+    rows = db.session.query(
+        per_bucket.c.period,
+        per_bucket.c.topic,
+        per_bucket.c.attempts,
+        per_bucket.c.correct,
+        func.sum(per_bucket.c.correct).over(**window),
+        func.sum(per_bucket.c.attempts).over(**window)
+    ).order_by(per_bucket.c.topic, per_bucket.c.period).all()
+
+    return [
+        {
+            "period": period_start,
+            "topic": row_topic,
+            "attempts": int(row_attempts),
+            "accuracy": round(row_correct / row_attempts * 100, 2) if row_attempts else 0.0,
+            "rolling_accuracy": round(window_correct / window_attempts * 100, 2) if window_attempts else 0.0
+        }
+        for period_start, row_topic, row_attempts, row_correct, window_correct, window_attempts in rows
+    ]
+
+def report(topic=None, difficulty=None, since=None, until=None, bucket="day", min_attempts=ANALYTICS_MIN_ATTEMPTS):
+    """All class analytics for the filters, from the cache unless answers have arrived since"""
+    params = {
+        "topic": topic, "difficulty": difficulty, "bucket": bucket, "min_attempts": min_attempts,
+        "since": since.isoformat() if since else None, "until": until.isoformat() if until else None
+    }
+    version = _version(topic)
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    key = f"analytics:report:{version}:{digest}"
+
+    cached = store.get(key)
+    if cached is not None:
+        _count("hits")
+        return dict(cached, cached=True)
+
+    _count("misses")
+    result = {
+        "filters": params,
+        "generated_at": datetime.utcnow().isoformat(),
+        "accuracy": accuracy_by_topic(topic, difficulty, since, until),
+        "questions": question_difficulty(topic, difficulty, since, until, min_attempts),
+        "trends": trends(topic, difficulty, since, until, bucket)
+    }
+    store.set(key, result, ttl=ANALYTICS_CACHE_TTL)
+    return dict(result, cached=False)
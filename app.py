@@ -7,18 +7,43 @@ IS_PRODUCTION = os.environ.get('FLASK_ENV') == 'production' or os.environ.get('R
 if not IS_PRODUCTION:
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
-from openai import OpenAI
-import json
-import re
-import random
+from flask import Flask, Blueprint, Response, stream_with_context, render_template, request, jsonify, redirect, url_for, session
 import uuid
-from flask_dance.contrib.google import make_google_blueprint, google
+import json
+import math
+import time
+import threading
+from contextlib import closing
 from dotenv import load_dotenv
 from werkzeug.middleware.proxy_fix import ProxyFix
-from models import db, User, UserSession, Performance, QuestionHistory
+from database import init_database
+from models import db, User, Performance, QuestionHistory, PerformanceAggregate
+from aggregates import summarize
+from write_behind import writer, question_history_row
+from question_generator import generate_question, generate_question_batch, generate_question_stream, shuffle_options
+from question_pool import QuestionPool, POOL_ENABLED, archived_question
+from replay import replay
+from local_questions import local_topic, generate_local_question
+from dedupe import seen_index
+from server_sessions import sessions, ServerSessionInterface
+from state_store import store
+from llm_engine import engine, EngineBusy
+from resilience import LLMUnavailable
+from history import attempts_page, questions_page, parse_date, page_size
+from analytics import report as analytics_report, stats as analytics_stats, ANALYTICS_MIN_ATTEMPTS
+from budget import BudgetExhausted, check_llm_allowed, global_budget_left, record_usage, spend_report, user_requests
+from response_parser import ParseError, stats as parser_stats
+from grading import grade, load_question, remember_question, stats as grading_stats
+from adaptive import mastery, MAX_ADAPTIVE_TOPICS
+from prompt_registry import prompts
+from instrumentation import get_logger, timer, errors_total, register_gauges, render as render_metrics, start_logging
+from instrumentation import init_app as init_instrumentation
 from datetime import datetime
 
+MAX_BATCH_SIZE = 20
+MAX_LOCAL_ATTEMPTS = 5
+MAX_DUPLICATE_RETRIES = 2
+
 # Load environment variables
 load_dotenv()
 
@@ -26,60 +51,44 @@ GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 SESSION_SECRET = os.environ.get("SESSION_SECRET")
 
-# Debug: Print credentials (only in development)
-if not IS_PRODUCTION:
-    print(f"DEBUG: GOOGLE_CLIENT_ID: {GOOGLE_CLIENT_ID}")
-    print(f"DEBUG: GOOGLE_CLIENT_SECRET: {GOOGLE_CLIENT_SECRET[:10]}..." if GOOGLE_CLIENT_SECRET else "DEBUG: GOOGLE_CLIENT_SECRET: None")
-    print(f"DEBUG: SESSION_SECRET: {SESSION_SECRET[:10]}..." if SESSION_SECRET else "DEBUG: SESSION_SECRET: None")
+log = get_logger("app")
 
-app = Flask(__name__)
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# All application routes; the app itself is built by create_app()
+main = Blueprint('main', __name__)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), "maths_generator.db")}')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# How long the last question for each topic/difficulty is kept in the shared store
+LAST_QUESTION_TTL = int(os.environ.get("LAST_QUESTION_TTL", 24 * 3600))
 
-# Initialize database
-db.init_app(app)
+# Every completion's token usage counts towards the daily budgets
+engine.on_usage = record_usage
 
-# Create database tables if they don't exist
-with app.app_context():
-    db.create_all()
+def generate_pool_question(topic, difficulty):
+    """Pool refills stop once today's global budget is spent"""
+    if not global_budget_left():
+        raise BudgetExhausted("Today's question budget has been used up")
+    return generate_question(topic, difficulty)
 
-API_KEY = os.environ.get("API_KEY", "sk-2b91306525ae497ca872f7bc7df5421d")
-BASE_URL = "https://api.deepseek.com"
+# Ready questions per topic/difficulty, refilled in the background
+question_pool = QuestionPool(generate_pool_question)
 
-# Store the last question for each topic/difficulty
-last_questions = {}
+# Existing counters are exported on /metrics as gauges
+register_gauges("llm_engine", engine.stats)
+register_gauges("question_pool", question_pool.stats)
+register_gauges("write_behind", writer.stats)
+register_gauges("response_parser", parser_stats)
+register_gauges("stream", lambda: streaming_stats())
+register_gauges("analytics_cache", analytics_stats)
+register_gauges("grading", grading_stats)
+register_gauges("adaptive", mastery.stats)
+register_gauges("sessions", sessions.stats)
+register_gauges("prompts", prompts.stats)
 
-app.secret_key = SESSION_SECRET or "your-secret-key-change-this-in-production"
+# Time-to-first-content and total latency of /api/generate_stream
+stream_stats = {"streams": 0, "errors": 0, "first_content_seconds_total": 0.0, "total_seconds_total": 0.0}
+stream_stats_lock = threading.Lock()
 
-# Configure OAuth environment variables (like Google example)
-if app.debug:
-    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-    os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
-
-google_bp = make_google_blueprint(
-    client_id=GOOGLE_CLIENT_ID,
-    client_secret=GOOGLE_CLIENT_SECRET,
-    scope=[
-        "openid",
-        "https://www.googleapis.com/auth/userinfo.email",
-        "https://www.googleapis.com/auth/userinfo.profile"
-    ]
-)
-
-# Debug: Print the exact redirect URI being used
-if not IS_PRODUCTION:
-    print(f"DEBUG: Google OAuth redirect URI: {google_bp.redirect_url}")
-    print(f"DEBUG: Google OAuth redirect to: {google_bp.redirect_to}")
-app.register_blueprint(google_bp, url_prefix="/google_login")
-
-# Debug: Print the blueprint info (only in development)
-if not IS_PRODUCTION:
-    print(f"DEBUG: Google blueprint registered with prefix: {google_bp.url_prefix}")
-    print(f"DEBUG: Blueprint routes: {[str(rule) for rule in google_bp.deferred_functions]}")
-    print(f"DEBUG: App routes: {[str(rule) for rule in app.url_map.iter_rules()]}")
+# PID that started the background threads; they do not survive a fork
+_services_pid = None
 
 # Email whitelist check function
 def is_email_allowed(email):
@@ -106,394 +115,537 @@ def get_or_create_user(email, user_info=None):
     
     return user
 
-def create_user_session(user_id, session_token, request):
-    """Create a new user session record"""
-    session_record = UserSession(
-        user_id=user_id,
-        session_token=session_token,
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent', ''),
-        is_active=True
-    )
-    db.session.add(session_record)
-    db.session.commit()
-    return session_record
-
 # Route protection decorator
 def login_required(f):
     from functools import wraps
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Check if user is already authenticated via session
+        # google_logged_in sets these at login; the OAuth token itself is never kept
         if session.get("user_email") and session.get("user_id"):
             return f(*args, **kwargs)
-        
-        # If not authenticated via session, check Google OAuth
-        if not google.authorized:
-            return redirect(url_for("login"))
-        
-        try:
-            resp = google.get("/oauth2/v2/userinfo")
-            if not resp.ok:
-                # Token might be expired, redirect to login
-                return redirect(url_for("login"))
-            
-            email = resp.json().get("email", "")
-            if not is_email_allowed(email):
-                return redirect(url_for("login", error="unauthorized"))
-            
-            session["user_email"] = email
-            return f(*args, **kwargs)
-        except Exception as e:
-            # Handle token expiration and other OAuth errors
-            if not IS_PRODUCTION:
-                print(f"DEBUG: OAuth error in login_required: {e}")
-            return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
     return decorated_function
 
-@app.route("/protected")
+def teacher_required(f):
+    """Like login_required, but only for teachers and admins"""
+    from functools import wraps
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('role') not in ('teacher', 'admin'):
+            return jsonify({"error": "Unauthorized"}), 403
+        return f(*args, **kwargs)
+    return login_required(decorated_function)
+
+def rate_limited():
+    """A 429 response if the current user has used up their request allowance, else None"""
+    if user_requests.allow(session.get('user_id')):
+        return None
+    response = jsonify({"error": "Too many requests, please slow down"})
+    response.headers["Retry-After"] = str(user_requests.retry_after())
+    return response, 429
+
+@main.route("/protected")
 @login_required
 def protected():
     return f"Logged-in user: {session.get('user_email')}"
 
-@app.route('/')
+@main.route('/')
 @login_required
 def home():
-    if not IS_PRODUCTION:
-        print(f"DEBUG: User accessing home page, session: {session}")
-    return render_template('index.html')
+    log.debug("User accessing home page, session: %s", session)
+    # Topics come from prompt_templates.json, so a new topic needs no code change
+    return render_template('index.html', topics=prompts.topics)
 
-@app.route('/login')
+@main.route('/login')
 def login():
-    if os.environ.get('FLASK_ENV') != 'production':
-        print(f"DEBUG: User accessing login page, google.authorized: {google.authorized}")
-    
-    # Check if there's an error parameter
-    error = request.args.get('error')
+    log.debug("User accessing login page")
     
     # Check if user is already authenticated via session
     if session.get("user_email") and session.get("user_id"):
-        if os.environ.get('FLASK_ENV') != 'production':
-            print("DEBUG: User already authenticated via session, redirecting to home")
-        return redirect(url_for('home'))
-    
-    # Check Google OAuth
-    if google.authorized and not error:
-        if os.environ.get('FLASK_ENV') != 'production':
-            print("DEBUG: User is authorized via Google and no error, redirecting to home")
-        return redirect(url_for('home'))
+        log.debug("User already authenticated via session, redirecting to home")
+        return redirect(url_for('main.home'))
     
-    if os.environ.get('FLASK_ENV') != 'production':
-        print("DEBUG: User not authorized, showing login page")
+    log.debug("User not authorized, showing login page")
     
     # Debug: Show what the Google login URL will be
     google_login_url = url_for('google.login', _external=True)
-    if os.environ.get('FLASK_ENV') != 'production':
-        print(f"DEBUG: Google login URL will be: {google_login_url}")
+    log.debug("Google login URL will be: %s", google_login_url)
     
     return render_template('login.html')
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
-    # Close active session in database
-    if session.get('session_token'):
-        session_record = UserSession.query.filter_by(
-            session_token=session.get('session_token')
-        ).first()
-        if session_record:
-            session_record.logout_time = datetime.utcnow()
-            session_record.is_active = False
-            db.session.commit()
-    
-    # Clear session
+    # An emptied session closes its UserSession row and drops the cookie
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/test')
+@main.route('/test')
 def test():
     """Simple test route to check if the app is working"""
-    return "App is working! OAuth status: " + str(google.authorized)
+    return "App is working!"
 
-@app.route('/health')
+@main.route('/health')
 def health():
     """Health check route that doesn't require authentication"""
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
+        "question_pool": question_pool.stats(),
+        "llm_engine": engine.stats(),
+        "circuit_breaker": engine.policy.breaker.stats(),
+        "replay": replay.stats(engine.stats()),
+        "dedupe": seen_index.stats(),
+        "write_behind": writer.stats(),
+        "state_store": store.stats(),
+        "streaming": streaming_stats(),
+        "response_parser": parser_stats(),
+        "analytics_cache": analytics_stats(),
+        "grading": grading_stats(),
+        "adaptive": mastery.stats(),
+        "sessions": sessions.stats(),
+        "prompts": prompts.stats(),
         "session_data": {
             "has_user_email": bool(session.get("user_email")),
-            "has_user_id": bool(session.get("user_id")),
-            "google_authorized": google.authorized
+            "has_user_id": bool(session.get("user_id"))
         }
     })
 
-@app.route('/results')
+@main.route('/metrics')
+def metrics():
+    """Prometheus metrics for this worker"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/results')
 def results():
     """Results page for users to view their performance"""
-    print("DEBUG: Results route accessed")
+    log.debug("Results route accessed")
     return render_template('results.html')
 
-@app.route('/simple-results')
+@main.route('/simple-results')
 def simple_results():
     """Simple test results route"""
     return "Simple results route working!"
 
-# Flask-Dance will handle the OAuth callback automatically at /google_login/google/authorized
-# Add a post-login handler to check email and redirect appropriately
-@app.route('/google_login/google/authorized')
-def google_authorized():
-    """Handle post-OAuth login to check email and set session"""
-    if not google.authorized:
-        if os.environ.get('FLASK_ENV') != 'production':
-            print("DEBUG: OAuth not authorized in callback")
-        return redirect(url_for('login'))
+# Flask-Dance handles the OAuth callback at /google_login/google/authorized and then calls this
+def google_logged_in(blueprint, token):
+    """Check the Google account's email and set the session; the OAuth token is used once and never stored"""
+    if not token:
+        log.debug("OAuth not authorized in callback")
+        return redirect(url_for('main.login'))
     
-    if os.environ.get('FLASK_ENV') != 'production':
-        print("DEBUG: OAuth authorized, getting user info")
+    log.debug("OAuth authorized, getting user info")
     
     # Get user info
-    resp = google.get("/oauth2/v2/userinfo")
+    resp = blueprint.session.get("/oauth2/v2/userinfo")
     if not resp.ok:
-        if os.environ.get('FLASK_ENV') != 'production':
-            print(f"DEBUG: Failed to get user info: {resp.status_code}")
-        return redirect(url_for('login'))
+        log.debug("Failed to get user info: %s", resp.status_code)
+        return redirect(url_for('main.login'))
     
     user_info = resp.json()
     email = user_info.get("email", "")
-    if os.environ.get('FLASK_ENV') != 'production':
-        print(f"DEBUG: User email: {email}")
+    log.debug("User email: %s", email)
     
     # Check email whitelist
     if not is_email_allowed(email):
-        if os.environ.get('FLASK_ENV') != 'production':
-            print(f"DEBUG: Email not allowed: {email}")
-        return redirect(url_for('login', error="unauthorized"))
+        log.debug("Email not allowed: %s", email)
+        return redirect(url_for('main.login', error="unauthorized"))
     
-    if os.environ.get('FLASK_ENV') != 'production':
-        print(f"DEBUG: Email allowed, setting session for: {email}")
+    log.debug("Email allowed, setting session for: %s", email)
     
     # Create or get user record in database
     user = get_or_create_user(email, user_info)
     
-    # Create session record
-    session_token = str(uuid.uuid4())
-    create_user_session(user.id, session_token, request)
-    
-    # Store user info in session
+    # Store user info in session; setting user_id starts a UserSession under a new token
     session["user_email"] = email
-    session["user_info"] = user_info
     session["user_id"] = user.id
-    session["session_token"] = session_token
+    session["role"] = user.role
     
-    if os.environ.get('FLASK_ENV') != 'production':
-        print(f"DEBUG: Session set, redirecting to home. Session: {session}")
+    log.debug("Session set, redirecting to home. Session: %s", session)
     
-    return redirect(url_for('home'))
-
-@app.route('/api/generate', methods=['POST'])
+    # False stops Flask-Dance saving the token, so it never reaches the session tables
+    return False
+
+def seen_questions(data):
+    """Questions the current user has already seen"""
+    user_id = session.get('user_id')
+    if user_id:
+        return seen_index.for_user(user_id)
+    # Anonymous callers have no stored history, so fall back to the client's list
+    return set(data.get('previousQuestions', []))
+
+def requested_topic(data, user_id):
+    """Topic and difficulty from the request, or picked from the student's mastery in adaptive mode"""
+    if data.get('adaptive'):
+        topics = [t for t in data.get('topics') or [] if isinstance(t, str) and t][:MAX_ADAPTIVE_TOPICS]
+        if not topics:
+            raise ValueError("Adaptive mode needs a list of topics")
+        with timer("adaptive_select"):
+            return mastery.choose(user_id, topics)
+    return data.get('topic', 'mathematics'), data.get('difficulty', 'medium')
+
+def save_question(topic, difficulty, item, user_id=None):
+    """Queue a new question for QuestionHistory, giving item the id answers are graded against"""
+    row = question_history_row(topic, difficulty, item, user_id)
+    writer.enqueue(QuestionHistory, row)
+    # Grading must not depend on the write-behind batch having been committed
+    remember_question(row)
+
+@main.route('/api/generate', methods=['POST'])
+@login_required
 def generate():
+    limited = rate_limited()
+    if limited:
+        return limited
     try:
         data = request.json
-        topic = data.get('topic', 'mathematics')
-        difficulty = data.get('difficulty', 'medium')
-        previous_questions = data.get('previousQuestions', [])
+        user_id = session.get('user_id')
+        topic, difficulty = requested_topic(data, user_id)
+        with timer("seen_load"):
+            seen = seen_questions(data)
         key = f"{topic}|{difficulty}"
-        last_question = last_questions.get(key, "")
-
-        # Add prompt variety: random template and random tag
-        templates = [
-            "Generate ONE {difficulty} secondary-school mathematics question on '{topic}'. Provide EXACTLY 4 answer options.",
-            "Write a {difficulty} math question for secondary school about '{topic}' with 4 answer choices.",
-            "Create a single {difficulty} level math MCQ on '{topic}'. Give 4 options.",
-            "Formulate a {difficulty} secondary-school mathematics multiple-choice question on '{topic}' with 4 options."
-        ]
-        rand_tag = str(uuid.uuid4())[:8]
 
-        factorization_templates = [
-            "Write a {difficulty} math question for secondary school about factorization using identities (perfect square, difference of two squares), with 4 answer choices.",
-            "Create a single {difficulty} level math MCQ on factorization (identities: perfect square, difference of two squares). Give 4 options.",
-            "Formulate a {difficulty} secondary-school mathematics multiple-choice question on factorization using identities (perfect square, difference of two squares) with 4 options."
-        ]
-        # Add a special template for challenging level
-        if difficulty.lower() == "challenging":
-            factorization_templates.append(
-                "Generate a CHALLENGING secondary-school mathematics question on factorization using identities (perfect square, difference of two squares). Provide EXACTLY 4 answer options. The question should be similar in style to: Factorize the expression 4x^2 + 4x + 1 - y^2."
-            )
-            factorization_templates.append(
-                "Write a challenging factorization question for secondary school using identities (perfect square, difference of two squares). Provide 4 answer choices. The question should be similar in style to: Factorize the expression: y^2 - x^2 - 2x - 1."
-            )
-
-        # Templates for factorization using cross method
-        cross_method_templates = [
-            "Generate ONE {difficulty} secondary-school mathematics question on factorization using the cross method. Provide EXACTLY 4 answer options.",
-            "Write a {difficulty} math question for secondary school about factorization using the cross method, with 4 answer choices.",
-            "Create a single {difficulty} level math MCQ on factorization using the cross method. Give 4 options.",
-            "Formulate a {difficulty} secondary-school mathematics multiple-choice question on factorization using the cross method with 4 options."
-        ]
-        if difficulty.lower() == "challenging":
-            cross_method_templates.append(
-                "Write a challenging factorization question for secondary school using the cross method. Provide 4 answer choices. The question should be similar in style to: Factorize the expression: 6x^2 + 11x + 3."
-            )
-
-        # Templates for positive integral indices
-        indices_templates = [
-            "Generate ONE {difficulty} secondary-school mathematics question on positive integral indices. Provide EXACTLY 4 answer options.",
-            "Write a {difficulty} math question for secondary school about positive integral indices, with 4 answer choices.",
-            "Create a single {difficulty} level math MCQ on positive integral indices. Give 4 options.",
-            "Formulate a {difficulty} secondary-school mathematics multiple-choice question on positive integral indices with 4 options."
-        ]
-        if difficulty.lower() == "challenging":
-            indices_templates.append(
-                "Write a challenging question for secondary school on positive integral indices. Provide 4 answer choices. The question should be similar in style to: Simplify (x^3 * y^2)^4 / (x^2 * y)^3."
-            )
-
-        # Select template set based on topic
-        if "factorization using cross method" in topic.lower():
-            template = random.choice(cross_method_templates)
-            user_content = template.format(difficulty=difficulty)
-            if previous_questions:
-                user_content += " Do NOT repeat any of these questions: " + "; ".join(f'\"{q}\"' for q in previous_questions)
-            user_content += f" Tag: {rand_tag}."
-        elif "positive integral indices" in topic.lower():
-            template = random.choice(indices_templates)
-            user_content = template.format(difficulty=difficulty)
-            if previous_questions:
-                user_content += " Do NOT repeat any of these questions: " + "; ".join(f'\"{q}\"' for q in previous_questions)
-            user_content += f" Tag: {rand_tag}."
-        elif "factorization" in topic.lower():
-            template = random.choice(factorization_templates)
-            user_content = template.format(difficulty=difficulty)
-            if previous_questions:
-                user_content += " Do NOT repeat any of these questions: " + "; ".join(f'\"{q}\"' for q in previous_questions)
-            user_content += f" Tag: {rand_tag}."
+        if local_topic(topic):
+            # Algorithmic topics are built locally; the LLM only handles free-form topics
+            seed = data.get('seed')
+            with timer("local_question"):
+                for _ in range(MAX_LOCAL_ATTEMPTS):
+                    item = generate_local_question(topic, difficulty, seed)
+                    if seed is not None or item["question"] not in seen:
+                        break
+            with timer("history_enqueue"):
+                save_question(topic, difficulty, item, user_id)
         else:
-            template = random.choice(templates)
-            user_content = template.format(difficulty=difficulty, topic=topic)
-            if previous_questions:
-                user_content += " Do NOT repeat any of these questions: " + "; ".join(f'\"{q}\"' for q in previous_questions)
-            user_content += f" Tag: {rand_tag}."
-
-        # print("System prompt:", system_prompt)
-        print("User prompt:", user_content)
-
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a strict generator of multiple-choice questions. "
-                    "Return your answer as a JSON object with keys: question, options (array of 4), and correct_answer (the correct option string)."
-                )
-            },
-            {
-                "role": "user",
-                "content": user_content
-            }
-        ]
-
-        client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            temperature=0.2,
-            max_tokens=800
-        )
-
-        choice = response.choices[0]
-        content = choice.message.content
-
-        print("AI raw content:", content)
-
-        # Extract JSON from markdown code block if present
-        match = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', content)
-        if not match:
-            match = re.search(r'```\s*(\{[\s\S]*?\})\s*```', content)
-        if match:
-            json_str = match.group(1)
-        else:
-            # Try to find the first JSON object in the string
-            match = re.search(r'(\{[\s\S]*\})', content)
-            if match:
-                json_str = match.group(1)
-            else:
-                json_str = content.strip()
-
-        # Escape all unescaped backslashes (e.g., in LaTeX) to make valid JSON
-        json_str = re.sub(r'(?<!\\)\\(?![\\"/bfnrtu])', r'\\\\', json_str)
-
-        # No need to escape backslashes or quotes now, just parse
-        args = json.loads(json_str)
-
-        question = args["question"]
-        options = args["options"]
-        correct_answer = args["correct_answer"]
-
-        # Shuffle options and update correctIndex
-        combined = list(zip(options, range(len(options))))
-        random.shuffle(combined)
-        shuffled_options = [opt for opt, _ in combined]
-        correctIndex = shuffled_options.index(correct_answer)
-        options = shuffled_options
+            # Archived questions this user has not seen come first; the LLM is the last resort
+            with timer("replay"):
+                item = replay.take(topic, difficulty, seen)
+            if item is None and POOL_ENABLED:
+                with timer("pool_take"):
+                    item = question_pool.take(topic, difficulty, exclude=seen)
+                if item is not None:
+                    replay.add(topic, difficulty, item)
+            if item is None:
+                started = time.perf_counter()
+                try:
+                    check_llm_allowed(user_id, topic)
+                    # Duplicates and unparseable output are retried here instead of by the client
+                    for attempt in range(1 + MAX_DUPLICATE_RETRIES):
+                        try:
+                            item = generate_question(topic, difficulty, user_id)
+                        except ParseError:
+                            if attempt == MAX_DUPLICATE_RETRIES:
+                                raise
+                            continue
+                        if item["question"] not in seen:
+                            break
+                    replay.record_fresh(topic, time.perf_counter() - started)
+                    # Saved before replay can hand it out, so every served copy has its id
+                    with timer("history_enqueue"):
+                        save_question(topic, difficulty, item, user_id)
+                    replay.add(topic, difficulty, item)
+                except LLMUnavailable:
+                    # The provider is down, too slow or over budget; serve a stored question instead
+                    item = archived_question(topic, difficulty, exclude=seen)
+                    if item is None:
+                        raise
+
+        question = item["question"]
+        with timer("seen_add"):
+            seen.add(question)
+
+        # The key stays on the server; answers are graded by /api/submit_answer
+        options, _ = shuffle_options(item["options"], item["correct_answer"])
 
         # Save the last question for this topic/difficulty
-        last_questions[key] = question
-
-        # Save question to history
-        question_history = QuestionHistory(
-            topic=topic,
-            difficulty=difficulty,
-            question_text=question,
-            options=options,
-            correct_answer=correct_answer,
-            generated_by_user_id=session.get('user_id')
-        )
-        db.session.add(question_history)
-        db.session.commit()
-        
+        with timer("store_last_question"):
+            store.set(f"last_question:{key}", question, ttl=LAST_QUESTION_TTL)
+
         return jsonify({
+            "questionId": item["id"],
             "question": question,
             "options": options,
-            "correctIndex": correctIndex
+            "topic": topic,
+            "difficulty": difficulty
         })
+    except BudgetExhausted as e:
+        return jsonify({"error": str(e)}), 429
+    except (EngineBusy, LLMUnavailable) as e:
+        return jsonify({"error": str(e)}), 503
+    except ParseError as e:
+        errors_total.inc(where="generate")
+        return jsonify({"error": str(e)}), 502
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(e)
+        log.exception("Error generating question: %s", e)
+        errors_total.inc(where="generate")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/submit_answer', methods=['POST'])
+def sse(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def streaming_stats():
+    """Return average time-to-first-content and total latency of streamed questions"""
+    with stream_stats_lock:
+        stats = dict(stream_stats)
+    count = stats["streams"]
+    stats["first_content_seconds_avg"] = stats["first_content_seconds_total"] / count if count else 0.0
+    stats["total_seconds_avg"] = stats["total_seconds_total"] / count if count else 0.0
+    return stats
+
+@main.route('/api/generate_stream', methods=['POST'])
 @login_required
-def submit_answer():
-    """Record user's answer and performance"""
+def generate_stream():
+    """Stream a question as Server-Sent Events: the stem first, then the validated options"""
+    limited = rate_limited()
+    if limited:
+        return limited
+    data = request.json
+    user_id = session.get('user_id')
+    try:
+        topic, difficulty = requested_topic(data, user_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    seen = seen_questions(data)
+    started = time.perf_counter()
+
+    def ready_item():
+        """A question that needs no LLM call, or None"""
+        if local_topic(topic):
+            for _ in range(MAX_LOCAL_ATTEMPTS):
+                item = generate_local_question(topic, difficulty)
+                if item["question"] not in seen:
+                    break
+            save_question(topic, difficulty, item, user_id)
+            return item
+        item = replay.take(topic, difficulty, seen)
+        if item is None and POOL_ENABLED:
+            item = question_pool.take(topic, difficulty, exclude=seen)
+            if item is not None:
+                replay.add(topic, difficulty, item)
+        return item
+
+    def events():
+        first_content = None
+        try:
+            item = ready_item()
+            if item is not None:
+                first_content = time.perf_counter() - started
+                yield sse("question", {"question": item["question"], "topic": topic, "difficulty": difficulty})
+            else:
+                try:
+                    check_llm_allowed(user_id, topic)
+                    # Duplicates and unparseable output are retried here, as in /api/generate
+                    for attempt in range(1 + MAX_DUPLICATE_RETRIES):
+                        item = None
+                        stem_sent = False
+                        try:
+                            with closing(generate_question_stream(topic, difficulty, user_id)) as parts:
+                                for kind, value in parts:
+                                    if kind == "options":
+                                        item = value
+                                    elif value in seen and attempt < MAX_DUPLICATE_RETRIES:
+                                        # Dropped before the student sees it; closing stops the upstream call
+                                        break
+                                    else:
+                                        stem_sent = True
+                                        first_content = first_content or time.perf_counter() - started
+                                        yield sse("question", {"question": value, "topic": topic, "difficulty": difficulty})
+                        except ParseError:
+                            if attempt == MAX_DUPLICATE_RETRIES:
+                                raise
+                            if stem_sent:
+                                yield sse("retry", {})
+                            continue
+                        if item is not None:
+                            break
+                    replay.record_fresh(topic, time.perf_counter() - started)
+                    save_question(topic, difficulty, item, user_id)
+                    replay.add(topic, difficulty, item)
+                except LLMUnavailable:
+                    item = archived_question(topic, difficulty, exclude=seen)
+                    if item is None or first_content is not None:
+                        raise
+                    first_content = time.perf_counter() - started
+                    yield sse("question", {"question": item["question"], "topic": topic, "difficulty": difficulty})
+
+            seen.add(item["question"])
+            store.set(f"last_question:{topic}|{difficulty}", item["question"], ttl=LAST_QUESTION_TTL)
+            options, _ = shuffle_options(item["options"], item["correct_answer"])
+            yield sse("options", {"questionId": item["id"], "options": options})
+
+            total = time.perf_counter() - started
+            with stream_stats_lock:
+                stream_stats["streams"] += 1
+                stream_stats["first_content_seconds_total"] += first_content
+                stream_stats["total_seconds_total"] += total
+            yield sse("done", {"firstContentMs": round(first_content * 1000), "totalMs": round(total * 1000)})
+        except Exception as e:
+            log.warning("Error streaming question: %s", e)
+            errors_total.inc(where="generate_stream")
+            with stream_stats_lock:
+                stream_stats["errors"] += 1
+            yield sse("error", {
+                "error": str(e),
+                "busy": isinstance(e, (EngineBusy, LLMUnavailable)),
+                "limited": isinstance(e, BudgetExhausted)
+            })
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@main.route('/api/generate_batch', methods=['POST'])
+@login_required
+def generate_batch():
+    """Generate several questions for a topic/difficulty in one request"""
+    limited = rate_limited()
+    if limited:
+        return limited
     try:
         data = request.json
-        topic = data.get('topic')
-        difficulty = data.get('difficulty')
-        question_text = data.get('question')
+        topic = data.get('topic', 'mathematics')
+        difficulty = data.get('difficulty', 'medium')
+        count = max(1, min(int(data.get('count', 5)), MAX_BATCH_SIZE))
+        user_id = session.get('user_id')
+        seen = seen_questions(data)
+
+        items = []
+        new_items = []
+        seed = data.get('seed')
+        if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+            raise ValueError("seed must be an integer")
+        if local_topic(topic):
+            for attempt in range(count * MAX_LOCAL_ATTEMPTS):
+                if len(new_items) == count:
+                    break
+                item = generate_local_question(topic, difficulty, None if seed is None else seed + attempt)
+                if item["question"] not in seen:
+                    seen.add(item["question"])
+                    save_question(topic, difficulty, item, user_id)
+                    new_items.append(item)
+        else:
+            while len(items) < count:
+                item = replay.take(topic, difficulty, seen)
+                if item is None and POOL_ENABLED:
+                    item = question_pool.take(topic, difficulty, exclude=seen)
+                    if item is not None:
+                        replay.add(topic, difficulty, item)
+                if item is None:
+                    break
+                seen.add(item["question"])
+                items.append(item)
+
+            if len(items) < count:
+                started = time.perf_counter()
+                try:
+                    check_llm_allowed(user_id, topic)
+                    for item in generate_question_batch(topic, difficulty, count - len(items), user_id):
+                        if item["question"] not in seen:
+                            seen.add(item["question"])
+                            save_question(topic, difficulty, item, user_id)
+                            replay.add(topic, difficulty, item)
+                            new_items.append(item)
+                    replay.record_fresh(topic, time.perf_counter() - started)
+                except LLMUnavailable:
+                    # The provider is down, too slow or over budget; fill up with stored questions instead
+                    while len(items) + len(new_items) < count:
+                        item = archived_question(topic, difficulty, exclude=seen)
+                        if item is None or item["question"] in seen:
+                            break
+                        seen.add(item["question"])
+                        items.append(item)
+                    # Only an empty batch is an error
+                    if not items and not new_items:
+                        raise
+                except ParseError:
+                    # Unusable LLM output; the questions already found are still worth returning
+                    errors_total.inc(where="generate_batch")
+                    if not items and not new_items:
+                        raise
+
+        # New questions were queued for history as they arrived; the writer batches them into one transaction
+        items.extend(new_items)
+
+        questions = []
+        for item in items:
+            options, _ = shuffle_options(item["options"], item["correct_answer"])
+            questions.append({
+                "questionId": item["id"],
+                "question": item["question"],
+                "options": options
+            })
+
+        return jsonify({"questions": questions})
+    except BudgetExhausted as e:
+        return jsonify({"error": str(e)}), 429
+    except (EngineBusy, LLMUnavailable) as e:
+        return jsonify({"error": str(e)}), 503
+    except ParseError as e:
+        return jsonify({"error": str(e)}), 502
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception("Error generating batch: %s", e)
+        errors_total.inc(where="generate_batch")
+        return jsonify({"error": str(e)}), 500
+
+@main.route('/api/submit_answer', methods=['POST'])
+@login_required
+def submit_answer():
+    """Grade the user's answer against the served question and record their performance"""
+    try:
+        data = request.json or {}
+        question_id = data.get('questionId')
         user_answer = data.get('userAnswer')
-        correct_answer = data.get('correctAnswer')
-        is_correct = data.get('isCorrect', False)
         time_taken = data.get('timeTaken')  # Time in seconds
+        if not question_id or user_answer is None:
+            return jsonify({"error": "questionId and userAnswer are required"}), 400
+        if not isinstance(user_answer, str):
+            return jsonify({"error": "userAnswer must be the text of an option"}), 400
+        if time_taken is not None and (
+            isinstance(time_taken, bool) or not isinstance(time_taken, (int, float))
+            or not math.isfinite(time_taken) or time_taken < 0
+        ):
+            return jsonify({"error": "timeTaken must be a number of seconds"}), 400
+
+        # The stored key decides, not the client
+        with timer("grade"):
+            question = load_question(question_id)
+            if question is None:
+                return jsonify({"error": "Unknown question"}), 404
+            is_correct = grade(question, user_answer)
+        # Adaptive mode picks the next topic from this, so it is updated before the response
+        with timer("mastery_update"):
+            mastery.record(session.get('user_id'), question["topic"], question["difficulty"], is_correct)
         
-        # Create performance record
-        performance = Performance(
-            user_id=session.get('user_id'),
-            topic=topic,
-            difficulty=difficulty,
-            question_text=question_text,
-            user_answer=user_answer,
-            correct_answer=correct_answer,
-            is_correct=is_correct,
-            time_taken=time_taken
-        )
-        
-        db.session.add(performance)
-        db.session.commit()
+        # Queue the performance record; its aggregate is updated when the batch is written
+        with timer("performance_enqueue"):
+            writer.enqueue(Performance, {
+                "id": str(uuid.uuid4()),
+                "user_id": session.get('user_id'),
+                "topic": question["topic"],
+                "difficulty": question["difficulty"],
+                "question_text": question["question_text"],
+                "user_answer": str(user_answer),
+                "correct_answer": question["correct_answer"],
+                "is_correct": is_correct,
+                "time_taken": time_taken,
+                "attempt_number": 1,
+                "question_id": question_id,
+                "created_at": datetime.utcnow()
+            })
         
-        return jsonify({"success": True, "message": "Answer recorded"})
+        return jsonify({"success": True, "isCorrect": is_correct, "correctAnswer": question["correct_answer"]})
         
     except Exception as e:
-        print(f"Error recording answer: {e}")
+        log.exception("Error recording answer: %s", e)
+        errors_total.inc(where="submit_answer")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/performance/<user_id>')
+@main.route('/api/performance/<user_id>')
 @login_required
 def get_user_performance(user_id):
     """Get performance statistics for a user"""
@@ -502,48 +654,188 @@ def get_user_performance(user_id):
         if session.get('user_id') != user_id and session.get('role') != 'teacher':
             return jsonify({"error": "Unauthorized"}), 403
         
-        performances = Performance.query.filter_by(user_id=user_id).all()
-        
-        # Calculate statistics
-        total_questions = len(performances)
-        correct_answers = len([p for p in performances if p.is_correct])
-        accuracy = (correct_answers / total_questions * 100) if total_questions > 0 else 0
+        # Totals come from the aggregates, so the cost does not grow with history
+        with timer("aggregate_query"):
+            aggregates = PerformanceAggregate.query.filter_by(user_id=user_id).all()
+        with timer("aggregate_summarize"):
+            overall, topic_stats = summarize(aggregates)
         
-        # Group by topic
-        topic_stats = {}
-        for p in performances:
-            if p.topic not in topic_stats:
-                topic_stats[p.topic] = {'total': 0, 'correct': 0}
-            topic_stats[p.topic]['total'] += 1
-            if p.is_correct:
-                topic_stats[p.topic]['correct'] += 1
-        
-        # Calculate topic accuracy
-        for topic in topic_stats:
-            topic_stats[topic]['accuracy'] = (
-                topic_stats[topic]['correct'] / topic_stats[topic]['total'] * 100
-            )
+        with timer("recent_query"):
+            recent = Performance.query.filter_by(user_id=user_id).order_by(
+                Performance.created_at.desc()
+            ).limit(10).all()
         
         return jsonify({
-            "total_questions": total_questions,
-            "correct_answers": correct_answers,
-            "accuracy": round(accuracy, 2),
+            "total_questions": overall["total"],
+            "correct_answers": overall["correct"],
+            "accuracy": round(overall["accuracy"], 2),
+            "average_time": round(overall["average_time"], 2),
             "topic_stats": topic_stats,
             "recent_performances": [
                 {
                     "topic": p.topic,
                     "difficulty": p.difficulty,
+                    "question_text": p.question_text,
                     "is_correct": p.is_correct,
                     "time_taken": p.time_taken,
                     "created_at": p.created_at.isoformat()
                 }
-                for p in performances[-10:]  # Last 10 attempts
+                for p in recent  # Last 10 attempts, newest first
             ]
         })
         
     except Exception as e:
-        print(f"Error getting performance: {e}")
+        log.exception("Error getting performance: %s", e)
+        errors_total.inc(where="get_user_performance")
         return jsonify({"error": str(e)}), 500
 
+def history_filters():
+    """Topic, difficulty and date filters, cursor and page size from the query string"""
+    return {
+        "topic": request.args.get('topic') or None,
+        "difficulty": request.args.get('difficulty') or None,
+        "since": parse_date(request.args.get('since')),
+        "until": parse_date(request.args.get('until')),
+        "cursor": request.args.get('cursor') or None,
+        "limit": page_size(request.args.get('limit'))
+    }
+
+@main.route('/api/history/attempts')
+@login_required
+def attempt_history():
+    """A page of the current user's answers, newest first; teachers may pass user_id"""
+    try:
+        user_id = request.args.get('user_id') or session.get('user_id')
+        if user_id != session.get('user_id') and session.get('role') not in ('teacher', 'admin'):
+            return jsonify({"error": "Unauthorized"}), 403
+        return jsonify(attempts_page(user_id, **history_filters()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception("Error getting attempt history: %s", e)
+        errors_total.inc(where="attempt_history")
+        return jsonify({"error": str(e)}), 500
+
+@main.route('/api/history/questions')
+@teacher_required
+def question_archive():
+    """A page of generated questions, newest first"""
+    try:
+        return jsonify(questions_page(**history_filters()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception("Error getting question archive: %s", e)
+        errors_total.inc(where="question_archive")
+        return jsonify({"error": str(e)}), 500
+
+@main.route('/api/analytics')
+@teacher_required
+def class_analytics():
+    """Class-wide accuracy, median times, question difficulty and trends"""
+    try:
+        return jsonify(analytics_report(
+            topic=request.args.get('topic') or None,
+            difficulty=request.args.get('difficulty') or None,
+            since=parse_date(request.args.get('since')),
+            until=parse_date(request.args.get('until')),
+            bucket=request.args.get('bucket', 'day'),
+            min_attempts=max(1, int(request.args.get('min_attempts', ANALYTICS_MIN_ATTEMPTS)))
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception("Error computing analytics: %s", e)
+        errors_total.inc(where="class_analytics")
+        return jsonify({"error": str(e)}), 500
+
+@main.route('/admin/spend')
+@teacher_required
+def admin_spend():
+    """LLM spend per day, student and topic"""
+    return render_template('admin_spend.html')
+
+@main.route('/api/admin/spend')
+@teacher_required
+def get_spend():
+    """LLM spend over the last N days as JSON"""
+    try:
+        days = max(1, min(int(request.args.get('days', 7)), 90))
+        return jsonify(spend_report(days))
+    except Exception as e:
+        log.exception("Error getting spend: %s", e)
+        errors_total.inc(where="get_spend")
+        return jsonify({"error": str(e)}), 500
+
+def start_background_services(app):
+    """Start the per-process writer, pool and LLM threads (again after a fork)"""
+    global _services_pid
+    if _services_pid == os.getpid():
+        return
+    _services_pid = os.getpid()
+
+    start_logging()
+    # Batched inserts for Performance and QuestionHistory
+    writer.start(app)
+    # Writes back last-seen times and expires idle sessions
+    sessions.start(app)
+    if POOL_ENABLED:
+        question_pool.start(app)
+    engine.start()
+
+def create_app():
+    """Build and configure the Flask application"""
+    app = Flask(__name__)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    # The schema is created by init_db.py or `flask db upgrade`, not on every start;
+    # the web server only needs Flask-Migrate when the flask CLI is running a db command
+    init_database(app, migrations=os.environ.get("FLASK_RUN_FROM_CLI") == "true")
+
+    # Debug: Log credentials (only with LOG_LEVEL=DEBUG)
+    log.debug("GOOGLE_CLIENT_ID: %s", GOOGLE_CLIENT_ID)
+    log.debug("GOOGLE_CLIENT_SECRET: %s", f"{GOOGLE_CLIENT_SECRET[:10]}..." if GOOGLE_CLIENT_SECRET else None)
+    log.debug("SESSION_SECRET: %s", f"{SESSION_SECRET[:10]}..." if SESSION_SECRET else None)
+
+    app.secret_key = SESSION_SECRET or "your-secret-key-change-this-in-production"
+    # The session cookie only carries an opaque token; the data is kept server-side
+    app.session_interface = ServerSessionInterface()
+
+    # Configure OAuth environment variables (like Google example)
+    if app.debug:
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
+
+    from flask_dance.consumer import oauth_authorized
+    from flask_dance.contrib.google import make_google_blueprint
+
+    google_bp = make_google_blueprint(
+        client_id=GOOGLE_CLIENT_ID,
+        client_secret=GOOGLE_CLIENT_SECRET,
+        scope=[
+            "openid",
+            "https://www.googleapis.com/auth/userinfo.email",
+            "https://www.googleapis.com/auth/userinfo.profile"
+        ]
+    )
+
+    # Debug: Log the exact redirect URI being used
+    log.debug("Google OAuth redirect URI: %s", google_bp.redirect_url)
+    log.debug("Google OAuth redirect to: %s", google_bp.redirect_to)
+    oauth_authorized.connect_via(google_bp)(google_logged_in)
+    app.register_blueprint(google_bp, url_prefix="/google_login")
+    app.register_blueprint(main)
+    init_instrumentation(app)
+
+    # Debug: Log the blueprint info
+    log.debug("Google blueprint registered with prefix: %s", google_bp.url_prefix)
+    log.debug("Blueprint routes: %s", [str(rule) for rule in google_bp.deferred_functions])
+    log.debug("App routes: %s", [str(rule) for rule in app.url_map.iter_rules()])
+
+    # Threads are started on the first request so each server worker gets its own
+    app.before_request(lambda: start_background_services(app))
+
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=False, host="0.0.0.0", port=int(os.environ.get("PORT", 8000))) 
+    create_app().run(debug=False, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)), threaded=True) 
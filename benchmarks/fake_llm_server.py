@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Fake LLM provider for Maths Generator App benchmarks
+Serves OpenAI-compatible /chat/completions (plain and streamed) with configurable
+latency, jitter, error rate and malformed-JSON rate, so benchmarks run offline
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PROMPT_TOKENS = 60
+COMPLETION_TOKENS_PER_QUESTION = 45
+STREAM_CHUNK_CHARS = 8
+
+def make_question():
+    """A valid question with a unique stem, so dedupe does not reject it"""
+    a, b = random.randint(2, 10**6), random.randint(2, 99)
+    answer = a + b
+    options = [str(answer), str(answer + 1), str(answer - 1), str(answer + 10)]
+    return {"question": f"What is ${a} + {b}$?", "options": options, "correct_answer": str(answer)}
+
+class FakeLLM:
+    """Behaviour and counters shared by every request handler"""
+
+    def __init__(self, latency=0.3, jitter=0.1, error_rate=0.0, malformed_rate=0.0, chunk_delay=0.01):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.chunk_delay = chunk_delay
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "streams": 0, "errors": 0, "malformed": 0}
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def delay(self):
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def content(self, messages):
+        """The completion text for a request: one question, a batch, or broken JSON"""
+        user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        batch = re.match(r"Generate (\d+) different", user)
+        if batch:
+            questions = [make_question() for _ in range(int(batch.group(1)))]
+            body = json.dumps({"questions": questions})
+        else:
+            questions = [make_question()]
+            body = json.dumps(questions[0])
+
+        if random.random() < self.malformed_rate:
+            self.count("malformed")
+            # Truncated output, as when a completion hits max_tokens
+            body = body[:len(body) // 2]
+        return body, len(questions)
+
+def make_handler(llm):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_json(200, llm.stats())
+            else:
+                self.send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "not found"}})
+                return
+
+            llm.count("requests")
+            llm.delay()
+            if random.random() < llm.error_rate:
+                llm.count("errors")
+                self.send_json(503, {"error": {"message": "fake upstream overloaded", "type": "server_error"}})
+                return
+
+            content, questions = llm.content(request.get("messages", []))
+            usage = {
+                "prompt_tokens": PROMPT_TOKENS,
+                "completion_tokens": COMPLETION_TOKENS_PER_QUESTION * questions,
+                "total_tokens": PROMPT_TOKENS + COMPLETION_TOKENS_PER_QUESTION * questions
+            }
+            if request.get("stream"):
+                self.stream(content, usage, request.get("stream_options", {}).get("include_usage"))
+                return
+
+            self.send_json(200, {
+                "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": usage
+            })
+
+        def stream(self, content, usage, include_usage):
+            llm.count("streams")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def event(choices, **extra):
+                chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                         "choices": choices, **extra}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+            for start in range(0, len(content), STREAM_CHUNK_CHARS):
+                event([{"index": 0, "delta": {"content": content[start:start + STREAM_CHUNK_CHARS]},
+                        "finish_reason": None}])
+                time.sleep(llm.chunk_delay)
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                event([], usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+def start(port=0, **options):
+    """Serve in a daemon thread; return the server and its FakeLLM (server.server_port is the bound port)"""
+    llm = FakeLLM(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(llm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, llm
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=18555)
+    parser.add_argument("--latency", type=float, default=0.3, help="mean seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of completions cut off mid-JSON")
+    args = parser.parse_args()
+
+    server, _ = start(args.port, latency=args.latency, jitter=args.jitter,
+                      error_rate=args.error_rate, malformed_rate=args.malformed_rate)
+    print(f"Fake LLM listening on http://127.0.0.1:{server.server_port}", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
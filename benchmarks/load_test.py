@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Load test for Maths Generator App
+Starts gunicorn with different worker counts and reports requests/sec and
+latency percentiles for /, /api/submit_answer and /api/performance
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.request import urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+SESSION_SECRET = "load-test-secret"
+BENCH_EMAIL = "loadtest@school.cdgfss.edu.hk"
+BENCH_QUESTIONS = 20
+
+def prepare_database(database_url):
+    """Create the schema, a test user and questions to answer; return the user id, a session cookie and question ids"""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["SESSION_SECRET"] = SESSION_SECRET
+    from database import create_db_app, upgrade_schema
+    from models import db, User, QuestionHistory
+    from server_sessions import sessions
+
+    with create_db_app().app_context():
+        upgrade_schema()
+        user = User.query.filter_by(email=BENCH_EMAIL).first()
+        if user is None:
+            user = User(email=BENCH_EMAIL, first_name="Load", last_name="Test")
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+
+        # Answers are graded against stored questions, so submits need real ids
+        questions = [
+            QuestionHistory(topic="Quadratics", difficulty="easy", question_text=f"Load test question {n}",
+                            options=["1", "2", "3", "4"], correct_answer="1")
+            for n in range(BENCH_QUESTIONS)
+        ]
+        db.session.add_all(questions)
+        db.session.commit()
+        question_ids = [q.id for q in questions]
+
+        # The session cookie is the token of a server-side session
+        cookie = sessions.create(user_id, {"user_id": user_id, "user_email": BENCH_EMAIL, "role": "student"})
+    return user_id, cookie, question_ids
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def start_server(port, workers, threads, database_url, extra_env=None):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "GUNICORN_THREADS": str(threads),
+        "GUNICORN_ACCESS_LOG": "",
+        "DATABASE_URL": database_url,
+        "SESSION_SECRET": SESSION_SECRET,
+        "QUESTION_POOL_ENABLED": "0",
+        "FLASK_ENV": "production",
+    })
+    env.update(extra_env or {})
+    server = subprocess.Popen(
+        ["gunicorn", "app:create_app()", "-c", "gunicorn.conf.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urlopen(f"http://127.0.0.1:{port}/test", timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start")
+
+def drive(port, cookie, user_id, question_ids, concurrency, duration):
+    """Hit each endpoint from concurrency threads for duration seconds"""
+    headers = {"Cookie": f"session={cookie}", "Content-Type": "application/json"}
+    answer = json.dumps({"questionId": question_ids[0], "userAnswer": "1", "timeTaken": 12.5})
+    requests = [
+        ("/", "GET", "/", None),
+        ("/api/submit_answer", "POST", "/api/submit_answer", answer),
+        ("/api/performance", "GET", f"/api/performance/{user_id}", None),
+    ]
+    results = {name: {"latencies": [], "errors": 0} for name, _, _, _ in requests}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(offset):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        i = offset
+        while time.monotonic() < stop_at:
+            name, method, path, body = requests[i % len(requests)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if ok:
+                    results[name]["latencies"].append(elapsed)
+                else:
+                    results[name]["errors"] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return {
+        name: {
+            "requests": len(r["latencies"]),
+            "errors": r["errors"],
+            "rps": round(len(r["latencies"]) / duration, 1),
+            "p50_ms": round(percentile(r["latencies"], 50), 2),
+            "p95_ms": round(percentile(r["latencies"], 95), 2),
+            "p99_ms": round(percentile(r["latencies"], 99), 2),
+        }
+        for name, r in results.items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--threads", type=int, default=8, help="threads per worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per worker count")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--database-url", default=f"sqlite:///{os.path.join(ROOT, 'bench_load.db')}")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    user_id, cookie, question_ids = prepare_database(args.database_url)
+
+    report = {}
+    for workers in [int(n) for n in args.workers.split(",")]:
+        print(f"🚀 {workers} worker(s) x {args.threads} threads, {args.concurrency} clients...", file=sys.stderr)
+        server = start_server(args.port, workers, args.threads, args.database_url)
+        try:
+            report[workers] = drive(args.port, cookie, user_id, question_ids, args.concurrency, args.duration)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for workers, endpoints in report.items():
+        print(f"\n📊 {workers} worker(s)")
+        for name, r in endpoints.items():
+            print(f"   {name:20} {r['rps']:8.1f} req/s   p50 {r['p50_ms']:7.2f} ms   "
+                  f"p95 {r['p95_ms']:7.2f} ms   p99 {r['p99_ms']:7.2f} ms   errors {r['errors']}")
+
+if __name__ == "__main__":
+    main()
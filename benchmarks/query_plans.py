@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Query plan benchmark for Maths Generator App
+Seeds a scratch database, then reports query plans and p50/p95 latency
+for the hot queries with and without the indexes declared in models.py
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+# Add the app directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, insert
+from models import db, User, UserSession, Performance, QuestionHistory
+
+TOPICS = [
+    "Simultaneous Equations", "Quadratics", "Trigonometry", "Probability",
+    "Linear Equations in One Unknown",
+    "Factorization using identities (perfect square, difference of two squares)",
+    "Factorization using cross method", "Positive integral indices",
+]
+DIFFICULTIES = ["easy", "medium", "challenging"]
+BATCH_SIZE = 10000
+
+# Hot queries from app.py, dedupe.py, question_pool.py and manage_db.py
+QUERIES = {
+    "recent_attempts_for_user": (
+        "SELECT * FROM performances WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 10"
+    ),
+    "seen_questions_for_user": (
+        "SELECT question_text FROM performances WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 2000"
+    ),
+    "generated_questions_for_user": (
+        "SELECT question_text FROM question_history WHERE generated_by_user_id = :user_id "
+        "ORDER BY generated_at DESC LIMIT 2000"
+    ),
+    "pool_seed_for_topic": (
+        "SELECT * FROM question_history WHERE topic = :topic AND difficulty = :difficulty "
+        "ORDER BY generated_at DESC LIMIT 5"
+    ),
+    "recent_attempts_all": "SELECT * FROM performances ORDER BY created_at DESC LIMIT 10",
+    "recent_questions_all": "SELECT * FROM question_history ORDER BY generated_at DESC LIMIT 20",
+    "recent_sessions": "SELECT * FROM user_sessions ORDER BY login_time DESC LIMIT 20",
+    "sessions_for_user": "SELECT * FROM user_sessions WHERE user_id = :user_id",
+}
+
+def bench_indexes():
+    """Indexes declared in __table_args__, i.e. the ones added by migrations"""
+    return [
+        index
+        for table in db.metadata.sorted_tables
+        for index in table.indexes
+        if index.name != "ix_users_email"
+    ]
+
+def seed(engine, rows, users):
+    """Fill the scratch database with a realistic spread of rows"""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": uid, "email": f"student{i}@school.cdgfss.edu.hk", "role": "student"}
+            for i, uid in enumerate(user_ids)
+        ])
+        conn.execute(insert(UserSession), [
+            {
+                "id": str(uuid.uuid4()), "user_id": rng.choice(user_ids),
+                "session_token": str(uuid.uuid4()), "is_active": False,
+                "login_time": now - timedelta(minutes=rng.randint(0, 525600)),
+            }
+            for _ in range(users * 20)
+        ])
+
+    def batches(total, make_row):
+        done = 0
+        while done < total:
+            size = min(BATCH_SIZE, total - done)
+            yield [make_row() for _ in range(size)]
+            done += size
+
+    def performance_row():
+        return {
+            "id": str(uuid.uuid4()), "user_id": rng.choice(user_ids),
+            "topic": rng.choice(TOPICS), "difficulty": rng.choice(DIFFICULTIES),
+            "question_text": f"Question {rng.randint(0, 10**9)}", "user_answer": "a",
+            "correct_answer": "a", "is_correct": rng.random() < 0.6,
+            "time_taken": rng.uniform(5, 120), "attempt_number": 1,
+            "created_at": now - timedelta(seconds=rng.randint(0, 31536000)),
+        }
+
+    def question_row():
+        return {
+            "id": str(uuid.uuid4()), "topic": rng.choice(TOPICS), "difficulty": rng.choice(DIFFICULTIES),
+            "question_text": f"Question {rng.randint(0, 10**9)}", "options": ["a", "b", "c", "d"],
+            "correct_answer": "a", "generated_by_user_id": rng.choice(user_ids + [None]),
+            "generated_at": now - timedelta(seconds=rng.randint(0, 31536000)),
+        }
+
+    for model, total, make_row in ((Performance, rows, performance_row), (QuestionHistory, rows // 4, question_row)):
+        for batch in batches(total, make_row):
+            with engine.begin() as conn:
+                conn.execute(insert(model), batch)
+        print(f"   seeded {total} {model.__tablename__} rows")
+
+    return user_ids
+
+def explain(conn, sql, params):
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+        return [row[-1] for row in rows]
+    return [row[0] for row in conn.execute(text("EXPLAIN " + sql), params).fetchall()]
+
+def run_queries(engine, user_ids, runs):
+    rng = random.Random(7)
+    report = {}
+    with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            def params():
+                return {"user_id": rng.choice(user_ids), "topic": rng.choice(TOPICS),
+                        "difficulty": rng.choice(DIFFICULTIES)}
+
+            timings = []
+            for _ in range(runs):
+                p = params()
+                started = time.perf_counter()
+                conn.execute(text(sql), p).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            report[name] = {
+                "plan": explain(conn, sql, params()),
+                "p50_ms": round(statistics.median(timings), 3),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+            }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///bench_queries.db",
+                        help="scratch database; it is dropped and recreated")
+    parser.add_argument("--rows", type=int, default=1000000, help="performance rows to seed")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50, help="executions per query")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    indexes = bench_indexes()
+    for index in indexes:
+        index.drop(engine)
+
+    print(f"🌱 Seeding {args.rows} performance rows...")
+    user_ids = seed(engine, args.rows, args.users)
+
+    print("⏱️  Running queries without indexes...")
+    before = run_queries(engine, user_ids, args.runs)
+
+    for index in indexes:
+        index.create(engine)
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.execute(text("ANALYZE"))
+
+    print("⏱️  Running queries with indexes...")
+    after = run_queries(engine, user_ids, args.runs)
+
+    report = {name: {"before": before[name], "after": after[name]} for name in QUERIES}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for name, result in report.items():
+        print(f"\n📊 {name}")
+        for label in ("before", "after"):
+            r = result[label]
+            print(f"   {label:6}  p50 {r['p50_ms']:9.3f} ms   p95 {r['p95_ms']:9.3f} ms")
+            for line in r["plan"]:
+                print(f"            {line}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for Maths Generator App
+Runs gunicorn against the fake LLM provider, drives /api/generate, /api/submit_answer
+and /api/performance at a fixed concurrency, and reports throughput, p50/p95/p99
+latency and DB row counts as JSON for comparing commits
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import fake_llm_server
+from load_test import prepare_database, start_server, percentile
+
+DEFAULT_TOPICS = "Vectors,Probability,Trigonometric Ratios,Factorization using Identities"
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_mix(text):
+    """'generate=2,submit=1' -> ['generate', 'generate', 'submit']"""
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix.extend([name.strip()] * int(weight or 1))
+    return mix
+
+def drive(port, cookie, user_id, question_ids, mix, topics, concurrency, duration):
+    """Send the request mix from concurrency threads for duration seconds"""
+    headers = {"Cookie": f"session={cookie}", "Content-Type": "application/json"}
+    results = {name: {"latencies": [], "statuses": {}} for name in set(mix)}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def request_for(name, rng):
+        topic = rng.choice(topics)
+        if name == "generate":
+            return "POST", "/api/generate", json.dumps({"topic": topic, "difficulty": "medium"})
+        if name == "submit":
+            # Stored questions are keyed "1"; about 70% of answers are right
+            return "POST", "/api/submit_answer", json.dumps({
+                "questionId": rng.choice(question_ids), "userAnswer": "1" if rng.random() < 0.7 else "2",
+                "timeTaken": round(rng.uniform(5, 60), 1)
+            })
+        if name == "performance":
+            return "GET", f"/api/performance/{user_id}", None
+        raise ValueError(f"Unknown request type {name!r}")
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        while time.monotonic() < stop_at:
+            name = rng.choice(mix)
+            method, path, body = request_for(name, rng)
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = str(response.status)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                status = "connection_error"
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                statuses = results[name]["statuses"]
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == "200":
+                    results[name]["latencies"].append(elapsed)
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name, r in sorted(results.items()):
+        total = sum(r["statuses"].values())
+        endpoints[name] = {
+            "requests": total,
+            "ok": len(r["latencies"]),
+            "errors": total - len(r["latencies"]),
+            "statuses": r["statuses"],
+            "rps": round(len(r["latencies"]) / elapsed, 1),
+            "p50_ms": round(percentile(r["latencies"], 50), 2),
+            "p95_ms": round(percentile(r["latencies"], 95), 2),
+            "p99_ms": round(percentile(r["latencies"], 99), 2),
+        }
+    ok = sum(e["ok"] for e in endpoints.values())
+    totals = {
+        "requests": sum(e["requests"] for e in endpoints.values()),
+        "ok": ok,
+        "errors": sum(e["errors"] for e in endpoints.values()),
+        "rps": round(ok / elapsed, 1),
+        "seconds": round(elapsed, 2),
+    }
+    return endpoints, totals
+
+def count_rows():
+    """Row counts per table after the run"""
+    from database import create_db_app
+    from models import db, User, Performance, QuestionHistory, PerformanceAggregate, LLMUsage
+
+    with create_db_app(migrations=False).app_context():
+        return {
+            model.__tablename__: db.session.query(model).count()
+            for model in (User, Performance, QuestionHistory, PerformanceAggregate, LLMUsage)
+        }
+
+def compare(report, baseline):
+    """Print throughput and p95 changes against an earlier report"""
+    print(f"\n📈 Compared with {baseline.get('commit')} ({baseline.get('timestamp')})", file=sys.stderr)
+    for name, now in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        rps = (now["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+        p95 = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        print(f"   {name:12} rps {before['rps']:8.1f} -> {now['rps']:8.1f} ({rps:+.1f}%)   "
+              f"p95 {before['p95_ms']:8.2f} -> {now['p95_ms']:8.2f} ms ({p95:+.1f}%)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="threads per worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--mix", default="generate=2,submit=2,performance=1", help="request types and weights")
+    parser.add_argument("--topics", default=DEFAULT_TOPICS, help="comma-separated topics for /api/generate")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="fake LLM latency standard deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake LLM calls answered with 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of fake LLM completions cut off")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app setting")
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--database-url", help="defaults to a new SQLite file in a temporary directory")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='mathsgen-bench-'), 'bench.db')}"
+    llm_server, llm = fake_llm_server.start(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, malformed_rate=args.malformed_rate
+    )
+
+    # Every generate request reaches the LLM path unless --env turns replay or the pool back on
+    app_env = {
+        "LLM_BASE_URL": f"http://127.0.0.1:{llm_server.server_port}",
+        "API_KEY": "benchmark",
+        "REPLAY_ENABLED": "0",
+        "RATE_LIMIT_USER_PER_MINUTE": "0",
+        "RATE_LIMIT_TOPIC_PER_MINUTE": "0",
+        "LLM_DAILY_BUDGET_USD": "0",
+        "LLM_USER_DAILY_TOKENS": "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    app_env.update(item.split("=", 1) for item in args.env)
+    os.environ.update(app_env)
+
+    user_id, cookie, question_ids = prepare_database(database_url)
+    print(f"🚀 {args.workers} worker(s) x {args.threads} threads, {args.concurrency} clients, "
+          f"{args.duration:.0f}s, LLM {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms", file=sys.stderr)
+    server = start_server(args.port, args.workers, args.threads, database_url, extra_env=app_env)
+    try:
+        endpoints, totals = drive(
+            args.port, cookie, user_id, question_ids, parse_mix(args.mix), [t.strip() for t in args.topics.split(",")],
+            args.concurrency, args.duration
+        )
+    finally:
+        # Workers flush their write-behind queues on shutdown, so row counts are final
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+        llm_server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "workers": args.workers, "threads": args.threads, "concurrency": args.concurrency,
+            "duration": args.duration, "mix": args.mix, "topics": args.topics,
+            "llm_latency": args.latency, "llm_jitter": args.jitter,
+            "llm_error_rate": args.error_rate, "llm_malformed_rate": args.malformed_rate,
+            "env": {key: value for key, value in app_env.items() if key != "LLM_BASE_URL"},
+        },
+        "total": totals,
+        "endpoints": endpoints,
+        "db_rows": count_rows(),
+        "fake_llm": llm.stats(),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"📄 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for Maths Generator App
+Starts fresh interpreters and times importing app.py, create_app(), the first and
+second requests, and the database-only app used by manage_db.py.
+Reports medians as JSON, with the slowest imports, for comparing commits
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy modules the web process should not load until they are needed
+DEFERRED_MODULES = ["openai", "flask_migrate", "alembic"]
+
+# Runs in a fresh interpreter; prints one JSON object
+WEB_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+web = app.create_app()
+created = time.perf_counter()
+client = web.test_client()
+client.get("/test")
+first = time.perf_counter()
+client.get("/test")
+second = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first - created) * 1000,
+    "second_request_ms": (second - first) * 1000,
+    "ready_ms": (first - started) * 1000,
+    "modules": len(sys.modules),
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+DB_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+from database import create_db_app
+create_db_app(migrations=False)
+print(json.dumps({
+    "db_app_ms": (time.perf_counter() - started) * 1000,
+    "web_stack_loaded": [name for name in ("app", "flask_dance", "openai") if name in sys.modules],
+}))
+"""
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def probe(code, env):
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+def slowest_imports(env, top):
+    """The modules with the largest cumulative import time when importing app.py"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if cumulative.isdigit():
+            rows.append((int(cumulative), name))
+    # Only top-level packages, so nested modules do not repeat their parents' time
+    top_level = {}
+    for cumulative, name in rows:
+        root = name.split(".")[0]
+        top_level[root] = max(top_level.get(root, 0), cumulative)
+    ranked = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"module": name, "ms": round(us / 1000, 1)} for name, us in ranked]
+
+def summarize(samples, fields):
+    return {
+        field: {
+            "median": round(statistics.median(s[field] for s in samples), 1),
+            "min": round(min(s[field] for s in samples), 1),
+            "max": round(max(s[field] for s in samples), 1),
+        }
+        for field in fields
+    }
+
+def compare(report, baseline):
+    """Print median changes against an earlier report"""
+    print(f"\n📈 Compared with {baseline.get('commit')} ({baseline.get('timestamp')})", file=sys.stderr)
+    for section in ("web", "db_scripts"):
+        for field, now in report[section].items():
+            before = baseline.get(section, {}).get(field)
+            if not isinstance(now, dict) or not before:
+                continue
+            change = (now["median"] - before["median"]) / before["median"] * 100 if before["median"] else 0.0
+            print(f"   {field:20} {before['median']:8.1f} -> {now['median']:8.1f} ms ({change:+.1f}%)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='mathsgen-startup-'), 'startup.db')}",
+        "QUESTION_POOL_ENABLED": "0",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONDONTWRITEBYTECODE": "",
+    })
+    # One untimed run so every later run reads compiled bytecode, as a deployed instance does
+    probe(WEB_PROBE % (DEFERRED_MODULES,), env)
+
+    web = [probe(WEB_PROBE % (DEFERRED_MODULES,), env) for _ in range(args.runs)]
+    scripts = [probe(DB_PROBE, env) for _ in range(args.runs)]
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "runs": args.runs,
+        "web": summarize(web, ["import_ms", "create_app_ms", "first_request_ms", "second_request_ms", "ready_ms"]),
+        "db_scripts": summarize(scripts, ["db_app_ms"]),
+        "modules_loaded": web[-1]["modules"],
+        "deferred_modules_loaded": web[-1]["loaded"],
+        "web_stack_in_scripts": scripts[-1]["web_stack_loaded"],
+        "slowest_imports": slowest_imports(env, args.top),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"📄 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Rate limits and token budgets for Maths Generator App
+Token buckets per user and topic, plus daily LLM spend read from llm_usage, which every worker writes
+"""
+
+import os
+import time
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from models import db, LLMUsage, User
+from aggregates import increment_totals
+from state_store import store
+from write_behind import writer
+from resilience import LLMUnavailable
+
+RATE_LIMIT_USER_PER_MINUTE = float(os.environ.get("RATE_LIMIT_USER_PER_MINUTE", 30))
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", 10))
+RATE_LIMIT_TOPIC_PER_MINUTE = float(os.environ.get("RATE_LIMIT_TOPIC_PER_MINUTE", 60))
+RATE_LIMIT_TOPIC_BURST = float(os.environ.get("RATE_LIMIT_TOPIC_BURST", 20))
+LLM_DAILY_BUDGET_USD = float(os.environ.get("LLM_DAILY_BUDGET_USD", 5.0))
+LLM_USER_DAILY_TOKENS = int(os.environ.get("LLM_USER_DAILY_TOKENS", 50000))
+# How long a worker trusts today's spend read from llm_usage before reading it again
+BUDGET_REFRESH_SECONDS = float(os.environ.get("BUDGET_REFRESH_SECONDS", 5))
+
+# deepseek-chat list prices in USD per million tokens
+LLM_PRICE_INPUT_PER_MTOK = float(os.environ.get("LLM_PRICE_INPUT_PER_MTOK", 0.27))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.environ.get("LLM_PRICE_OUTPUT_PER_MTOK", 1.10))
+
+# Without a shared store every worker keeps its own buckets, so each gets an even share of the limits
+BUCKET_SHARES = 1 if store.shared else max(1, int(os.environ.get("WEB_CONCURRENCY", 2)))
+
+class BudgetExhausted(LLMUnavailable):
+    """A rate limit or daily budget rules out another LLM call; serve stored questions instead"""
+
+def token_cost(prompt_tokens, completion_tokens):
+    """Estimated cost in USD of one completion"""
+    return (prompt_tokens * LLM_PRICE_INPUT_PER_MTOK + completion_tokens * LLM_PRICE_OUTPUT_PER_MTOK) / 1e6
+
+class TokenBucket:
+    """Token bucket in the shared store: rate tokens per minute, holding at most burst"""
+
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        self.rate = per_minute / 60 / BUCKET_SHARES
+        self.burst = max(1, burst / BUCKET_SHARES)
+
+    def allow(self, key):
+        """Take one token for key; False if the bucket is empty"""
+        if self.rate <= 0:
+            return True
+        store_key = f"ratelimit:{self.name}:{key}"
+        now = time.time()
+        state = store.get(store_key) or {"tokens": self.burst, "at": now}
+        tokens = min(self.burst, state["tokens"] + (now - state["at"]) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Not atomic across workers; a race can let through at most one extra request each
+        store.set(store_key, {"tokens": tokens, "at": now}, ttl=int(self.burst / self.rate) + 60)
+        return allowed
+
+    def retry_after(self):
+        """Seconds until an empty bucket has a token again"""
+        return max(1, int(1 / self.rate)) if self.rate > 0 else 0
+
+user_requests = TokenBucket("user", RATE_LIMIT_USER_PER_MINUTE, RATE_LIMIT_USER_BURST)
+topic_llm_calls = TokenBucket("topic", RATE_LIMIT_TOPIC_PER_MINUTE, RATE_LIMIT_TOPIC_BURST)
+
+class SpendLedger:
+    """Today's totals from llm_usage, cached per worker, plus this worker's usage since they were read"""
+
+    def __init__(self, refresh_seconds=BUDGET_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._day = None
+        self._totals = {}
+
+    def get(self, key, query):
+        """Today's total for key, running query(day) when the cached one is stale; needs an app context then"""
+        today = date.today()
+        with self._lock:
+            if self._day != today:
+                self._day = today
+                self._totals = {}
+            cached = self._totals.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.refresh_seconds:
+            return cached[0]
+        # Rows still waiting in the write-behind queue are missed until the next read
+        value = query(today) or 0
+        with self._lock:
+            if self._day == today:
+                self._totals[key] = [value, time.monotonic()]
+        return value
+
+    def add(self, key, amount):
+        """Count usage at once, before its llm_usage row is written"""
+        with self._lock:
+            if self._day == date.today() and key in self._totals:
+                self._totals[key][0] += amount
+
+ledger = SpendLedger()
+
+def _spent_usd(day):
+    return db.session.query(func.sum(LLMUsage.cost_usd)).filter(LLMUsage.day == day).scalar()
+
+def _user_tokens(user_id):
+    def query(day):
+        return db.session.query(func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens)).filter(
+            LLMUsage.day == day, LLMUsage.user_id == user_id
+        ).scalar()
+    return query
+
+def record_usage(user_id, topic, prompt_tokens, completion_tokens):
+    """Count one completion's usage towards today's budgets and queue it for llm_usage"""
+    cost = token_cost(prompt_tokens, completion_tokens)
+    ledger.add("global", cost)
+    ledger.add(("user", user_id or ""), prompt_tokens + completion_tokens)
+    writer.enqueue(LLMUsage, {
+        "day": date.today(),
+        "user_id": user_id or "",
+        "topic": topic,
+        "calls": 1,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": cost
+    })
+
+def spent_today():
+    """Today's estimated LLM spend in USD across all users; must run inside an app context"""
+    return ledger.get("global", _spent_usd)
+
+def global_budget_left():
+    return LLM_DAILY_BUDGET_USD <= 0 or spent_today() < LLM_DAILY_BUDGET_USD
+
+def user_budget_left(user_id):
+    if LLM_USER_DAILY_TOKENS <= 0:
+        return True
+    return ledger.get(("user", user_id), _user_tokens(user_id)) < LLM_USER_DAILY_TOKENS
+
+def check_llm_allowed(user_id, topic):
+    """Raise BudgetExhausted unless a new LLM call fits today's budgets and the topic rate limit"""
+    if not global_budget_left():
+        raise BudgetExhausted("Today's question budget has been used up")
+    if user_id is not None and not user_budget_left(user_id):
+        raise BudgetExhausted("You have used up today's new questions")
+    if not topic_llm_calls.allow(topic):
+        raise BudgetExhausted("Too many new questions on this topic right now")
+
+def apply_usage_rows(rows):
+    """Add LLMUsage rows (as dicts) to their daily totals in the current transaction"""
+    increment_totals(LLMUsage, ("day", "user_id", "topic"), ("calls", "prompt_tokens", "completion_tokens", "cost_usd"), rows)
+
+def spend_report(days=7):
+    """Spend per day, per user and per topic over the last days; must run inside an app context"""
+    since = date.today() - timedelta(days=days - 1)
+    columns = (
+        func.sum(LLMUsage.calls), func.sum(LLMUsage.prompt_tokens),
+        func.sum(LLMUsage.completion_tokens), func.sum(LLMUsage.cost_usd)
+    )
+
+    def rows(*group_by):
+        query = db.session.query(*group_by, *columns).filter(LLMUsage.day >= since)
+        return query.group_by(*group_by).order_by(func.sum(LLMUsage.cost_usd).desc()).all()
+
+    def entry(calls, prompt_tokens, completion_tokens, cost_usd):
+        return {
+            "calls": int(calls or 0),
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0),
+            "cost_usd": round(cost_usd or 0.0, 6)
+        }
+
+    emails = dict(db.session.query(User.id, User.email).join(
+        LLMUsage, LLMUsage.user_id == User.id
+    ).filter(LLMUsage.day >= since).distinct().all())
+
+    return {
+        "since": since.isoformat(),
+        "budget_usd": LLM_DAILY_BUDGET_USD,
+        "spent_today_usd": round(spent_today(), 6),
+        "by_day": sorted(
+            (dict(day=day.isoformat(), **entry(*totals)) for day, *totals in rows(LLMUsage.day)),
+            key=lambda row: row["day"], reverse=True
+        ),
+        "by_user": [
+            dict(user_id=user_id, email=emails.get(user_id, "(question pool)" if not user_id else user_id), **entry(*totals))
+            for user_id, *totals in rows(LLMUsage.user_id)
+        ],
+        "by_topic": [dict(topic=topic, **entry(*totals)) for topic, *totals in rows(LLMUsage.topic)]
+    }
+
+writer.register_applier(LLMUsage, apply_usage_rows)
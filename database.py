@@ -0,0 +1,41 @@
+"""
+Database setup for Maths Generator App
+Configures Flask-SQLAlchemy on an app, and builds a database-only app for scripts that do not need the web stack
+"""
+
+import os
+
+from flask import Flask
+
+from models import db
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATABASE_URL = f'sqlite:///{os.path.join(ROOT, "maths_generator.db")}'
+MIGRATIONS_DIR = os.path.join(ROOT, "migrations")
+
+def init_database(app, migrations=True):
+    """Point app at DATABASE_URL; Flask-Migrate (which imports alembic) is only set up when migrations is true"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    if migrations:
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=MIGRATIONS_DIR)
+
+def create_db_app(migrations=True):
+    """A Flask app with only the database (and optionally migrations) configured, for init_db.py and manage_db.py"""
+    app = Flask(__name__)
+    init_database(app, migrations=migrations)
+    return app
+
+def upgrade_schema():
+    """Create missing tables and bring the schema up to the latest migration; must run inside an app context"""
+    from flask_migrate import stamp, upgrade
+    from sqlalchemy import inspect
+
+    db.create_all()
+    if 'alembic_version' not in inspect(db.engine).get_table_names():
+        # Databases created before migrations were added match the initial revision
+        stamp(revision='0001_initial_schema')
+    upgrade()
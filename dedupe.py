@@ -0,0 +1,201 @@
+"""
+Duplicate question detection for Maths Generator App
+Per-user index of seen questions: normalized-text hashes plus a MinHash/LSH near-duplicate index
+"""
+
+import os
+import re
+import hashlib
+import random
+import threading
+from collections import OrderedDict
+
+from models import Performance, QuestionHistory
+from state_store import store
+
+DEDUPE_THRESHOLD = float(os.environ.get("DEDUPE_THRESHOLD", 0.8))
+DEDUPE_HISTORY_LIMIT = int(os.environ.get("DEDUPE_HISTORY_LIMIT", 2000))
+DEDUPE_MAX_USERS = int(os.environ.get("DEDUPE_MAX_USERS", 1000))
+DEDUPE_TTL = int(os.environ.get("DEDUPE_TTL", 7 * 24 * 3600))
+# Shorter questions share most of their few shingles, e.g. "x^2 * x^2" and "x^2 * x^3", so they only match exactly
+DEDUPE_MIN_TOKENS = int(os.environ.get("DEDUPE_MIN_TOKENS", 12))
+
+SHINGLE_SIZE = 3
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240901)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_LATEX_DELIMITERS = re.compile(r'\\[()\[\]]|\$')
+_TOKENS = re.compile(r'[a-z]+|\d+(?:\.\d+)?|[^\sa-z\d]')
+
+def normalize_question(text):
+    """Lowercase, drop LaTeX delimiters and whitespace differences"""
+    text = _LATEX_DELIMITERS.sub(" ", text.lower())
+    text = text.replace("**", "^").replace("×", "*").replace("\\times", "*").replace("\\cdot", "*")
+    return " ".join(_TOKENS.findall(text)).rstrip(" .?")
+
+def question_hash(text):
+    """Stable hash of the normalized question text"""
+    return hashlib.sha1(normalize_question(text).encode()).hexdigest()[:16]
+
+def _shingles(normalized):
+    tokens = normalized.split(" ")
+    if len(tokens) < SHINGLE_SIZE:
+        return {normalized}
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+def minhash(normalized):
+    """MinHash signature of the token shingles of a normalized question"""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in _shingles(normalized)
+    ]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+def _bands(signature):
+    return [(i, signature[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+def _similarity(a, b):
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+_stats_lock = threading.Lock()
+_stats = {"checks": 0, "duplicates": 0, "loads": 0}
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+class SeenQuestions:
+    """Questions one user has already seen
+
+    The shared store holds the hashes and MinHash signatures; each worker keeps
+    an LSH index over them and catches up when another worker has added more.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.hashes = set()
+        self.signatures = {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def _index(self, digest, signature):
+        with self._lock:
+            if digest in self.hashes:
+                return
+            self.hashes.add(digest)
+            self.signatures[digest] = signature
+            for band in _bands(signature):
+                self.buckets.setdefault(band, set()).add(digest)
+
+    def _keys(self):
+        return (f"{self.key}:hashes", f"{self.key}:sigs", f"{self.key}:loaded")
+
+    def sync(self):
+        """Index questions other workers have recorded since the last sync"""
+        hashes_key, sigs_key, _ = self._keys()
+        if store.scard(hashes_key) <= len(self.hashes):
+            return
+        for digest, signature in store.hgetall(sigs_key).items():
+            self._index(digest, tuple(signature))
+
+    def add_many(self, texts):
+        """Record questions as seen, in the store and the local index"""
+        new = {}
+        for text in texts:
+            normalized = normalize_question(text)
+            digest = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+            if digest not in self.hashes and digest not in new:
+                new[digest] = minhash(normalized)
+        if not new:
+            return
+        hashes_key, sigs_key, loaded_key = self._keys()
+        store.hset(sigs_key, {digest: list(signature) for digest, signature in new.items()})
+        store.sadd(hashes_key, *new)
+        for key in self._keys():
+            store.expire(key, DEDUPE_TTL)
+        for digest, signature in new.items():
+            self._index(digest, signature)
+
+    def add(self, text):
+        self.add_many([text])
+
+    def _contains(self, text):
+        normalized = normalize_question(text)
+        digest = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+        if digest in self.hashes or store.sismember(self._keys()[0], digest):
+            return True
+        if len(normalized.split(" ")) < DEDUPE_MIN_TOKENS:
+            return False
+        self.sync()
+        # Only questions sharing an LSH band are compared, so the cost does not grow with history
+        signature = minhash(normalized)
+        with self._lock:
+            candidates = set()
+            for band in _bands(signature):
+                candidates |= self.buckets.get(band, set())
+            signatures = [self.signatures[c] for c in candidates]
+        return any(_similarity(signature, other) >= DEDUPE_THRESHOLD for other in signatures)
+
+    def __contains__(self, text):
+        _count("checks")
+        duplicate = self._contains(text)
+        if duplicate:
+            _count("duplicates")
+        return duplicate
+
+    def __len__(self):
+        return len(self.hashes)
+
+class SeenQuestionIndex:
+    """LRU of per-user seen-question indexes, backed by the shared store"""
+
+    def __init__(self, max_users=DEDUPE_MAX_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, user_id):
+        """Build a user's index, seeding the store from the database if no worker has yet"""
+        seen = SeenQuestions(f"seen:{user_id}")
+        if not store.set(f"seen:{user_id}:loaded", True, ttl=DEDUPE_TTL, only_if_absent=True):
+            seen.sync()
+            return seen
+
+        answered = Performance.query.with_entities(Performance.question_text).filter_by(
+            user_id=user_id
+        ).order_by(Performance.created_at.desc()).limit(DEDUPE_HISTORY_LIMIT).all()
+        generated = QuestionHistory.query.with_entities(QuestionHistory.question_text).filter_by(
+            generated_by_user_id=user_id
+        ).order_by(QuestionHistory.generated_at.desc()).limit(DEDUPE_HISTORY_LIMIT).all()
+        seen.add_many(text for (text,) in answered + generated)
+        _count("loads")
+        return seen
+
+    def for_user(self, user_id):
+        """Return the seen-question set for a user; must run inside an app context"""
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is not None:
+                self._users.move_to_end(user_id)
+                return seen
+
+        seen = self._load(user_id)
+        with self._lock:
+            seen = self._users.setdefault(user_id, seen)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return seen
+
+    def stats(self):
+        """Return check/duplicate counters and the number of cached users"""
+        with _stats_lock:
+            stats = dict(_stats)
+        stats["users"] = len(self._users)
+        return stats
+
+seen_index = SeenQuestionIndex()
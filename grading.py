@@ -0,0 +1,355 @@
+"""
+Answer grading for Maths Generator App
+Grades answers on the server against the stored key, and checks algebraic keys by comparing canonical polynomial forms
+"""
+
+import os
+import re
+import threading
+from fractions import Fraction
+from functools import lru_cache
+
+from models import db, QuestionHistory
+from local_questions import local_topic
+from state_store import store
+from write_behind import writer, question_history_row
+
+GRADING_CACHE_SIZE = int(os.environ.get("GRADING_CACHE_SIZE", 10000))
+# Questions are kept in the store until the write-behind row is surely committed
+SERVED_QUESTION_TTL = int(os.environ.get("SERVED_QUESTION_TTL", 3600))
+# Expanding (a + b)^n is costly, so multi-term bases get a lower cap than monomials
+MAX_POWER = 12
+MAX_MONOMIAL_POWER = 200
+# Limits on every intermediate term, so nested powers cannot grow without bound
+MAX_DEGREE = 200
+MAX_COEFFICIENT_BITS = 256
+MAX_EXPRESSION_LENGTH = 300
+
+ALGEBRA_KEYWORDS = ("factori", "expan", "simplif", "indices", "algebra", "polynomial", "identit")
+
+KEY_OK = "ok"
+KEY_BAD = "bad_key"
+KEY_NO_CORRECT_OPTION = "no_correct_option"
+KEY_UNCHECKED = "unchecked"
+QUARANTINE_VERDICTS = (KEY_BAD, KEY_NO_CORRECT_OPTION)
+
+_stats = {verdict: 0 for verdict in (KEY_OK, KEY_BAD, KEY_NO_CORRECT_OPTION, KEY_UNCHECKED)}
+_stats.update({"graded": 0, "quarantined": 0})
+_stats_lock = threading.Lock()
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+class ExpressionError(ValueError):
+    """Text that is not a polynomial expression the normalizer understands"""
+
+# Polynomials are dicts of {((variable, power), ...): Fraction}; powers may be negative after division
+
+def _bits(coeff):
+    return max(coeff.numerator.bit_length(), coeff.denominator.bit_length())
+
+def _check_term(key, coeff):
+    if sum(abs(power) for _, power in key) > MAX_DEGREE or _bits(Fraction(coeff)) > MAX_COEFFICIENT_BITS:
+        raise ExpressionError("expression is too large")
+
+def _mul(a, b):
+    result = {}
+    for ka, ca in a.items():
+        for kb, cb in b.items():
+            powers = dict(ka)
+            for var, power in kb:
+                powers[var] = powers.get(var, 0) + power
+            key = tuple(sorted((var, power) for var, power in powers.items() if power))
+            result[key] = result.get(key, 0) + ca * cb
+            _check_term(key, result[key])
+    return {k: c for k, c in result.items() if c}
+
+def _add(a, b, sign=1):
+    result = dict(a)
+    for key, c in b.items():
+        result[key] = result.get(key, 0) + sign * c
+    return {k: c for k, c in result.items() if c}
+
+def _constant(poly):
+    """The value of a constant polynomial, or None"""
+    if not poly:
+        return Fraction(0)
+    if len(poly) == 1 and () in poly:
+        return poly[()]
+    return None
+
+def _pow(poly, exponent):
+    exponent = _constant(exponent)
+    limit = MAX_MONOMIAL_POWER if len(poly) <= 1 else MAX_POWER
+    if exponent is None or exponent.denominator != 1 or abs(exponent) > limit:
+        raise ExpressionError("exponent must be a small integer")
+    n = int(exponent)
+    if n < 0:
+        return _pow(_inverse(poly), {(): Fraction(-n)})
+    if len(poly) == 1:
+        (key, coeff), = poly.items()
+        # Checked before raising to the power, which is where the cost is
+        if sum(abs(power) for _, power in key) * n > MAX_DEGREE or _bits(Fraction(coeff)) * n > MAX_COEFFICIENT_BITS:
+            raise ExpressionError("expression is too large")
+        return {tuple((var, power * n) for var, power in key): coeff ** n}
+    result = {(): Fraction(1)}
+    for _ in range(n):
+        result = _mul(result, poly)
+    return result
+
+def _inverse(poly):
+    """1/poly for a single term; other divisions are not polynomials"""
+    if len(poly) != 1:
+        raise ExpressionError("can only divide by a single term")
+    (key, coeff), = poly.items()
+    return {tuple((var, -power) for var, power in key): 1 / coeff}
+
+_LATEX = [
+    (r"\\left|\\right|\\,|\\;|\\!|\$", ""),
+    (r"\\cdot|\\times|×|·", "*"),
+    (r"\\div|÷", "/"),
+    (r"−|–", "-"),
+    (r"\*\*", "^"),
+]
+_FRAC = re.compile(r"\\[dt]?frac\{([^{}]*)\}\{([^{}]*)\}")
+_TOKEN = re.compile(r"\s*(?:(\d+(?:\.\d+)?)|([a-zA-Z])|(.))")
+
+def _tokens(text):
+    for pattern, replacement in _LATEX:
+        text = re.sub(pattern, replacement, text)
+    while _FRAC.search(text):
+        text = _FRAC.sub(r"((\1)/(\2))", text)
+    text = text.replace("{", "(").replace("}", ")").strip()
+    if not text or re.search(r"[a-zA-Z]{4,}", text):
+        # Words are not algebra; without this, anagrams would compare equal
+        raise ExpressionError("not an expression")
+
+    tokens = []
+    for number, letter, other in _TOKEN.findall(text):
+        if number:
+            tokens.append(("num", Fraction(number)))
+        elif letter:
+            tokens.append(("var", letter))
+        elif other in "+-*/^()":
+            tokens.append(("op", other))
+        elif other.strip():
+            raise ExpressionError(f"unexpected {other!r}")
+    return tokens
+
+class _Parser:
+    """Recursive-descent parser with implicit multiplication (2x, 3(x + 1), (x + 1)(x - 1))"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, op=None):
+        token = self.peek()
+        if op is not None and token != ("op", op):
+            raise ExpressionError(f"expected {op!r}")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        poly = self.expression()
+        if self.pos != len(self.tokens):
+            raise ExpressionError("trailing input")
+        return poly
+
+    def expression(self):
+        poly = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            sign = 1 if self.take()[1] == "+" else -1
+            poly = _add(poly, self.term(), sign)
+        return poly
+
+    def term(self):
+        poly = self.unary()
+        while True:
+            kind, value = self.peek()
+            if (kind, value) == ("op", "*"):
+                self.take()
+                poly = _mul(poly, self.unary())
+            elif (kind, value) == ("op", "/"):
+                self.take()
+                poly = _mul(poly, _inverse(self.unary()))
+            elif kind in ("num", "var") or (kind, value) == ("op", "("):
+                poly = _mul(poly, self.power())
+            else:
+                return poly
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            return _mul({(): Fraction(-1)}, self.unary())
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() == ("op", "^"):
+            self.take()
+            return _pow(base, self.unary())
+        return base
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == "num":
+            return {(): value} if value else {}
+        if kind == "var":
+            return {((value, 1),): Fraction(1)}
+        if (kind, value) == ("op", "("):
+            poly = self.expression()
+            self.take(")")
+            return poly
+        raise ExpressionError("expected a number, variable or '('")
+
+@lru_cache(maxsize=GRADING_CACHE_SIZE)
+def canonical(text):
+    """Hashable expanded form of an expression, or None if it is not a polynomial expression"""
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        return None
+    try:
+        return tuple(sorted(_Parser(_tokens(text)).parse().items()))
+    except (ExpressionError, ZeroDivisionError, RecursionError):
+        return None
+
+def _variables(form):
+    """The variables in a canonical form"""
+    return {var for key, _ in form for var, _ in key}
+
+def normalize_text(text):
+    return " ".join(str(text).replace("$", "").split()).lower()
+
+def chosen_option(options, answer):
+    """The option a student picked, by its text; None if it is not one of the options"""
+    # Options are served shuffled, so an index would not say which one the student saw
+    text = normalize_text(answer)
+    return next((option for option in options if normalize_text(option) == text), None)
+
+def algebraic(topic):
+    """True for topics whose stems contain an expression the options should equal"""
+    return local_topic(topic) is not None or any(word in topic.lower() for word in ALGEBRA_KEYWORDS)
+
+_VERB = re.compile(r"\b(?:factori[sz]e|expand|simplify)\b", re.IGNORECASE)
+# Stems asking for something other than an equivalent form ("a factor of", "the value when x = 2")
+_NOT_EQUIVALENCE = re.compile(r"\bfactors? of\b|\bnot\b|\bvalue\b|\bwhen\b|\bif\b|\bwhere\b", re.IGNORECASE)
+_STEM = re.compile(
+    r"(?:factori[sz]e|expand|simplify)\s*:?\s*(?:the\s+(?:expression|following)\s*:?\s*)?(.+?)"
+    r"(?=\s+(?:using|by|completely|fully)\b|[.?](?:\s|$)|$)",
+    re.IGNORECASE | re.DOTALL
+)
+_INLINE_MATH = re.compile(r"\$\$?(.+?)\$\$?|\\\((.+?)\\\)", re.DOTALL)
+
+def stem_expression(question):
+    """The expression a factorize/expand/simplify stem asks about, or None"""
+    if not _VERB.search(question) or _NOT_EQUIVALENCE.search(question):
+        return None
+    candidates = [a or b for a, b in _INLINE_MATH.findall(question)]
+    match = _STEM.search(question)
+    if match:
+        candidates.append(match.group(1))
+    for candidate in sorted(candidates, key=len, reverse=True):
+        if canonical(candidate) is not None:
+            return candidate
+    return None
+
+def _in_stem_variables(target, forms):
+    """True if every option is an expression in the stem's variables, so one of them should equal the stem"""
+    stem_vars = _variables(target)
+    # Numbers against a stem in x answer a question about it, such as a coefficient
+    return all(_variables(form) <= stem_vars and (_variables(form) or not stem_vars) for form in forms)
+
+def check_key(topic, question, options, correct_answer):
+    """Verdict on an answer key: ok, bad_key, no_correct_option, or unchecked when it cannot be verified"""
+    verdict = KEY_UNCHECKED
+    expression = stem_expression(question) if algebraic(topic) else None
+    if expression is not None:
+        target = canonical(expression)
+        forms = [canonical(option) for option in options]
+        if canonical(correct_answer) == target:
+            verdict = KEY_OK
+        elif target in forms:
+            verdict = KEY_BAD
+        elif None not in forms and _in_stem_variables(target, forms):
+            verdict = KEY_NO_CORRECT_OPTION
+    _count(verdict)
+    return verdict
+
+def vet_question(topic, difficulty, item):
+    """Check an LLM question's key; quarantine it and return False if the key is wrong"""
+    verdict = check_key(topic, item["question"], item["options"], item["correct_answer"])
+    if verdict not in QUARANTINE_VERDICTS:
+        return True
+    # Kept for auditing, but never served
+    row = question_history_row(topic, difficulty, dict(item))
+    row["quarantined"] = True
+    writer.enqueue(QuestionHistory, row)
+    _count("quarantined")
+    return False
+
+def remember_question(row):
+    """Keep a just-served question where grading can find it before its row is committed"""
+    store.set(f"question:{row['id']}", {
+        "id": row["id"],
+        "topic": row["topic"],
+        "difficulty": row["difficulty"],
+        "question_text": row["question_text"],
+        "options": row["options"],
+        "correct_answer": row["correct_answer"]
+    }, ttl=SERVED_QUESTION_TTL)
+
+def load_question(question_id):
+    """A served question by id, from the store or QuestionHistory; None if unknown"""
+    cached = store.get(f"question:{question_id}")
+    if cached is not None:
+        return cached
+    row = db.session.get(QuestionHistory, question_id)
+    if row is None:
+        return None
+    return {
+        "id": row.id,
+        "topic": row.topic,
+        "difficulty": row.difficulty,
+        "question_text": row.question_text,
+        "options": list(row.options),
+        "correct_answer": row.correct_answer
+    }
+
+def grade(question, user_answer):
+    """True if user_answer is the keyed option; an equivalent but different option is still wrong"""
+    _count("graded")
+    option = chosen_option(question["options"], user_answer)
+    return option is not None and normalize_text(option) == normalize_text(question["correct_answer"])
+
+def audit_archive(batch_size=500):
+    """Re-check every stored key and quarantine the bad ones; return (checked, quarantined)"""
+    checked = quarantined = 0
+    last_id = ""
+    while True:
+        rows = QuestionHistory.query.filter(
+            QuestionHistory.id > last_id, QuestionHistory.quarantined.is_(False)
+        ).order_by(QuestionHistory.id).limit(batch_size).all()
+        if not rows:
+            return checked, quarantined
+        for row in rows:
+            checked += 1
+            if check_key(row.topic, row.question_text, row.options, row.correct_answer) in QUARANTINE_VERDICTS:
+                row.quarantined = True
+                quarantined += 1
+        db.session.commit()
+        last_id = rows[-1].id
+
+def stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    info = canonical.cache_info()
+    stats["canonical_cache_hits"] = info.hits
+    stats["canonical_cache_misses"] = info.misses
+    return stats
@@ -0,0 +1,39 @@
+"""
+Gunicorn configuration for Maths Generator App
+Every setting can be tuned with an environment variable on Render
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+
+# Worker processes, each with a pool of threads (LLM calls spend most of their time waiting)
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Load the app once in the master so workers fork with it already imported
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# LLM generation can take tens of seconds
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers gradually; send SIGHUP to the master for a graceful reload
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Set GUNICORN_ACCESS_LOG to an empty string to turn the access log off
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+
+def post_fork(server, worker):
+    # Database connections opened by the master must not be shared with workers
+    from models import db
+    with server.app.wsgi().app_context():
+        db.engine.dispose()
+
+def worker_exit(server, worker):
+    # Write any answers still waiting in the write-behind queue
+    from write_behind import writer
+    writer.stop()
@@ -0,0 +1,162 @@
+"""
+History pages for Maths Generator App
+Keyset pagination over attempts, generated questions, sessions and users, so each page costs the same at any table size
+"""
+
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+from models import User, UserSession, Performance, QuestionHistory
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(at, row_id):
+    """Opaque cursor for the row a page ended on"""
+    return base64.urlsafe_b64encode(f"{at.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Return (datetime, id) from a cursor; raise ValueError if it is malformed"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        at, row_id = text.split("|", 1)
+        return datetime.fromisoformat(at), row_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def parse_date(value):
+    """Parse an ISO date or datetime filter; None stays None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid date: {value!r}; use YYYY-MM-DD or an ISO datetime") from e
+
+def page_size(value):
+    """Clamp a requested page size to 1..MAX_PAGE_SIZE"""
+    return max(1, min(int(value or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+
+def _page(query, time_column, id_column, cursor, limit, serialize):
+    """Newest-first page after cursor; uses the (..., time, id) index instead of OFFSET"""
+    if cursor:
+        at, row_id = decode_cursor(cursor)
+        query = query.filter(or_(time_column < at, and_(time_column == at, id_column < row_id)))
+
+    rows = query.order_by(time_column.desc(), id_column.desc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if more:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, time_column.key), getattr(last, id_column.key))
+    return {"items": [serialize(row) for row in rows], "next_cursor": next_cursor}
+
+def _filtered(query, model, time_column, topic=None, difficulty=None, since=None, until=None):
+    if topic:
+        query = query.filter(model.topic == topic)
+    if difficulty:
+        query = query.filter(model.difficulty == difficulty)
+    if since:
+        query = query.filter(time_column >= since)
+    if until:
+        query = query.filter(time_column < until)
+    return query
+
+def _email(user):
+    return user.email if user else None
+
+def attempts_page(user_id=None, topic=None, difficulty=None, since=None, until=None, cursor=None,
+                  limit=DEFAULT_PAGE_SIZE):
+    """A page of answered questions, newest first; all users when user_id is None"""
+    query = Performance.query
+    if user_id is not None:
+        query = query.filter(Performance.user_id == user_id)
+    else:
+        # One joined query instead of a user lookup per row
+        query = query.options(joinedload(Performance.user))
+    query = _filtered(query, Performance, Performance.created_at, topic, difficulty, since, until)
+
+    def serialize(p):
+        item = {
+            "id": p.id,
+            "topic": p.topic,
+            "difficulty": p.difficulty,
+            "question_text": p.question_text,
+            "user_answer": p.user_answer,
+            "correct_answer": p.correct_answer,
+            "is_correct": p.is_correct,
+            "question_id": p.question_id,
+            "time_taken": p.time_taken,
+            "created_at": p.created_at.isoformat()
+        }
+        if user_id is None:
+            item["user_email"] = _email(p.user)
+        return item
+
+    return _page(query, Performance.created_at, Performance.id, cursor, limit, serialize)
+
+def questions_page(topic=None, difficulty=None, since=None, until=None, user_id=None, cursor=None,
+                   limit=DEFAULT_PAGE_SIZE):
+    """A page of the generated-question archive, newest first"""
+    query = QuestionHistory.query.options(joinedload(QuestionHistory.generated_by))
+    if user_id is not None:
+        query = query.filter(QuestionHistory.generated_by_user_id == user_id)
+    query = _filtered(query, QuestionHistory, QuestionHistory.generated_at, topic, difficulty, since, until)
+
+    def serialize(q):
+        return {
+            "id": q.id,
+            "topic": q.topic,
+            "difficulty": q.difficulty,
+            "question_text": q.question_text,
+            "options": q.options,
+            "correct_answer": q.correct_answer,
+            "quarantined": q.quarantined,
+            "generated_at": q.generated_at.isoformat(),
+            "generated_by": _email(q.generated_by)
+        }
+
+    return _page(query, QuestionHistory.generated_at, QuestionHistory.id, cursor, limit, serialize)
+
+def sessions_page(user_id=None, since=None, until=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """A page of login sessions, newest first"""
+    query = UserSession.query.options(joinedload(UserSession.user))
+    if user_id is not None:
+        query = query.filter(UserSession.user_id == user_id)
+    if since:
+        query = query.filter(UserSession.login_time >= since)
+    if until:
+        query = query.filter(UserSession.login_time < until)
+
+    def serialize(s):
+        return {
+            "id": s.id,
+            "user_email": _email(s.user),
+            "login_time": s.login_time.isoformat(),
+            "logout_time": s.logout_time.isoformat() if s.logout_time else None,
+            "last_seen": s.last_seen.isoformat() if s.last_seen else None,
+            "ip_address": s.ip_address,
+            "is_active": s.is_active
+        }
+
+    return _page(query, UserSession.login_time, UserSession.id, cursor, limit, serialize)
+
+def users_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """A page of users, newest first"""
+    def serialize(u):
+        return {
+            "id": u.id,
+            "email": u.email,
+            "first_name": u.first_name,
+            "last_name": u.last_name,
+            "role": u.role,
+            "created_at": u.created_at.isoformat(),
+            "last_login": u.last_login.isoformat() if u.last_login else None
+        }
+
+    return _page(User.query, User.created_at, User.id, cursor, limit, serialize)
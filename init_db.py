@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Database initialization script for Maths Generator App
-Run this script to create the database and tables
+Run this script to create the database and tables, and before each deploy to apply migrations
 """
 
 import os
@@ -11,23 +11,31 @@ from datetime import datetime
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
-from models import User, UserSession, Performance, QuestionHistory
+from database import create_db_app, upgrade_schema
+from models import db, User, UserSession, PendingSession, Performance, QuestionHistory, PerformanceAggregate, LLMUsage
+from aggregates import rebuild_aggregates
+
+# Only the database is configured; the web app, OAuth and LLM client are not loaded
+app = create_db_app()
 
 def init_database():
     """Initialize the database and create all tables"""
     with app.app_context():
         print("Creating database tables...")
         
-        # Create all tables
-        db.create_all()
+        # Create missing tables, then apply migrations (e.g. indexes) to tables that already existed
+        upgrade_schema()
+        backfill_aggregates()
         
         print("✅ Database tables created successfully!")
         print(f"📊 Created tables:")
         print(f"   - {User.__tablename__}")
         print(f"   - {UserSession.__tablename__}")
+        print(f"   - {PendingSession.__tablename__}")
         print(f"   - {Performance.__tablename__}")
         print(f"   - {QuestionHistory.__tablename__}")
+        print(f"   - {PerformanceAggregate.__tablename__}")
+        print(f"   - {LLMUsage.__tablename__}")
         
         # Check if we can connect to the database
         try:
@@ -41,6 +49,13 @@ def init_database():
         
         return True
 
+def backfill_aggregates():
+    """Fill performance_aggregates from performances when it is empty, e.g. on a database that predates it"""
+    if PerformanceAggregate.query.first() is None and Performance.query.first() is not None:
+        print("Backfilling performance aggregates...")
+        count = rebuild_aggregates()
+        print(f"✅ Built {count} aggregate rows")
+
 def create_sample_data():
     """Create sample data for testing (optional)"""
     with app.app_context():
@@ -72,7 +87,9 @@ if __name__ == "__main__":
     print("=" * 50)
     
     if init_database():
-        create_sample_data()
+        # Deploys run with --no-sample-data so production never gets the sample user
+        if "--no-sample-data" not in sys.argv:
+            create_sample_data()
         print("\n🎉 Database initialization completed successfully!")
         print("\nYou can now run your Flask app with:")
         print("   python3 app.py")
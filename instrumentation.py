@@ -0,0 +1,227 @@
+"""
+Instrumentation for Maths Generator App
+Prometheus counters and histograms for the hot paths, and leveled, sampled logging written off the request thread
+"""
+
+import os
+import sys
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Share of records kept from high-volume loggers such as prompts and raw LLM output
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Seconds; covers local questions (~1 ms) up to slow LLM completions
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_gauge_sources = []
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labels:
+            values[()] = 0
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, key)} {_number(value)}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the with block, even if it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            series = {key: (list(counts), count, total) for key, (counts, count, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, count, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labels + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(total)}")
+        return lines
+
+request_seconds = Histogram(
+    "mathsgen_request_duration_seconds", "Time to build a response, by route and status", ("route", "method", "status")
+)
+stage_seconds = Histogram(
+    "mathsgen_stage_duration_seconds", "Time spent in one stage of a request or background job", ("stage",)
+)
+errors_total = Counter("mathsgen_errors_total", "Errors returned to clients or raised by background jobs", ("where",))
+log_dropped_total = Counter("mathsgen_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+def timer(stage):
+    """Time a stage of the hot path into mathsgen_stage_duration_seconds"""
+    return stage_seconds.time(stage=stage)
+
+def register_gauges(prefix, source):
+    """Export the top-level numbers of a stats() callable as gauges named mathsgen_<prefix>_<key>"""
+    _gauge_sources.append((prefix, source))
+
+def _render_gauges():
+    lines = []
+    for prefix, source in _gauge_sources:
+        try:
+            stats = source()
+        except Exception as e:
+            get_logger("metrics").warning("Reading %s stats failed: %s", prefix, e)
+            continue
+        for key, value in sorted(stats.items()):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"mathsgen_{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+    return lines
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(_render_gauges())
+    return "\n".join(lines) + "\n"
+
+def init_app(app):
+    """Record the latency of every request into mathsgen_request_duration_seconds"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            request_seconds.observe(
+                time.perf_counter() - started, route=route, method=request.method, status=response.status_code
+            )
+        return response
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue records for the listener thread; drop them rather than block when the queue is full"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_dropped_total.inc()
+
+class _SampleFilter(logging.Filter):
+    """Keep a random share of records below WARNING"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+_log_queue = queue.Queue(LOG_QUEUE_SIZE)
+_listener = None
+_listener_pid = None
+_root = logging.getLogger("mathsgen")
+
+def start_logging():
+    """Start the thread that writes queued records to stdout (again after a fork)"""
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    _listener_pid = os.getpid()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(_log_queue, handler)
+    _listener.start()
+
+def _stop_logging():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+def get_logger(name, sampled=False):
+    """A logger under mathsgen; sampled loggers keep LOG_SAMPLE_RATE of their records below WARNING"""
+    logger = logging.getLogger(f"mathsgen.{name}")
+    if sampled and not any(isinstance(f, _SampleFilter) for f in logger.filters):
+        logger.addFilter(_SampleFilter(LOG_SAMPLE_RATE))
+    return logger
+
+_root.setLevel(LOG_LEVEL)
+_root.propagate = False
+_root.addHandler(_DroppingQueueHandler(_log_queue))
+start_logging()
+atexit.register(_stop_logging)
@@ -0,0 +1,297 @@
+"""
+Async LLM engine for Maths Generator App
+Runs one asyncio loop in a background thread that owns a long-lived DeepSeek client
+"""
+
+import os
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from resilience import ResiliencePolicy, LLMUnavailable, LLM_ATTEMPT_TIMEOUT, retryable_errors
+from instrumentation import get_logger, stage_seconds
+
+API_KEY = os.environ.get("API_KEY", "sk-2b91306525ae497ca872f7bc7df5421d")
+BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.deepseek.com")
+
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 16))
+LLM_MAX_IN_FLIGHT_PER_TOPIC = int(os.environ.get("LLM_MAX_IN_FLIGHT_PER_TOPIC", 4))
+# Callers waiting on the LLM hold a gunicorn thread each, so some threads are always left for other routes
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", 8))
+LLM_FREE_THREADS = int(os.environ.get("LLM_FREE_THREADS", 2))
+LLM_MAX_QUEUED = int(os.environ.get("LLM_MAX_QUEUED", max(1, GUNICORN_THREADS - LLM_FREE_THREADS)))
+# 0 waits for the retry policy's whole budget plus LLM_QUEUE_WAIT_SECONDS, so the policy always gives up first
+LLM_WAIT_TIMEOUT = float(os.environ.get("LLM_WAIT_TIMEOUT", 0))
+LLM_QUEUE_WAIT_SECONDS = float(os.environ.get("LLM_QUEUE_WAIT_SECONDS", 10))
+LLM_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_KEEPALIVE_CONNECTIONS", 20))
+
+log = get_logger("llm_engine")
+
+class EngineBusy(Exception):
+    """Raised when too many LLM calls are already waiting"""
+
+class LLMEngine:
+    """Shared client, concurrency limits and request coalescing for LLM calls"""
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, max_per_topic=LLM_MAX_IN_FLIGHT_PER_TOPIC,
+                 max_queued=LLM_MAX_QUEUED):
+        self.max_in_flight = max_in_flight
+        self.max_per_topic = max_per_topic
+        self.max_queued = max_queued
+        self._loop = None
+        self._pid = None
+        self._client = None
+        self._global_sem = None
+        self._topic_sems = {}
+        self._in_flight = {}
+        self.policy = ResiliencePolicy()
+        self.wait_timeout = max(LLM_WAIT_TIMEOUT, self.policy.total_seconds() + LLM_QUEUE_WAIT_SECONDS)
+        # Called as on_usage(user_id, topic, prompt_tokens, completion_tokens) after each completion,
+        # on its own thread so a slow callback never holds up the event loop
+        self.on_usage = None
+        self._usage_executor = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "errors": 0,
+            "pending": 0,
+            "streams": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "upstream_seconds_total": 0.0,
+            "first_chunk_seconds_total": 0.0
+        }
+
+    def start(self):
+        """Start the event loop thread (idempotent)"""
+        with self._start_lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return
+            # A loop inherited through fork has no thread behind it; start afresh
+            self._client = None
+            self._topic_sems = {}
+            self._in_flight = {}
+            self._usage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-usage")
+            self._pid = os.getpid()
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._global_sem = asyncio.Semaphore(self.max_in_flight)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name="llm-engine", daemon=True).start()
+            ready.wait()
+            self._loop = loop
+
+    def _get_client(self):
+        # Only ever called on the engine loop, so no locking is needed
+        if self._client is None:
+            # Imported on the first LLM call rather than at startup, which it would slow by over half a second
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            try:
+                import httpx
+            except ImportError:  # newer openai releases ship httpx2
+                import httpx2 as httpx
+
+            self._client = AsyncOpenAI(
+                api_key=API_KEY,
+                base_url=BASE_URL,
+                # Retries and deadlines are owned by the resilience policy
+                max_retries=0,
+                timeout=LLM_ATTEMPT_TIMEOUT,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_in_flight,
+                        max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=30.0
+                    )
+                )
+            )
+        return self._client
+
+    def _topic_sem(self, topic):
+        sem = self._topic_sems.get(topic)
+        if sem is None:
+            sem = self._topic_sems[topic] = asyncio.Semaphore(self.max_per_topic)
+        return sem
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def _record_usage(self, user_id, topic, usage):
+        self._count("prompt_tokens", usage.prompt_tokens)
+        self._count("completion_tokens", usage.completion_tokens)
+        if self.on_usage is not None:
+            self._usage_executor.submit(self._on_usage, user_id, topic, usage.prompt_tokens, usage.completion_tokens)
+
+    def _on_usage(self, user_id, topic, prompt_tokens, completion_tokens):
+        try:
+            self.on_usage(user_id, topic, prompt_tokens, completion_tokens)
+        except Exception as e:
+            log.warning("Recording LLM usage failed: %s", e)
+
+    async def _call(self, messages, topic, user_id, kwargs):
+        async with self._global_sem, self._topic_sem(topic):
+            started = time.perf_counter()
+            client = self._get_client()
+            try:
+                response = await self.policy.run(lambda: client.chat.completions.create(
+                    model="deepseek-chat",
+                    messages=messages,
+                    **kwargs
+                ))
+            except Exception:
+                self._count("errors")
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self._count("upstream_seconds_total", elapsed)
+                stage_seconds.observe(elapsed, stage="llm_upstream")
+            self._count("calls")
+            if response.usage is not None:
+                self._record_usage(user_id, topic, response.usage)
+            return response.choices[0].message.content
+
+    async def _complete(self, messages, topic, coalesce_key, user_id, kwargs):
+        if coalesce_key is None:
+            return await self._call(messages, topic, user_id, kwargs)
+
+        # Callers asking for the same key while a call is running share its result
+        future = self._in_flight.get(coalesce_key)
+        if future is not None:
+            self._count("coalesced")
+            return await asyncio.shield(future)
+
+        future = self._loop.create_future()
+        self._in_flight[coalesce_key] = future
+        try:
+            # Usage is charged to the caller that started the shared call
+            result = await self._call(messages, topic, user_id, kwargs)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[coalesce_key]
+
+    async def acomplete(self, messages, topic="", coalesce_key=None, user_id=None, **kwargs):
+        """Run a chat completion from code already on the engine loop"""
+        return await self._complete(messages, topic, coalesce_key, user_id, kwargs)
+
+    def complete(self, messages, topic="", coalesce_key=None, user_id=None, timeout=None, **kwargs):
+        """Run a chat completion on the engine loop and wait for the message content"""
+        self.start()
+        with self._stats_lock:
+            if self._stats["pending"] >= self.max_queued:
+                self._stats["rejected"] += 1
+                raise EngineBusy("Too many questions are being generated, please try again")
+            self._stats["pending"] += 1
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                self._complete(messages, topic, coalesce_key, user_id, kwargs), self._loop
+            )
+            try:
+                return future.result(timeout or self.wait_timeout)
+            except TimeoutError as e:
+                # Callers fall back to stored questions on LLMUnavailable
+                future.cancel()
+                raise LLMUnavailable("Timed out waiting for the LLM") from e
+        finally:
+            self._count("pending", -1)
+
+    async def _stream(self, messages, topic, user_id, kwargs, out):
+        try:
+            async with self._global_sem, self._topic_sem(topic):
+                # Streams are not retried or hedged, but still respect the circuit breaker
+                breaker = self.policy.breaker
+                breaker.allow()
+                started = time.perf_counter()
+                try:
+                    try:
+                        stream = await asyncio.wait_for(self._get_client().chat.completions.create(
+                            model="deepseek-chat",
+                            messages=messages,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                            **kwargs
+                        ), LLM_ATTEMPT_TIMEOUT)
+                    except retryable_errors() as e:
+                        breaker.record_failure()
+                        raise LLMUnavailable(f"LLM stream failed to start: {e!r}") from e
+                    except asyncio.CancelledError:
+                        breaker.release()
+                        raise
+                    breaker.record_success()
+                    first = True
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            self._record_usage(user_id, topic, chunk.usage)
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if not delta:
+                            continue
+                        if first:
+                            first = False
+                            self._count("first_chunk_seconds_total", time.perf_counter() - started)
+                        out.put(delta)
+                finally:
+                    self._count("upstream_seconds_total", time.perf_counter() - started)
+                self._count("streams")
+        except Exception as e:
+            self._count("errors")
+            out.put(e)
+        finally:
+            out.put(None)
+
+    def stream(self, messages, topic="", user_id=None, timeout=None, **kwargs):
+        """Run a streamed chat completion on the engine loop, yielding content chunks"""
+        self.start()
+        with self._stats_lock:
+            if self._stats["pending"] >= self.max_queued:
+                self._stats["rejected"] += 1
+                raise EngineBusy("Too many questions are being generated, please try again")
+            self._stats["pending"] += 1
+
+        out = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._stream(messages, topic, user_id, kwargs, out), self._loop)
+        try:
+            while True:
+                try:
+                    item = out.get(timeout=timeout or self.wait_timeout)
+                except queue.Empty:
+                    raise LLMUnavailable("LLM stream stalled")
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stops the upstream request if the client went away early
+            future.cancel()
+            self._count("pending", -1)
+
+    def stats(self):
+        """Return call, coalescing and queue counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["max_in_flight"] = self.max_in_flight
+        stats["max_in_flight_per_topic"] = self.max_per_topic
+        stats["wait_timeout_seconds"] = self.wait_timeout
+        stats["resilience"] = self.policy.stats()
+        return stats
+
+engine = LLMEngine()
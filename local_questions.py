@@ -0,0 +1,233 @@
+"""
+Local question engine for Maths Generator App
+Builds factorization and index-law questions algorithmically, without calling the LLM
+"""
+
+import random
+
+IDENTITIES = "identities"
+CROSS_METHOD = "cross_method"
+INDICES = "indices"
+
+def local_topic(topic):
+    """Return the local generator kind for a topic, or None for free-form topics"""
+    topic = topic.lower()
+    if "factorization using cross method" in topic:
+        return CROSS_METHOD
+    if "positive integral indices" in topic:
+        return INDICES
+    if "factorization" in topic:
+        return IDENTITIES
+    return None
+
+# Polynomials in x and y are dicts of {(power of x, power of y): coefficient}
+
+def _poly_mul(a, b):
+    result = {}
+    for (ax, ay), ac in a.items():
+        for (bx, by), bc in b.items():
+            key = (ax + bx, ay + by)
+            result[key] = result.get(key, 0) + ac * bc
+    return {k: c for k, c in result.items() if c}
+
+def _poly_add(a, b):
+    result = dict(a)
+    for key, c in b.items():
+        result[key] = result.get(key, 0) + c
+    return {k: c for k, c in result.items() if c}
+
+def _poly_pow(a, n):
+    result = {(0, 0): 1}
+    for _ in range(n):
+        result = _poly_mul(result, a)
+    return result
+
+def _linear(x=0, y=0, c=0):
+    """Polynomial x*x + y*y + c"""
+    return {k: v for k, v in {(1, 0): x, (0, 1): y, (0, 0): c}.items() if v}
+
+def _monomial(coeff, px, py):
+    if px == 0 and py == 0:
+        return str(coeff)
+    text = "" if coeff == 1 else "-" if coeff == -1 else str(coeff)
+    for var, power in (("x", px), ("y", py)):
+        if power == 1:
+            text += var
+        elif power > 1:
+            text += f"{var}^{power}"
+    return text
+
+def format_poly(poly):
+    """Format a polynomial with terms in descending degree, e.g. 4x^2 + 4x + 1 - y^2"""
+    terms = sorted(poly.items(), key=lambda kv: (-(kv[0][0] + kv[0][1]), -kv[0][0]))
+    text = ""
+    for (px, py), coeff in terms:
+        term = _monomial(abs(coeff), px, py)
+        if not text:
+            text = term if coeff > 0 else f"-{term}"
+        else:
+            text += f" + {term}" if coeff > 0 else f" - {term}"
+    return text or "0"
+
+def _factor(poly, power=1):
+    text = f"({format_poly(poly)})"
+    return f"{text}^{power}" if power > 1 else text
+
+def _product(factors, coeff=1):
+    """Format and expand a product of (polynomial, power) factors"""
+    expanded = {(0, 0): coeff}
+    text = "" if coeff == 1 else str(coeff)
+    for poly, power in factors:
+        expanded = _poly_mul(expanded, _poly_pow(poly, power))
+        text += _factor(poly, power)
+    return text, expanded
+
+def _build(question, answer, distractors, rng):
+    """Assemble options from the answer and distractors that are not equivalent to it"""
+    answer_text, answer_value = answer
+    options = [answer_text]
+    values = [answer_value]
+    for text, value in distractors:
+        if len(options) == 4:
+            break
+        if text in options or value in values:
+            continue
+        options.append(text)
+        values.append(value)
+    if len(options) < 4:
+        return None
+    rng.shuffle(options)
+    return {"question": question, "options": options, "correct_answer": answer_text}
+
+def _nonzero(rng, low, high):
+    return rng.choice([n for n in range(low, high + 1) if n != 0])
+
+def _identities_question(difficulty, rng):
+    a = rng.randint(1, 2) if difficulty == "easy" else rng.randint(1, 4)
+    b = _nonzero(rng, -9, 9)
+
+    if difficulty == "challenging":
+        # (ax + b)^2 - (cy)^2 = (ax + b + cy)(ax + b - cy)
+        c = rng.randint(1, 3)
+        expanded = _poly_add(_poly_pow(_linear(x=a, c=b), 2), {(0, 2): -c * c})
+        answer = _product([(_linear(x=a, y=c, c=b), 1), (_linear(x=a, y=-c, c=b), 1)])
+        distractors = [
+            _product([(_linear(x=a, y=c, c=-b), 1), (_linear(x=a, y=-c, c=-b), 1)]),
+            _product([(_linear(x=a, y=-c, c=b), 2)]),
+            _product([(_linear(x=a, c=b), 1), (_linear(x=a, y=-c, c=b), 1)]),
+            _product([(_linear(x=a, y=c, c=b), 1), (_linear(x=a, y=c, c=-b), 1)]),
+        ]
+    elif rng.random() < 0.5:
+        # Perfect square: a^2x^2 + 2abx + b^2 = (ax + b)^2
+        expanded = _poly_pow(_linear(x=a, c=b), 2)
+        answer = _product([(_linear(x=a, c=b), 2)])
+        distractors = [
+            _product([(_linear(x=a, c=-b), 2)]),
+            _product([(_linear(x=a, c=b), 1), (_linear(x=a, c=-b), 1)]),
+            _product([(_linear(x=a, c=2 * b), 2)]),
+            _product([(_linear(x=a * a, c=b), 2)]),
+        ]
+    else:
+        # Difference of two squares: a^2x^2 - b^2y^2 = (ax + by)(ax - by)
+        b = abs(b)
+        var_y = difficulty != "easy"
+        plus = _linear(x=a, y=b) if var_y else _linear(x=a, c=b)
+        minus = _linear(x=a, y=-b) if var_y else _linear(x=a, c=-b)
+        expanded = _poly_mul(plus, minus)
+        answer = _product([(plus, 1), (minus, 1)])
+        distractors = [
+            _product([(minus, 2)]),
+            _product([(plus, 2)]),
+            _product([(_linear(x=a * a, y=b) if var_y else _linear(x=a * a, c=b), 1),
+                      (_linear(x=a * a, y=-b) if var_y else _linear(x=a * a, c=-b), 1)]),
+            _product([(plus, 1), (plus, 1)]),
+        ]
+
+    return _build(f"Factorize {format_poly(expanded)}.", answer, distractors, rng)
+
+def _cross_method_question(difficulty, rng):
+    # (px + q)(rx + s) = prx^2 + (ps + qr)x + qs
+    if difficulty == "easy":
+        p, r = 1, 1
+    elif difficulty == "medium":
+        p, r = rng.randint(2, 4), 1
+    else:
+        p, r = rng.randint(2, 5), rng.randint(2, 4)
+    q = _nonzero(rng, -9, 9)
+    s = _nonzero(rng, -9, 9)
+
+    first, second = _linear(x=p, c=q), _linear(x=r, c=s)
+    answer = _product([(first, 1), (second, 1)])
+    distractors = [
+        _product([(_linear(x=p, c=-q), 1), (_linear(x=r, c=-s), 1)]),
+        _product([(_linear(x=p, c=s), 1), (_linear(x=r, c=q), 1)]),
+        _product([(_linear(x=p, c=-q), 1), (second, 1)]),
+        _product([(first, 1), (_linear(x=r, c=-s), 1)]),
+        _product([(_linear(x=p, c=q + 1), 1), (_linear(x=r, c=s - 1), 1)]),
+    ]
+    expanded = answer[1]
+
+    return _build(f"Factorize {format_poly(expanded)} using the cross method.", answer, distractors, rng)
+
+def _power(var, n):
+    return var if n == 1 else f"{var}^{n}"
+
+def _indices_answer(px, py):
+    text = ""
+    if px:
+        text += _power("x", px)
+    if py:
+        text += _power("y", py)
+    return text, (px, py)
+
+def _indices_question(difficulty, rng):
+    if difficulty == "easy":
+        # x^a * x^b = x^(a + b)
+        a, b = rng.randint(2, 9), rng.randint(2, 9)
+        question = f"Simplify {_power('x', a)} * {_power('x', b)}."
+        answer = _indices_answer(a + b, 0)
+        distractors = [_indices_answer(a * b, 0), _indices_answer(a + b + 1, 0),
+                       _indices_answer(abs(a - b) or a + b + 2, 0), _indices_answer(a + b - 1, 0)]
+    elif difficulty == "medium":
+        # (x^a)^n * x^b = x^(an + b)
+        a, n, b = rng.randint(2, 5), rng.randint(2, 4), rng.randint(1, 6)
+        question = f"Simplify ({_power('x', a)})^{n} * {_power('x', b)}."
+        answer = _indices_answer(a * n + b, 0)
+        distractors = [_indices_answer(a + n + b, 0), _indices_answer(a * n * b, 0),
+                       _indices_answer(a * (n + b), 0), _indices_answer(a * n + b + 1, 0)]
+    else:
+        # (x^a y^b)^n / (x^c y^d)^m = x^(an - cm) y^(bn - dm)
+        while True:
+            a, b, n = rng.randint(2, 5), rng.randint(1, 4), rng.randint(2, 4)
+            c, d, m = rng.randint(1, 4), rng.randint(1, 3), rng.randint(2, 3)
+            px, py = a * n - c * m, b * n - d * m
+            if px > 0 and py > 0:
+                break
+        question = f"Simplify ({_power('x', a)} * {_power('y', b)})^{n} / ({_power('x', c)} * {_power('y', d)})^{m}."
+        answer = _indices_answer(px, py)
+        distractors = [_indices_answer(a + n - c - m, b + n - d - m) if a + n > c + m and b + n > d + m else _indices_answer(px + n, py),
+                       _indices_answer(a * n + c * m, b * n + d * m), _indices_answer(px, py + 1),
+                       _indices_answer(px - 1 or px + 2, py), _indices_answer(a * n - c, b * n - d)]
+        distractors = [item for item in distractors if item[1][0] > 0 and item[1][1] > 0]
+
+    return _build(question, answer, distractors, rng)
+
+GENERATORS = {
+    IDENTITIES: _identities_question,
+    CROSS_METHOD: _cross_method_question,
+    INDICES: _indices_question,
+}
+
+def generate_local_question(topic, difficulty, seed=None):
+    """Generate a question for an algorithmic topic; the same seed gives the same question"""
+    kind = local_topic(topic)
+    if kind is None:
+        raise ValueError(f"No local generator for topic '{topic}'")
+
+    rng = random.Random(seed)
+    difficulty = difficulty.lower()
+    while True:
+        item = GENERATORS[kind](difficulty, rng)
+        # Rare parameter choices leave too few distinct distractors; draw again
+        if item is not None:
+            return item
@@ -6,95 +6,116 @@ Useful for viewing and managing database records
 
 import os
 import sys
-from datetime import datetime
 
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
-from models import User, UserSession, Performance, QuestionHistory
+from database import create_db_app
+from models import User, PerformanceAggregate
+from aggregates import rebuild_aggregates, summarize
+from history import attempts_page, questions_page, sessions_page, users_page
+from grading import audit_archive
+
+# Only the database is configured; the web app, OAuth and LLM client are not loaded
+app = create_db_app(migrations=False)
+
+def show_pages(fetch, show, title):
+    """Print pages from a history function until the user stops or there are no more"""
+    cursor = None
+    shown = 0
+    print(f"\n{title}")
+    print("=" * 80)
+    while True:
+        page = fetch(cursor)
+        for item in page["items"]:
+            show(item)
+            print("-" * 40)
+        shown += len(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            print(f"({shown} shown)")
+            return
+        if input(f"({shown} shown) Enter for more, q to stop: ").strip().lower() == "q":
+            return
 
 def view_users():
-    """Display all users in the database"""
+    """Display users in the database, a page at a time"""
+    def show(user):
+        print(f"ID: {user['id']}")
+        print(f"Email: {user['email']}")
+        print(f"Name: {user['first_name']} {user['last_name']}")
+        print(f"Role: {user['role']}")
+        print(f"Created: {user['created_at']}")
+        print(f"Last Login: {user['last_login']}")
+
     with app.app_context():
-        users = User.query.all()
-        print(f"\n👥 Users in Database ({len(users)} total):")
-        print("=" * 80)
-        for user in users:
-            print(f"ID: {user.id}")
-            print(f"Email: {user.email}")
-            print(f"Name: {user.first_name} {user.last_name}")
-            print(f"Role: {user.role}")
-            print(f"Created: {user.created_at}")
-            print(f"Last Login: {user.last_login}")
-            print("-" * 40)
+        print(f"\n👥 Users in Database ({User.query.count()} total)")
+        show_pages(lambda cursor: users_page(cursor=cursor), show, "Newest first:")
 
 def view_sessions():
-    """Display recent user sessions"""
+    """Display user sessions, newest first"""
+    def show(session):
+        print(f"User: {session['user_email'] or 'Unknown'}")
+        print(f"Login: {session['login_time']}")
+        print(f"Logout: {session['logout_time'] or 'Active'}")
+        print(f"Last Seen: {session['last_seen'] or 'Unknown'}")
+        print(f"IP: {session['ip_address']}")
+        print(f"Active: {session['is_active']}")
+
     with app.app_context():
-        sessions = UserSession.query.order_by(UserSession.login_time.desc()).limit(20).all()
-        print(f"\n🔐 Recent Sessions ({len(sessions)} total):")
-        print("=" * 80)
-        for session in sessions:
-            user = User.query.get(session.user_id)
-            print(f"User: {user.email if user else 'Unknown'}")
-            print(f"Login: {session.login_time}")
-            print(f"Logout: {session.logout_time or 'Active'}")
-            print(f"IP: {session.ip_address}")
-            print(f"Active: {session.is_active}")
-            print("-" * 40)
+        show_pages(lambda cursor: sessions_page(cursor=cursor), show, "🔐 Recent Sessions")
 
 def view_performance():
     """Display performance statistics"""
     with app.app_context():
-        performances = Performance.query.all()
-        print(f"\n📊 Performance Data ({len(performances)} total):")
+        # Totals come from the aggregates instead of loading every Performance row
+        overall, topics = summarize(PerformanceAggregate.query.all())
+        print(f"\n📊 Performance Data ({overall['total']} total):")
         print("=" * 80)
         
-        if performances:
-            # Overall stats
-            correct = len([p for p in performances if p.is_correct])
-            accuracy = (correct / len(performances)) * 100
-            print(f"Overall Accuracy: {accuracy:.2f}% ({correct}/{len(performances)})")
-            
-            # By topic
-            topics = {}
-            for p in performances:
-                if p.topic not in topics:
-                    topics[p.topic] = {'total': 0, 'correct': 0}
-                topics[p.topic]['total'] += 1
-                if p.is_correct:
-                    topics[p.topic]['correct'] += 1
+        if overall["total"]:
+            print(f"Overall Accuracy: {overall['accuracy']:.2f}% ({overall['correct']}/{overall['total']})")
             
             print("\n📈 Performance by Topic:")
             for topic, stats in topics.items():
-                topic_accuracy = (stats['correct'] / stats['total']) * 100
-                print(f"  {topic}: {topic_accuracy:.1f}% ({stats['correct']}/{stats['total']})")
+                print(f"  {topic}: {stats['accuracy']:.1f}% ({stats['correct']}/{stats['total']})")
             
-            # Recent attempts
-            recent = Performance.query.order_by(Performance.created_at.desc()).limit(10).all()
+            # Recent attempts, with their users joined in the same query
+            recent = attempts_page(limit=10)
             print(f"\n🕒 Recent Attempts:")
-            for p in recent:
-                user = User.query.get(p.user_id)
-                status = "✅" if p.is_correct else "❌"
-                print(f"  {status} {user.email if user else 'Unknown'} - {p.topic} ({p.difficulty})")
+            for p in recent["items"]:
+                status = "✅" if p["is_correct"] else "❌"
+                print(f"  {status} {p['user_email'] or 'Unknown'} - {p['topic']} ({p['difficulty']})")
         else:
             print("No performance data yet.")
 
 def view_questions():
-    """Display question history"""
+    """Display question history, optionally for one topic"""
+    topic = input("Topic (blank for all): ").strip() or None
+
+    def show(q):
+        print(f"Topic: {q['topic']}")
+        print(f"Difficulty: {q['difficulty']}")
+        print(f"Question: {q['question_text'][:100]}...")
+        print(f"Generated by: {q['generated_by'] or 'System'}")
+        print(f"Time: {q['generated_at']}")
+
     with app.app_context():
-        questions = QuestionHistory.query.order_by(QuestionHistory.generated_at.desc()).limit(20).all()
-        print(f"\n❓ Recent Questions ({len(questions)} total):")
-        print("=" * 80)
-        for q in questions:
-            user = User.query.get(q.generated_by_user_id) if q.generated_by_user_id else None
-            print(f"Topic: {q.topic}")
-            print(f"Difficulty: {q.difficulty}")
-            print(f"Question: {q.question_text[:100]}...")
-            print(f"Generated by: {user.email if user else 'System'}")
-            print(f"Time: {q.generated_at}")
-            print("-" * 40)
+        show_pages(lambda cursor: questions_page(topic=topic, cursor=cursor), show, "❓ Recent Questions")
+
+def rebuild_performance_aggregates():
+    """Recompute performance aggregates from existing Performance rows"""
+    with app.app_context():
+        print("\n🔁 Rebuilding performance aggregates...")
+        count = rebuild_aggregates()
+        print(f"✅ Rebuilt {count} aggregate rows")
+
+def audit_answer_keys():
+    """Re-check stored answer keys and quarantine questions whose key is wrong"""
+    with app.app_context():
+        print("\n🔍 Auditing answer keys...")
+        checked, quarantined = audit_archive()
+        print(f"✅ Checked {checked} questions, quarantined {quarantined}")
 
 def main():
     """Main menu for database management"""
@@ -105,9 +126,11 @@ def main():
         print("2. View Sessions")
         print("3. View Performance")
         print("4. View Questions")
-        print("5. Exit")
+        print("5. Rebuild Performance Aggregates")
+        print("6. Audit Answer Keys")
+        print("7. Exit")
         
-        choice = input("\nEnter your choice (1-5): ").strip()
+        choice = input("\nEnter your choice (1-7): ").strip()
         
         if choice == '1':
             view_users()
@@ -118,12 +141,23 @@ def main():
         elif choice == '4':
             view_questions()
         elif choice == '5':
+            rebuild_performance_aggregates()
+        elif choice == '6':
+            audit_answer_keys()
+        elif choice == '7':
             print("Goodbye! 👋")
             break
         else:
             print("Invalid choice. Please try again.")
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild-aggregates"]:
+        rebuild_performance_aggregates()
+        sys.exit(0)
+    if sys.argv[1:] == ["audit-keys"]:
+        audit_answer_keys()
+        sys.exit(0)
+    
     print("🗄️  Maths Generator Database Management")
     print("=" * 40)
     main()
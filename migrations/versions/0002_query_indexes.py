@@ -0,0 +1,38 @@
+"""Add indexes for hot queries
+
+Revision ID: 0002_query_indexes
+Revises: 0001_initial_schema
+Create Date: 2026-10-17 14:14:51.045048
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_query_indexes'
+down_revision = '0001_initial_schema'
+branch_labels = None
+depends_on = None
+
+
+# Tables created by db.create_all() may already have these indexes
+INDEXES = [
+    ('ix_performances_created_at', 'performances', ['created_at']),
+    ('ix_performances_user_id_created_at', 'performances', ['user_id', 'created_at']),
+    ('ix_question_history_generated_at', 'question_history', ['generated_at']),
+    ('ix_question_history_topic_difficulty_generated_at', 'question_history', ['topic', 'difficulty', 'generated_at']),
+    ('ix_question_history_user_generated_at', 'question_history', ['generated_by_user_id', 'generated_at']),
+    ('ix_user_sessions_login_time', 'user_sessions', ['login_time']),
+    ('ix_user_sessions_user_id', 'user_sessions', ['user_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
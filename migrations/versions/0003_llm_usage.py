@@ -0,0 +1,36 @@
+"""Add daily LLM usage table
+
+Revision ID: 0003_llm_usage
+Revises: 0002_query_indexes
+Create Date: 2026-10-17 18:02:37.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_llm_usage'
+down_revision = '0002_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() may already have created the table
+    op.create_table('llm_usage',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.String(length=36), nullable=False),
+    sa.Column('topic', sa.String(length=100), nullable=False),
+    sa.Column('calls', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('completion_tokens', sa.Integer(), nullable=False),
+    sa.Column('cost_usd', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('day', 'user_id', 'topic'),
+    if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('llm_usage', if_exists=True)
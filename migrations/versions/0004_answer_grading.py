@@ -0,0 +1,37 @@
+"""Add question quarantine flag and graded question id
+
+Revision ID: 0004_answer_grading
+Revises: 0003_llm_usage
+Create Date: 2026-10-17 19:40:12.208114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_answer_grading'
+down_revision = '0003_llm_usage'
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    # db.create_all() may already have created the columns
+    if 'quarantined' not in _columns('question_history'):
+        with op.batch_alter_table('question_history') as batch_op:
+            batch_op.add_column(sa.Column('quarantined', sa.Boolean(), nullable=False, server_default=sa.false()))
+    if 'question_id' not in _columns('performances'):
+        with op.batch_alter_table('performances') as batch_op:
+            batch_op.add_column(sa.Column('question_id', sa.String(length=36), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('performances') as batch_op:
+        batch_op.drop_column('question_id')
+    with op.batch_alter_table('question_history') as batch_op:
+        batch_op.drop_column('quarantined')
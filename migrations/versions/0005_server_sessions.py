@@ -0,0 +1,50 @@
+"""Add server-side session data, last seen time and active session indexes
+
+Revision ID: 0005_server_sessions
+Revises: 0004_answer_grading
+Create Date: 2026-10-17 21:05:37.614220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_server_sessions'
+down_revision = '0004_answer_grading'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_user_sessions_user_id_is_active', 'user_sessions', ['user_id', 'is_active']),
+    ('ix_user_sessions_is_active_last_seen', 'user_sessions', ['is_active', 'last_seen']),
+]
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    # db.create_all() may already have created the columns
+    columns = _columns('user_sessions')
+    with op.batch_alter_table('user_sessions') as batch_op:
+        if 'last_seen' not in columns:
+            batch_op.add_column(sa.Column('last_seen', sa.DateTime(), nullable=True))
+        if 'data' not in columns:
+            batch_op.add_column(sa.Column('data', sa.JSON(), nullable=True))
+
+    # Older sessions were last seen at login, so the sweeper expires them after the idle timeout
+    op.execute("UPDATE user_sessions SET last_seen = login_time WHERE last_seen IS NULL")
+
+    for name, table, index_columns in INDEXES:
+        op.create_index(name, table, index_columns, unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
+    with op.batch_alter_table('user_sessions') as batch_op:
+        batch_op.drop_column('data')
+        batch_op.drop_column('last_seen')
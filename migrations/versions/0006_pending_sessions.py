@@ -0,0 +1,34 @@
+"""Add a table for sessions that have not logged in yet
+
+Revision ID: 0006_pending_sessions
+Revises: 0005_server_sessions
+Create Date: 2026-10-17 23:12:08.530117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_pending_sessions'
+down_revision = '0005_server_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() may already have created the table
+    op.create_table(
+        'pending_sessions',
+        sa.Column('token', sa.String(length=64), nullable=False),
+        sa.Column('data', sa.JSON(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('token'),
+        if_not_exists=True
+    )
+    op.create_index('ix_pending_sessions_expires_at', 'pending_sessions', ['expires_at'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_pending_sessions_expires_at', table_name='pending_sessions', if_exists=True)
+    op.drop_table('pending_sessions')
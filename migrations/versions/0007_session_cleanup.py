@@ -0,0 +1,40 @@
+"""Drop the user_sessions user_id index and remove stored OAuth tokens
+
+Revision ID: 0007_session_cleanup
+Revises: 0006_pending_sessions
+Create Date: 2026-10-17 23:48:51.207734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_session_cleanup'
+down_revision = '0006_pending_sessions'
+branch_labels = None
+depends_on = None
+
+
+SECRET_KEYS = ('google_oauth_token',)
+
+
+def _scrub(table):
+    """Rewrite session data without the OAuth token, which earlier versions stored"""
+    bind = op.get_bind()
+    key = table.c.token if 'token' in table.c else table.c.id
+    for row_key, data in bind.execute(sa.select(key, table.c.data).where(table.c.data.isnot(None))).all():
+        if any(secret in data for secret in SECRET_KEYS):
+            cleaned = {k: v for k, v in data.items() if k not in SECRET_KEYS}
+            bind.execute(table.update().where(key == row_key).values(data=cleaned))
+
+
+def upgrade():
+    # (user_id, is_active) covers lookups by user_id alone
+    op.drop_index('ix_user_sessions_user_id', table_name='user_sessions', if_exists=True)
+    _scrub(sa.table('user_sessions', sa.column('id', sa.String), sa.column('data', sa.JSON)))
+    _scrub(sa.table('pending_sessions', sa.column('token', sa.String), sa.column('data', sa.JSON)))
+
+
+def downgrade():
+    op.create_index('ix_user_sessions_user_id', 'user_sessions', ['user_id'], unique=False, if_not_exists=True)
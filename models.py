@@ -26,6 +26,12 @@ class User(db.Model):
 class UserSession(db.Model):
     """Session model to track user login sessions"""
     __tablename__ = 'user_sessions'
+    __table_args__ = (
+        db.Index('ix_user_sessions_login_time', 'login_time'),
+        # Also serves lookups by user_id alone
+        db.Index('ix_user_sessions_user_id_is_active', 'user_id', 'is_active'),
+        db.Index('ix_user_sessions_is_active_last_seen', 'is_active', 'last_seen'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
@@ -35,13 +41,33 @@ class UserSession(db.Model):
     ip_address = db.Column(db.String(45))  # IPv6 compatible
     user_agent = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)  # Written back in batches by the session sweeper
+    data = db.Column(db.JSON)  # Server-side session contents, never the OAuth token; the cookie only holds session_token
     
     def __repr__(self):
         return f'<UserSession {self.session_token[:8]}...>'
 
+class PendingSession(db.Model):
+    """A session that has not logged in yet, holding only the OAuth handshake"""
+    __tablename__ = 'pending_sessions'
+    __table_args__ = (
+        db.Index('ix_pending_sessions_expires_at', 'expires_at'),
+    )
+    
+    token = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<PendingSession {self.token[:8]}...>'
+
 class Performance(db.Model):
     """Performance model to track user performance on math questions"""
     __tablename__ = 'performances'
+    __table_args__ = (
+        db.Index('ix_performances_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_performances_created_at', 'created_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
@@ -53,6 +79,7 @@ class Performance(db.Model):
     is_correct = db.Column(db.Boolean, nullable=False)
     time_taken = db.Column(db.Float)  # Time in seconds
     attempt_number = db.Column(db.Integer, default=1)  # For retry attempts
+    question_id = db.Column(db.String(36), nullable=True)  # QuestionHistory row that was graded
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
@@ -61,6 +88,11 @@ class Performance(db.Model):
 class QuestionHistory(db.Model):
     """Model to track all questions generated for analytics"""
     __tablename__ = 'question_history'
+    __table_args__ = (
+        db.Index('ix_question_history_topic_difficulty_generated_at', 'topic', 'difficulty', 'generated_at'),
+        db.Index('ix_question_history_user_generated_at', 'generated_by_user_id', 'generated_at'),
+        db.Index('ix_question_history_generated_at', 'generated_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     topic = db.Column(db.String(100), nullable=False)
@@ -70,6 +102,42 @@ class QuestionHistory(db.Model):
     correct_answer = db.Column(db.String(500), nullable=False)
     generated_at = db.Column(db.DateTime, default=datetime.utcnow)
     generated_by_user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
+    quarantined = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # Bad answer key
+    
+    generated_by = db.relationship('User', lazy=True)
     
     def __repr__(self):
         return f'<QuestionHistory {self.topic} - {self.difficulty}>'
+
+class PerformanceAggregate(db.Model):
+    """Running totals per user, topic and difficulty, kept in step with Performance"""
+    __tablename__ = 'performance_aggregates'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    topic = db.Column(db.String(100), primary_key=True)
+    difficulty = db.Column(db.String(50), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    time_count = db.Column(db.Integer, nullable=False, default=0)  # Attempts with a time_taken
+    time_sum = db.Column(db.Float, nullable=False, default=0.0)
+    time_sumsq = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<PerformanceAggregate {self.topic} - {self.difficulty}>'
+
+class LLMUsage(db.Model):
+    """Daily LLM token usage and estimated cost per user and topic"""
+    __tablename__ = 'llm_usage'
+    
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.String(36), primary_key=True)  # '' for background pool refills
+    topic = db.Column(db.String(100), primary_key=True)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost_usd = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<LLMUsage {self.day} {self.topic}>'
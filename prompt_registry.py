@@ -0,0 +1,148 @@
+"""
+Prompt templates for Maths Generator App
+Loads prompt_templates.json once and serves prompts by canonical topic id and difficulty, within a token budget
+"""
+
+import os
+import json
+import threading
+from functools import lru_cache
+from string import Formatter
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PROMPT_TEMPLATES = os.environ.get("PROMPT_TEMPLATES", os.path.join(ROOT, "prompt_templates.json"))
+# 0 uses max_prompt_tokens from the templates file
+MAX_PROMPT_TOKENS = int(os.environ.get("MAX_PROMPT_TOKENS", 0))
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", 1024))
+
+# Rough size of an English token, so the budget needs no tokenizer
+CHARS_PER_TOKEN = 4
+DEFAULT = "default"
+FIELDS = ("topic", "difficulty", "count")
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def normalize_topic(topic):
+    return " ".join(str(topic).lower().split())
+
+class Template:
+    """A format string split once into literal text and field names"""
+    __slots__ = ("text", "parts", "literal_length")
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if field is not None and (field not in FIELDS or spec or conversion):
+                raise ValueError(f"Unsupported field {{{field}}} in prompt template {text!r}")
+            self.parts.append((literal, field))
+        self.literal_length = sum(len(literal) for literal, _ in self.parts)
+
+    def render(self, max_chars, **values):
+        """Fill in the fields, cutting values short so the result fits in max_chars"""
+        budget = max_chars - self.literal_length
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field:
+                value = str(values[field])[:max(budget, 0)]
+                budget -= len(value)
+                out.append(value)
+        return "".join(out)
+
+class PromptRegistry:
+    """Topics and their per-difficulty templates; unknown topics use the default templates"""
+
+    def __init__(self, config, max_tokens=0):
+        self.max_tokens = max_tokens or config["max_prompt_tokens"]
+        self.max_chars = self.max_tokens * CHARS_PER_TOKEN
+        self.system = dict(config["system"])
+        self.batch = self._compile(config["batch"])
+        self.default = self._compile_set(config["default"])
+
+        self.topics = []
+        self._templates = {}
+        self._names = {}
+        for topic in config["topics"]:
+            topic_id = topic["id"]
+            if topic_id in self._templates:
+                raise ValueError(f"Duplicate prompt topic id {topic_id!r}")
+            self.topics.append({"id": topic_id, "name": topic["name"]})
+            self._templates[topic_id] = self._compile_set(topic["templates"]) if "templates" in topic else self.default
+            for name in [topic_id, topic["name"], *topic.get("aliases", [])]:
+                self._names[normalize_topic(name)] = topic_id
+        # Longest first, so "factorization using cross method" wins over "factorization"
+        self._contained = sorted(self._names.items(), key=lambda item: len(item[0]), reverse=True)
+
+        self._lock = threading.Lock()
+        self._stats = {"prompts": 0, "truncated": 0}
+        self.resolve = lru_cache(maxsize=PROMPT_CACHE_SIZE)(self._resolve)
+        self._user_prompt = lru_cache(maxsize=PROMPT_CACHE_SIZE)(self._render_user_prompt)
+
+    def _compile(self, text):
+        template = Template(text)
+        if template.literal_length > self.max_chars:
+            raise ValueError(f"Prompt template is over {self.max_tokens} tokens: {text!r}")
+        return template
+
+    def _compile_set(self, texts):
+        if DEFAULT not in texts:
+            raise ValueError(f"Prompt templates need a {DEFAULT!r} entry: {texts!r}")
+        return {difficulty.lower(): self._compile(text) for difficulty, text in texts.items()}
+
+    def _resolve(self, topic):
+        """Canonical id for a topic name, id or alias; a name containing one counts too; None if unknown"""
+        name = normalize_topic(topic)
+        if name in self._names:
+            return self._names[name]
+        for known, topic_id in self._contained:
+            if known in name:
+                return topic_id
+        return None
+
+    def _templates_for(self, topic, difficulty):
+        templates = self._templates.get(self.resolve(topic), self.default)
+        return templates.get(str(difficulty).lower(), templates[DEFAULT])
+
+    def _render(self, template, **values):
+        text = template.render(self.max_chars, **values)
+        if sum(len(str(value)) for value in values.values()) + template.literal_length > self.max_chars:
+            with self._lock:
+                self._stats["truncated"] += 1
+        return text
+
+    def _render_user_prompt(self, topic, difficulty):
+        return self._render(self._templates_for(topic, difficulty), topic=topic, difficulty=difficulty)
+
+    def user_prompt(self, topic, difficulty):
+        """The user prompt for a single question; the same for every request on a topic/difficulty"""
+        with self._lock:
+            self._stats["prompts"] += 1
+        return self._user_prompt(topic, difficulty)
+
+    def batch_prompt(self, topic, difficulty, count):
+        """The user prompt for a batch of questions"""
+        with self._lock:
+            self._stats["prompts"] += 1
+        return self._render(self.batch, topic=topic, difficulty=difficulty, count=count)
+
+    def system_prompt(self, kind):
+        return self.system[kind]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        info = self._user_prompt.cache_info()
+        stats["topics"] = len(self.topics)
+        stats["cache_hits"] = info.hits
+        stats["cache_misses"] = info.misses
+        stats["max_prompt_tokens"] = self.max_tokens
+        return stats
+
+def load_registry(path=PROMPT_TEMPLATES):
+    """Read and check a templates file; a bad file fails at startup rather than on a request"""
+    with open(path, encoding="utf-8") as f:
+        return PromptRegistry(json.load(f), MAX_PROMPT_TOKENS)
+
+prompts = load_registry()
@@ -0,0 +1,131 @@
+"""
+Question generation for Maths Generator App
+Builds the prompt for a topic/difficulty, calls the DeepSeek API and parses the result
+"""
+
+import os
+import random
+from llm_engine import engine
+from response_parser import parse_question, parse_question_batch, QuestionStreamParser, ParseError
+from grading import vet_question
+from prompt_registry import prompts
+from instrumentation import get_logger, timer
+
+# Prompts and raw completions are logged at DEBUG for a sample of requests
+log = get_logger("llm", sampled=True)
+
+# Ask the provider for a bare JSON object instead of free text
+LLM_JSON_MODE = os.environ.get("LLM_JSON_MODE", "1") == "1"
+# Prompts are fixed per topic/difficulty, so variety comes from sampling
+LLM_TEMPERATURE = float(os.environ.get("LLM_TEMPERATURE", 0.8))
+
+def json_mode():
+    """Extra completion arguments for the provider's JSON output mode"""
+    return {"response_format": {"type": "json_object"}} if LLM_JSON_MODE else {}
+
+def build_user_prompt(topic, difficulty):
+    """Build the user prompt for a single question on a topic/difficulty"""
+    # The prompt depends only on topic and difficulty, so identical requests can be served from the archive
+    return prompts.user_prompt(topic, difficulty)
+
+def build_messages(topic, difficulty):
+    """Build the chat messages for a single question"""
+    user_content = build_user_prompt(topic, difficulty)
+
+    log.debug("User prompt: %s", user_content)
+
+    return [
+        {"role": "system", "content": prompts.system_prompt("single")},
+        {"role": "user", "content": user_content}
+    ]
+
+def build_batch_messages(topic, difficulty, count):
+    """Build the chat messages for a batch of questions"""
+    user_content = prompts.batch_prompt(topic, difficulty, count)
+
+    log.debug("User prompt: %s", user_content)
+
+    return [
+        {"role": "system", "content": prompts.system_prompt("batch")},
+        {"role": "user", "content": user_content}
+    ]
+
+def checked(topic, difficulty, item):
+    """Return item if its answer key holds up; a quarantined key is retried like unparseable output"""
+    if not vet_question(topic, difficulty, item):
+        raise ParseError("bad_key", "correct_answer does not match the question")
+    return item
+
+def generate_question_stream(topic, difficulty, user_id=None):
+    """Stream one question, yielding ("question", text), then ("options", item) once the options validate"""
+    with timer("prompt"):
+        messages = build_messages(topic, difficulty)
+    parser = QuestionStreamParser()
+    sent_question = False
+
+    for chunk in engine.stream(messages, topic=topic, user_id=user_id, temperature=LLM_TEMPERATURE,
+                               max_tokens=800, **json_mode()):
+        parser.feed(chunk)
+        if not sent_question and isinstance(parser.fields.get("question"), str):
+            sent_question = True
+            yield "question", parser.fields["question"]
+
+    log.debug("AI raw content: %s", parser.buffer)
+
+    with timer("parse"):
+        item = checked(topic, difficulty, parser.result())
+    if not sent_question:
+        yield "question", item["question"]
+    yield "options", item
+
+def generate_question(topic, difficulty, user_id=None):
+    """Ask the LLM for one question and return question, options and correct_answer"""
+    with timer("prompt"):
+        messages = build_messages(topic, difficulty)
+
+    # Concurrent requests for the same topic/difficulty share one upstream call
+    with timer("llm"):
+        content = engine.complete(
+            messages,
+            topic=topic,
+            coalesce_key=f"{topic}|{difficulty}",
+            user_id=user_id,
+            temperature=LLM_TEMPERATURE,
+            max_tokens=800,
+            **json_mode()
+        )
+
+    log.debug("AI raw content: %s", content)
+
+    with timer("parse"):
+        return checked(topic, difficulty, parse_question(content))
+
+def shuffle_options(options, correct_answer):
+    """Shuffle options and return them with the new correctIndex"""
+    with timer("shuffle"):
+        combined = list(zip(options, range(len(options))))
+        random.shuffle(combined)
+        shuffled_options = [opt for opt, _ in combined]
+        correctIndex = shuffled_options.index(correct_answer)
+    return shuffled_options, correctIndex
+
+def generate_question_batch(topic, difficulty, count, user_id=None):
+    """Ask the LLM for several questions in one call"""
+    with timer("prompt"):
+        messages = build_batch_messages(topic, difficulty, count)
+
+    with timer("llm_batch"):
+        content = engine.complete(
+            messages,
+            topic=topic,
+            user_id=user_id,
+            temperature=LLM_TEMPERATURE,
+            max_tokens=min(800 * count, 8000),
+            **json_mode()
+        )
+
+    log.debug("AI raw content: %s", content)
+
+    with timer("parse"):
+        items = parse_question_batch(content)[:count]
+    return [item for item in items if vet_question(topic, difficulty, item)]
@@ -0,0 +1,202 @@
+"""
+Pre-generated question pool for Maths Generator App
+Keeps a queue of ready questions per (topic, difficulty) and refills it in the background
+"""
+
+import os
+import random
+import threading
+import time
+
+from models import QuestionHistory
+from write_behind import writer, question_history_row
+from grading import remember_question
+from state_store import store
+from instrumentation import get_logger, errors_total, stage_seconds
+
+POOL_ENABLED = os.environ.get("QUESTION_POOL_ENABLED", "1") == "1"
+POOL_WATERMARK = int(os.environ.get("QUESTION_POOL_WATERMARK", 5))
+POOL_IDLE_SECONDS = float(os.environ.get("QUESTION_POOL_IDLE_SECONDS", 5))
+POOL_ERROR_BACKOFF_SECONDS = float(os.environ.get("QUESTION_POOL_ERROR_BACKOFF_SECONDS", 10))
+POOL_SEED_TTL = int(os.environ.get("QUESTION_POOL_SEED_TTL", 3600))
+ARCHIVE_SAMPLE = int(os.environ.get("QUESTION_ARCHIVE_SAMPLE", 200))
+
+def archived_question(topic, difficulty, exclude=()):
+    """Pick a stored question for a topic/difficulty, preferring ones not in exclude; must run inside an app context"""
+    rows = QuestionHistory.query.filter_by(
+        topic=topic, difficulty=difficulty, quarantined=False
+    ).order_by(QuestionHistory.generated_at.desc()).limit(ARCHIVE_SAMPLE).all()
+    if not rows:
+        return None
+    fresh = [row for row in rows if row.question_text not in exclude]
+    row = random.choice(fresh or rows)
+    return {
+        "id": row.id,
+        "question": row.question_text,
+        "options": list(row.options),
+        "correct_answer": row.correct_answer
+    }
+
+log = get_logger("question_pool")
+
+class QuestionPool:
+    """Per-(topic, difficulty) queue of ready questions in the shared store, with a background refill worker"""
+
+    def __init__(self, generator, watermark=POOL_WATERMARK):
+        self.generator = generator
+        self.watermark = watermark
+        self._registered = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._app = None
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "refills": 0,
+            "refill_errors": 0,
+            "refill_seconds_total": 0.0,
+            "refill_seconds_last": 0.0
+        }
+
+    def _key(self, topic, difficulty):
+        return f"{topic}|{difficulty}"
+
+    def _queue_key(self, key):
+        return f"pool:{key}"
+
+    def register(self, topic, difficulty):
+        """Start tracking a topic/difficulty, seeding it from QuestionHistory"""
+        key = self._key(topic, difficulty)
+        with self._lock:
+            if key in self._registered:
+                return
+            self._registered.add(key)
+        store.sadd("pool:keys", key)
+
+        # Only one worker seeds a queue from the archive
+        if store.set(f"pool:seeded:{key}", True, ttl=POOL_SEED_TTL, only_if_absent=True):
+            for item in self._load_history(topic, difficulty):
+                self.put(topic, difficulty, item)
+        self._wake.set()
+
+    def _load_history(self, topic, difficulty):
+        """Load the most recent stored questions for a topic/difficulty"""
+        if self._app is None:
+            return []
+        with self._app.app_context():
+            rows = QuestionHistory.query.filter_by(
+                topic=topic, difficulty=difficulty, quarantined=False
+            ).order_by(QuestionHistory.generated_at.desc()).limit(self.watermark).all()
+            return [
+                {
+                    "id": row.id,
+                    "question": row.question_text,
+                    "options": list(row.options),
+                    "correct_answer": row.correct_answer
+                }
+                for row in rows
+            ]
+
+    def put(self, topic, difficulty, item):
+        """Add a ready question to the pool"""
+        store.rpush(self._queue_key(self._key(topic, difficulty)), item)
+
+    def take(self, topic, difficulty, exclude=()):
+        """Pop a ready question, skipping any in exclude; None on a miss"""
+        self.register(topic, difficulty)
+        queue_key = self._queue_key(self._key(topic, difficulty))
+
+        item = None
+        skipped = []
+        for _ in range(store.llen(queue_key)):
+            candidate = store.lpop(queue_key)
+            if candidate is None:
+                break
+            if "id" not in candidate:
+                # Queued before questions carried their history id, so it cannot be graded
+                continue
+            if candidate["question"] in exclude:
+                skipped.append(candidate)
+                continue
+            item = candidate
+            break
+        # Skipped questions may still suit other students
+        if skipped:
+            store.rpush(queue_key, *skipped)
+
+        with self._lock:
+            if item is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+
+        self._wake.set()
+        return item
+
+    def size(self, topic, difficulty):
+        return store.llen(self._queue_key(self._key(topic, difficulty)))
+
+    def _sizes(self):
+        return {key: store.llen(self._queue_key(key)) for key in store.smembers("pool:keys")}
+
+    def stats(self):
+        """Return hit/miss counters, refill latency and current pool sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pools"] = self._sizes()
+        stats["watermark"] = self.watermark
+        stats["refill_seconds_avg"] = (
+            stats["refill_seconds_total"] / stats["refills"] if stats["refills"] else 0.0
+        )
+        return stats
+
+    def start(self, app):
+        """Start the background refill worker"""
+        self._app = app
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="question-pool", daemon=True)
+        self._thread.start()
+
+    def _next_low_key(self):
+        """Return the tracked key furthest below the watermark, or None"""
+        low = [(size, key) for key, size in self._sizes().items() if size < self.watermark]
+        if not low:
+            return None
+        return tuple(min(low)[1].rsplit("|", 1))
+
+    def refill_one(self, topic, difficulty):
+        """Generate, persist and enqueue one question for a topic/difficulty"""
+        started = time.perf_counter()
+        item = self.generator(topic, difficulty)
+        row = question_history_row(topic, difficulty, item)
+        writer.enqueue(QuestionHistory, row)
+        remember_question(row)
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage="pool_refill")
+
+        self.put(topic, difficulty, item)
+        with self._lock:
+            self._stats["refills"] += 1
+            self._stats["refill_seconds_total"] += elapsed
+            self._stats["refill_seconds_last"] = elapsed
+
+    def _run(self):
+        while True:
+            key = self._next_low_key()
+            if key is None:
+                self._wake.wait(POOL_IDLE_SECONDS)
+                self._wake.clear()
+                continue
+
+            try:
+                # The generator checks today's spend in llm_usage
+                with self._app.app_context():
+                    self.refill_one(*key)
+            except Exception as e:
+                log.warning("Question pool refill failed for %s: %s", key, e)
+                errors_total.inc(where="pool_refill")
+                with self._lock:
+                    self._stats["refill_errors"] += 1
+                time.sleep(POOL_ERROR_BACKOFF_SECONDS)
@@ -0,0 +1,127 @@
+"""
+Archive replay for Maths Generator App
+Serves stored QuestionHistory questions a student has not seen before calling the LLM
+"""
+
+import os
+import random
+import threading
+import time
+
+from models import QuestionHistory
+from budget import token_cost
+
+REPLAY_ENABLED = os.environ.get("REPLAY_ENABLED", "1") == "1"
+REPLAY_FRESH_RATIO = float(os.environ.get("REPLAY_FRESH_RATIO", 0.1))
+REPLAY_ARCHIVE_LIMIT = int(os.environ.get("REPLAY_ARCHIVE_LIMIT", 5000))
+REPLAY_SCAN_LIMIT = int(os.environ.get("REPLAY_SCAN_LIMIT", 200))
+REPLAY_REFRESH_SECONDS = float(os.environ.get("REPLAY_REFRESH_SECONDS", 300))
+
+class ArchiveReplay:
+    """Per-(topic, difficulty) copy of the question archive, replayed to students who have not seen it"""
+
+    def __init__(self, fresh_ratio=REPLAY_FRESH_RATIO):
+        self.fresh_ratio = fresh_ratio
+        self._archives = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _topic_stats(self, topic):
+        stats = self._stats.get(topic)
+        if stats is None:
+            stats = self._stats[topic] = {
+                "replayed": 0, "fresh": 0, "fresh_by_ratio": 0, "exhausted": 0, "fresh_seconds_total": 0.0
+            }
+        return stats
+
+    def _count(self, topic, name, value=1):
+        with self._lock:
+            self._topic_stats(topic)[name] += value
+
+    def _load(self, topic, difficulty):
+        rows = QuestionHistory.query.with_entities(
+            QuestionHistory.id, QuestionHistory.question_text, QuestionHistory.options, QuestionHistory.correct_answer
+        ).filter_by(
+            topic=topic, difficulty=difficulty, quarantined=False
+        ).order_by(QuestionHistory.generated_at.desc()).limit(REPLAY_ARCHIVE_LIMIT).all()
+
+        items, texts = [], set()
+        for row_id, text, options, correct_answer in rows:
+            if text not in texts:
+                texts.add(text)
+                items.append({"id": row_id, "question": text, "options": list(options), "correct_answer": correct_answer})
+        return items, texts
+
+    def _archive(self, topic, difficulty):
+        """Return the cached archive for a key, reloading it when stale; must run inside an app context"""
+        key = (topic, difficulty)
+        with self._lock:
+            archive = self._archives.get(key)
+        # Reloads pick up questions other workers have stored since
+        if archive is None or time.monotonic() - archive["loaded_at"] > REPLAY_REFRESH_SECONDS:
+            items, texts = self._load(topic, difficulty)
+            archive = {"loaded_at": time.monotonic(), "items": items, "texts": texts}
+            with self._lock:
+                self._archives[key] = archive
+        return archive
+
+    def add(self, topic, difficulty, item):
+        """Make a newly generated question available for replay"""
+        with self._lock:
+            archive = self._archives.get((topic, difficulty))
+            if archive is not None and item["question"] not in archive["texts"]:
+                archive["texts"].add(item["question"])
+                archive["items"].append(item)
+
+    def take(self, topic, difficulty, seen):
+        """Return an archived question not in seen, or None if a fresh one should be generated"""
+        if not REPLAY_ENABLED:
+            return None
+        if random.random() < self.fresh_ratio:
+            self._count(topic, "fresh_by_ratio")
+            return None
+
+        items = self._archive(topic, difficulty)["items"]
+        # Checking a random sample keeps the cost flat however large the archive is
+        for index in random.sample(range(len(items)), min(len(items), REPLAY_SCAN_LIMIT)):
+            item = items[index]
+            if item["question"] not in seen:
+                self._count(topic, "replayed")
+                return item
+
+        self._count(topic, "exhausted")
+        return None
+
+    def record_fresh(self, topic, seconds):
+        """Record a question generated by the LLM while a student waited"""
+        with self._lock:
+            stats = self._topic_stats(topic)
+            stats["fresh"] += 1
+            stats["fresh_seconds_total"] += seconds
+
+    def stats(self, engine_stats):
+        """Return per-topic replay counts with the estimated LLM time and cost saved"""
+        calls = engine_stats["calls"]
+        tokens_in = engine_stats["prompt_tokens"] / calls if calls else 0
+        tokens_out = engine_stats["completion_tokens"] / calls if calls else 0
+        cost_per_call = token_cost(tokens_in, tokens_out)
+        default_seconds = engine_stats["upstream_seconds_total"] / calls if calls else 0.0
+
+        with self._lock:
+            topics = {topic: dict(stats) for topic, stats in self._stats.items()}
+            archived = {f"{t}|{d}": len(a["items"]) for (t, d), a in self._archives.items()}
+
+        for stats in topics.values():
+            fresh_seconds = stats["fresh_seconds_total"] / stats["fresh"] if stats["fresh"] else default_seconds
+            stats["saved_seconds"] = round(stats["replayed"] * fresh_seconds, 3)
+            stats["saved_tokens"] = round(stats["replayed"] * (tokens_in + tokens_out))
+            stats["saved_cost_usd"] = round(stats["replayed"] * cost_per_call, 6)
+
+        return {
+            "enabled": REPLAY_ENABLED,
+            "fresh_ratio": self.fresh_ratio,
+            "archived": archived,
+            "topics": topics
+        }
+
+replay = ArchiveReplay()
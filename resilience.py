@@ -0,0 +1,223 @@
+"""
+Resilience policy for Maths Generator App
+Per-attempt deadlines, jittered retries, hedged requests and a circuit breaker for LLM calls
+"""
+
+import os
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+LLM_ATTEMPT_TIMEOUT = float(os.environ.get("LLM_ATTEMPT_TIMEOUT", 20))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 8))
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_DEFAULT_SECONDS = float(os.environ.get("LLM_HEDGE_DEFAULT_SECONDS", 8))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", 30))
+
+LATENCY_WINDOW = 200
+
+_retryable_errors = None
+
+def retryable_errors():
+    """Failures worth retrying; anything else (bad request, auth) is raised at once"""
+    global _retryable_errors
+    if _retryable_errors is None:
+        # openai takes over half a second to import, so it waits until an LLM call fails
+        import openai
+        _retryable_errors = (
+            asyncio.TimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+    return _retryable_errors
+
+class LLMUnavailable(Exception):
+    """The LLM could not answer in time; callers should serve a stored question"""
+
+class CircuitOpen(LLMUnavailable):
+    """The circuit breaker is open, so the LLM is not being called"""
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one trial call through after a cool-down"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "short_circuited": 0}
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go upstream now"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            self._stats["short_circuited"] += 1
+        raise CircuitOpen("The question service is temporarily unavailable")
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._stats["opened"] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def release(self):
+        """Give up a half-open trial slot without a verdict (the call was cancelled)"""
+        with self._lock:
+            self._trial_running = False
+
+    def stats(self):
+        """Return the breaker state and counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self._state
+            stats["consecutive_failures"] = self._failures
+            if self._state == self.OPEN:
+                stats["retry_in_seconds"] = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+        return stats
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, default=None):
+        with self._lock:
+            if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+                return default
+            values = sorted(self._samples)
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+class ResiliencePolicy:
+    """Runs an upstream call with deadlines, retries, hedging and a circuit breaker"""
+
+    def __init__(self, attempt_timeout=LLM_ATTEMPT_TIMEOUT, max_retries=LLM_MAX_RETRIES, hedge=LLM_HEDGE_ENABLED):
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._stats_lock = threading.Lock()
+        self._stats = {"attempts": 0, "retries": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a hedged second request (the recent p95)"""
+        return self.latency.percentile(95, LLM_HEDGE_DEFAULT_SECONDS)
+
+    def total_seconds(self):
+        """Longest run() can take: every attempt timing out, plus the longest backoff between them"""
+        backoffs = sum(min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt) for attempt in range(self.max_retries))
+        return (self.max_retries + 1) * self.attempt_timeout + backoffs
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    async def _hedged(self, call):
+        """Run call, sending a duplicate if it is slower than the p95; the first success wins"""
+        tasks = [asyncio.ensure_future(call())]
+        try:
+            if not self.hedge:
+                return await tasks[0]
+
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if done:
+                return tasks[0].result()
+
+            self._count("hedges")
+            tasks.append(asyncio.ensure_future(call()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self._count("hedge_wins")
+                        return task.result()
+                    if not pending:
+                        raise task.exception()
+        finally:
+            # Also runs when the attempt deadline cancels us
+            for task in tasks:
+                task.cancel()
+
+    async def run(self, call):
+        """Await call() under the policy; raise LLMUnavailable once the retry budget is spent"""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self.breaker.allow()
+            if attempt:
+                self._count("retries")
+            self._count("attempts")
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self._hedged(call), self.attempt_timeout)
+            except retryable_errors() as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self._count("timeouts")
+                self.breaker.record_failure()
+                last_error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.backoff(attempt))
+                continue
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception:
+                # The provider answered, so it is up; the request itself was rejected
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            self.latency.add(time.perf_counter() - started)
+            return result
+
+        self._count("failures")
+        raise LLMUnavailable(f"LLM call failed after {self.max_retries + 1} attempts: {last_error!r}")
+
+    def stats(self):
+        """Return retry/hedge counters, the hedge threshold and the breaker state"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["hedge_after_seconds"] = self.hedge_delay()
+        stats["breaker"] = self.breaker.stats()
+        return stats
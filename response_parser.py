@@ -0,0 +1,274 @@
+"""
+Response parsing for Maths Generator App
+Single-pass, LaTeX-safe JSON extraction and schema validation of LLM output
+"""
+
+import json
+import re
+import threading
+import time
+
+QUESTION_FIELDS = ("question", "options", "correct_answer")
+OPTION_COUNT = 4
+
+_HEX4 = re.compile(r'[0-9a-fA-F]{4}')
+
+class ParseError(ValueError):
+    """The model output did not contain a valid question"""
+
+    def __init__(self, reason, message=None):
+        super().__init__(message or reason)
+        self.reason = reason
+
+_stats_lock = threading.Lock()
+_stats = {"parses": 0, "failures": 0, "parse_seconds_total": 0.0, "failure_reasons": {}}
+
+def _record(started, reason=None):
+    elapsed = time.perf_counter() - started
+    with _stats_lock:
+        _stats["parses"] += 1
+        _stats["parse_seconds_total"] += elapsed
+        if reason is not None:
+            _stats["failures"] += 1
+            _stats["failure_reasons"][reason] = _stats["failure_reasons"].get(reason, 0) + 1
+
+def stats():
+    """Return parse counts, failure rate by reason and average parse time"""
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["failure_reasons"] = dict(_stats["failure_reasons"])
+    parses = stats["parses"]
+    stats["failure_rate"] = stats["failures"] / parses if parses else 0.0
+    stats["parse_seconds_avg"] = stats["parse_seconds_total"] / parses if parses else 0.0
+    return stats
+
+def _escape_backslash(text, i):
+    """Return the JSON for the backslash at text[i] and how many characters it consumed"""
+    nxt = text[i + 1:i + 2]
+    if nxt and nxt in '"\\/':
+        return text[i:i + 2], 2
+    if nxt == "u" and _HEX4.match(text, i + 2):
+        return text[i:i + 6], 6
+    # \frac, \times, \neq... are LaTeX commands, not \f, \t and \n escapes
+    if nxt and nxt in "bfnrt" and not text[i + 2:i + 3].islower():
+        return text[i:i + 2], 2
+    return "\\\\", 1
+
+def repair_json(text):
+    """Escape stray LaTeX backslashes inside the strings of a JSON fragment"""
+    out = []
+    in_string = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string and ch == "\\":
+            escaped, step = _escape_backslash(text, i)
+            out.append(escaped)
+            i += step
+            continue
+        if ch == '"':
+            in_string = not in_string
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+def extract_json(text, openers="{["):
+    """Return the first complete JSON object or array in text, LaTeX backslashes repaired
+
+    One linear scan that tracks strings and bracket depth, so code fences, prose
+    and braces inside strings around the JSON do not matter.
+    """
+    out = []
+    depth = 0
+    in_string = False
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if depth == 0:
+            if ch in openers:
+                depth = 1
+                out.append(ch)
+            i += 1
+            continue
+
+        if in_string:
+            if ch == "\\":
+                escaped, step = _escape_backslash(text, i)
+                out.append(escaped)
+                i += step
+                continue
+            if ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                out.append(ch)
+                return "".join(out)
+        out.append(ch)
+        i += 1
+
+    raise ParseError("no_json", "No complete JSON value in the model output")
+
+def loads(text, openers="{["):
+    """Extract and decode the first JSON value in text"""
+    try:
+        return json.loads(extract_json(text, openers), strict=False)
+    except json.JSONDecodeError as e:
+        raise ParseError("invalid_json", f"Model output is not valid JSON: {e}")
+
+def validate_question(entry):
+    """Check an entry against the question schema and return a clean question dict"""
+    if not isinstance(entry, dict):
+        raise ParseError("not_an_object", "Question is not a JSON object")
+    missing = [name for name in QUESTION_FIELDS if name not in entry]
+    if missing:
+        raise ParseError("missing_field", f"Question is missing {', '.join(missing)}")
+
+    question, options, correct_answer = (entry[name] for name in QUESTION_FIELDS)
+    if not isinstance(question, str) or not question.strip():
+        raise ParseError("bad_question", "Question text is empty")
+    if not isinstance(options, list) or len(options) != OPTION_COUNT:
+        raise ParseError("bad_options", f"Question must have exactly {OPTION_COUNT} options")
+
+    # Numeric options are common; compare them as the strings the student sees
+    options = [str(option) for option in options]
+    correct_answer = str(correct_answer)
+    if len(set(options)) != OPTION_COUNT:
+        raise ParseError("duplicate_options", "Question options are not distinct")
+    if correct_answer not in options:
+        raise ParseError("answer_not_in_options", "correct_answer is not one of the options")
+
+    return {"question": question, "options": options, "correct_answer": correct_answer}
+
+def is_valid_question(item):
+    """True if item matches the question schema"""
+    try:
+        validate_question(item)
+        return True
+    except ParseError:
+        return False
+
+def parse_question(content):
+    """Parse and validate one question from the model output"""
+    started = time.perf_counter()
+    try:
+        data = loads(content, "{")
+        item = validate_question(data)
+    except ParseError as e:
+        _record(started, e.reason)
+        raise
+    _record(started)
+    return item
+
+def parse_question_batch(content):
+    """Parse a batch of questions, dropping entries that fail validation"""
+    started = time.perf_counter()
+    try:
+        data = loads(content)
+    except ParseError as e:
+        _record(started, e.reason)
+        raise
+    if isinstance(data, dict):
+        data = data.get("questions", [])
+
+    questions = []
+    for entry in data if isinstance(data, list) else []:
+        # Drop malformed items instead of failing the whole batch
+        try:
+            questions.append(validate_question(entry))
+        except ParseError:
+            continue
+    _record(started, None if questions else "empty_batch")
+    return questions
+
+class QuestionStreamParser:
+    """Scans streamed JSON once, reporting each top-level field as soon as its value is complete"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.key = None
+        self.value_start = None
+        self.fields = {}
+        self.seconds = 0.0
+
+    def feed(self, chunk):
+        """Add streamed text; return a list of (field, value) pairs completed by it"""
+        started = time.perf_counter()
+        self.buffer += chunk
+        completed = []
+        buf = self.buffer
+        while self.pos < len(buf):
+            ch = buf[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self._end_string(completed)
+            elif ch == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.value_start = self.pos
+            elif ch in "{[":
+                if self.depth == 1 and not self.expect_key:
+                    self.value_start = self.pos
+                self.depth += 1
+                if self.depth == 1:
+                    self.expect_key = True
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1:
+                    self._end_value(self.pos + 1, completed)
+            elif self.depth == 1:
+                if ch == ",":
+                    self.expect_key = True
+                elif ch == ":":
+                    self.expect_key = False
+            self.pos += 1
+        self.seconds += time.perf_counter() - started
+        return completed
+
+    def complete(self):
+        """True once every question field has been seen"""
+        return all(name in self.fields for name in QUESTION_FIELDS)
+
+    def result(self):
+        """Validate the streamed question, falling back to a whole-document parse"""
+        if not self.complete():
+            return parse_question(self.buffer)
+        started = time.perf_counter() - self.seconds
+        try:
+            item = validate_question(self.fields)
+        except ParseError as e:
+            _record(started, e.reason)
+            raise
+        _record(started)
+        return item
+
+    def _end_string(self, completed):
+        raw = self.buffer[self.value_start:self.pos + 1]
+        if self.expect_key:
+            self.key = json.loads(raw)
+        else:
+            self._end_value(self.pos + 1, completed)
+
+    def _end_value(self, end, completed):
+        if self.key not in QUESTION_FIELDS or self.value_start is None:
+            return
+        value = json.loads(repair_json(self.buffer[self.value_start:end]), strict=False)
+        self.fields[self.key] = value
+        completed.append((self.key, value))
+        self.value_start = None
@@ -0,0 +1,341 @@
+"""
+Server-side sessions for Maths Generator App
+Keeps only an opaque token in the session cookie; logged-in sessions live in UserSession with a per-worker cache, earlier ones in PendingSession
+"""
+
+import os
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import request
+from flask.sessions import SessionInterface, SecureCookieSession
+from sqlalchemy import bindparam
+
+from models import db, UserSession, PendingSession
+from instrumentation import get_logger, errors_total, stage_seconds
+
+SESSION_IDLE_TIMEOUT = int(os.environ.get("SESSION_IDLE_TIMEOUT", 12 * 3600))
+SESSION_SWEEP_SECONDS = float(os.environ.get("SESSION_SWEEP_SECONDS", 60))
+# How long a worker trusts its cached copy; logouts on other workers apply within this time
+SESSION_CACHE_SECONDS = float(os.environ.get("SESSION_CACHE_SECONDS", 30))
+# Sessions before login only hold the OAuth handshake
+ANONYMOUS_SESSION_TTL = int(os.environ.get("ANONYMOUS_SESSION_TTL", 600))
+
+TOKEN_BYTES = 32
+# Credentials that must never be written to the session tables
+UNPERSISTED_KEYS = ("google_oauth_token",)
+_TOKEN = re.compile(r"[A-Za-z0-9_-]{43}")
+
+log = get_logger("server_sessions")
+
+class SessionRecord:
+    """A logged-in session cached by this worker"""
+    __slots__ = ("token", "user_id", "data", "last_seen", "flushed_seen", "loaded_at")
+
+    def __init__(self, token, user_id, data, last_seen):
+        self.token = token
+        self.user_id = user_id
+        self.data = data
+        self.last_seen = last_seen
+        self.flushed_seen = last_seen
+        self.loaded_at = time.monotonic()
+
+class ServerSession(SecureCookieSession):
+    """Session dict that remembers its token and the user it was loaded for"""
+
+    def __init__(self, initial=None, token=None, user_id=None):
+        super().__init__(initial)
+        self.token = token
+        self.user_id = user_id
+
+class ServerSessionStore:
+    """Session lookup, writes and the idle-session sweeper; DB work must run inside an app context"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._app = None
+        self._stats = {
+            "lookups": 0,
+            "cache_hits": 0,
+            "db_loads": 0,
+            "anonymous_loads": 0,
+            "misses": 0,
+            "lookup_errors": 0,
+            "lookup_seconds_total": 0.0,
+            "created": 0,
+            "ended": 0,
+            "expired": 0,
+            "pending_expired": 0,
+            "touches_flushed": 0,
+            "sweeps": 0,
+            "sweep_errors": 0,
+            "sweep_seconds_last": 0.0,
+            "cookies": 0,
+            "cookie_bytes_total": 0,
+            "cookie_bytes_max": 0
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def observe_cookie(self, size):
+        """Record the size of an incoming session cookie"""
+        with self._lock:
+            self._stats["cookies"] += 1
+            self._stats["cookie_bytes_total"] += size
+            self._stats["cookie_bytes_max"] = max(self._stats["cookie_bytes_max"], size)
+
+    def load(self, token):
+        """Return (user_id, data) for a live session token, or None"""
+        started = time.perf_counter()
+        self._count("lookups")
+        try:
+            # Anything else (an old signed cookie, garbage) is not worth a lookup
+            if not _TOKEN.fullmatch(token):
+                self._count("misses")
+                return None
+            return self._load(token)
+        except Exception as e:
+            log.warning("Session lookup failed: %s", e)
+            errors_total.inc(where="session_lookup")
+            self._count("lookup_errors")
+            return None
+        finally:
+            elapsed = time.perf_counter() - started
+            stage_seconds.observe(elapsed, stage="session_lookup")
+            self._count("lookup_seconds_total", elapsed)
+
+    def _load(self, token):
+        now = datetime.utcnow()
+        idle_cutoff = now - timedelta(seconds=SESSION_IDLE_TIMEOUT)
+        with self._lock:
+            record = self._records.get(token)
+        if record is not None and time.monotonic() - record.loaded_at < SESSION_CACHE_SECONDS:
+            if record.last_seen >= idle_cutoff:
+                record.last_seen = now
+                self._count("cache_hits")
+                return record.user_id, dict(record.data)
+
+        # Pending sessions are in the database so the OAuth callback can land on any worker
+        pending = db.session.get(PendingSession, token)
+        if pending is not None and pending.expires_at > now:
+            self._count("anonymous_loads")
+            return None, pending.data
+
+        row = UserSession.query.filter_by(session_token=token, is_active=True).first()
+        if row is None or (row.last_seen or row.login_time) < idle_cutoff:
+            with self._lock:
+                self._records.pop(token, None)
+            self._count("misses")
+            return None
+
+        fresh = SessionRecord(token, row.user_id, row.data or {}, row.last_seen or row.login_time)
+        fresh.last_seen = now
+        with self._lock:
+            self._records[token] = fresh
+        self._count("db_loads")
+        return fresh.user_id, dict(fresh.data)
+
+    def create(self, user_id, data, ip_address=None, user_agent=None):
+        """Start a logged-in session and return its token"""
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        now = datetime.utcnow()
+        db.session.add(UserSession(
+            user_id=user_id,
+            session_token=token,
+            login_time=now,
+            last_seen=now,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            data=data,
+            is_active=True
+        ))
+        db.session.commit()
+        with self._lock:
+            self._records[token] = SessionRecord(token, user_id, data, now)
+        self._count("created")
+        return token
+
+    def update(self, token, data):
+        """Replace a logged-in session's data"""
+        UserSession.query.filter_by(session_token=token).update({"data": data}, synchronize_session=False)
+        db.session.commit()
+        with self._lock:
+            record = self._records.get(token)
+            if record is not None:
+                record.data = data
+
+    def end(self, token):
+        """Close a session, logged in or not"""
+        self._drop_pending(token)
+        with self._lock:
+            record = self._records.pop(token, None)
+        values = {"is_active": False, "logout_time": datetime.utcnow()}
+        if record is not None:
+            values["last_seen"] = record.last_seen
+        updated = UserSession.query.filter_by(session_token=token, is_active=True).update(
+            values, synchronize_session=False
+        )
+        db.session.commit()
+        if updated:
+            self._count("ended")
+
+    def _drop_pending(self, token):
+        PendingSession.query.filter_by(token=token).delete(synchronize_session=False)
+        db.session.commit()
+
+    def save(self, session, ip_address=None, user_agent=None):
+        """Persist a modified session; return the token the cookie should carry, or None to drop it"""
+        data = {key: value for key, value in session.items() if key not in UNPERSISTED_KEYS}
+        token = session.token
+        user_id = data.get("user_id")
+
+        if token and session.user_id and (not data or user_id != session.user_id):
+            # Logged out, or logged in as someone else
+            self.end(token)
+            token = None
+        if not data:
+            if token:
+                self._drop_pending(token)
+            return None
+
+        if user_id and user_id == session.user_id:
+            self.update(token, data)
+            return token
+        if user_id:
+            # A new token at login, so a token seen before login cannot be reused afterwards
+            if token:
+                self._drop_pending(token)
+            return self.create(user_id, data, ip_address, user_agent)
+
+        token = token or secrets.token_urlsafe(TOKEN_BYTES)
+        db.session.merge(PendingSession(
+            token=token,
+            data=data,
+            expires_at=datetime.utcnow() + timedelta(seconds=ANONYMOUS_SESSION_TTL)
+        ))
+        db.session.commit()
+        return token
+
+    def sweep(self):
+        """Write back last-seen times, expire idle sessions and delete expired pending ones, each in one statement; must run inside an app context"""
+        started = time.perf_counter()
+        with self._lock:
+            records = list(self._records.values())
+        touched = [record for record in records if record.last_seen > record.flushed_seen]
+        if touched:
+            table = UserSession.__table__
+            # Never move last_seen backwards when another worker flushed a later time
+            db.session.execute(
+                table.update()
+                .where(table.c.session_token == bindparam("token"), table.c.last_seen < bindparam("seen"))
+                .values(last_seen=bindparam("seen")),
+                [{"token": record.token, "seen": record.last_seen} for record in touched]
+            )
+            for record in touched:
+                record.flushed_seen = record.last_seen
+
+        now = datetime.utcnow()
+        expired = UserSession.query.filter(
+            UserSession.is_active.is_(True),
+            UserSession.last_seen < now - timedelta(seconds=SESSION_IDLE_TIMEOUT)
+        ).update({"is_active": False, "logout_time": now}, synchronize_session=False)
+        pending_expired = PendingSession.query.filter(PendingSession.expires_at <= now).delete(synchronize_session=False)
+        db.session.commit()
+
+        # Forget sessions this worker has not served lately; they are re-read from the row if they come back
+        stale = time.monotonic() - SESSION_CACHE_SECONDS
+        with self._lock:
+            for record in records:
+                if record.loaded_at < stale and record.last_seen == record.flushed_seen:
+                    self._records.pop(record.token, None)
+            self._stats["touches_flushed"] += len(touched)
+            self._stats["expired"] += expired
+            self._stats["pending_expired"] += pending_expired
+            self._stats["sweeps"] += 1
+            self._stats["sweep_seconds_last"] = time.perf_counter() - started
+
+    def start(self, app):
+        """Start the background sweeper"""
+        self._app = app
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(SESSION_SWEEP_SECONDS):
+            try:
+                with self._app.app_context():
+                    self.sweep()
+            except Exception as e:
+                log.warning("Session sweep failed: %s", e)
+                errors_total.inc(where="session_sweep")
+                self._count("sweep_errors")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached"] = len(self._records)
+        stats["lookup_seconds_avg"] = stats["lookup_seconds_total"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["cookie_bytes_avg"] = stats["cookie_bytes_total"] / stats["cookies"] if stats["cookies"] else 0.0
+        return stats
+
+sessions = ServerSessionStore()
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface whose cookie is only a session token"""
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if not token:
+            return ServerSession()
+        sessions.observe_cookie(len(token))
+        loaded = sessions.load(token)
+        if loaded is None:
+            # Unknown or expired; save_session replaces the cookie if the session is written
+            return ServerSession()
+        user_id, data = loaded
+        return ServerSession(data, token=token, user_id=user_id)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session.modified:
+            return
+
+        token = sessions.save(
+            session,
+            ip_address=request.remote_addr,
+            user_agent=request.headers.get("User-Agent", "")
+        )
+        if token is None:
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+        if token != session.token:
+            response.set_cookie(
+                name,
+                token,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+            response.vary.add("Cookie")
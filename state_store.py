@@ -0,0 +1,227 @@
+"""
+Shared state store for Maths Generator App
+Key/value, list, set and hash state with TTLs, kept in memory or in Redis so every worker sees the same state
+"""
+
+import os
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+STATE_PREFIX = os.environ.get("STATE_PREFIX", "mathsgen:")
+STATE_MAX_KEYS = int(os.environ.get("STATE_MAX_KEYS", 100000))
+
+class MemoryStore:
+    """In-process store with per-key TTLs and LRU eviction; state is not shared between processes"""
+    shared = False
+
+    def __init__(self, max_keys=STATE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._expires = {}
+        self._lock = threading.RLock()
+        self._stats = {"expired": 0, "evicted": 0}
+
+    def _live(self, key):
+        """Return the value for key, dropping it if it has expired"""
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            del self._expires[key]
+            self._stats["expired"] += 1
+            return None
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def _put(self, key, value, ttl=None):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if ttl is not None:
+            self._expires[key] = time.monotonic() + ttl
+        while len(self._data) > self.max_keys:
+            evicted, _ = self._data.popitem(last=False)
+            self._expires.pop(evicted, None)
+            self._stats["evicted"] += 1
+
+    def _container(self, key, kind):
+        value = self._live(key)
+        if value is None:
+            value = kind()
+            self._put(key, value)
+        return value
+
+    def get(self, key):
+        with self._lock:
+            value = self._live(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None, only_if_absent=False):
+        """Store a JSON value; with only_if_absent, return False if the key already exists"""
+        with self._lock:
+            if only_if_absent and self._live(key) is not None:
+                return False
+            self._expires.pop(key, None)
+            self._put(key, json.dumps(value), ttl)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+
+    def expire(self, key, ttl):
+        with self._lock:
+            if self._live(key) is not None:
+                self._expires[key] = time.monotonic() + ttl
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add to an integer counter; ttl is only applied when the counter is created"""
+        with self._lock:
+            value = self._live(key)
+            count = (0 if value is None else json.loads(value)) + amount
+            if value is None:
+                self._put(key, json.dumps(count), ttl)
+            else:
+                self._data[key] = json.dumps(count)
+        return count
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._container(key, deque)
+            items.extend(json.dumps(value) for value in values)
+            return len(items)
+
+    def lpop(self, key):
+        with self._lock:
+            items = self._live(key)
+            if not items:
+                return None
+            return json.loads(items.popleft())
+
+    def llen(self, key):
+        with self._lock:
+            items = self._live(key)
+            return len(items) if items else 0
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._container(key, set).update(members)
+
+    def sismember(self, key, member):
+        with self._lock:
+            members = self._live(key)
+            return bool(members) and member in members
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._live(key) or ())
+
+    def scard(self, key):
+        with self._lock:
+            return len(self._live(key) or ())
+
+    def hset(self, key, mapping):
+        with self._lock:
+            self._container(key, dict).update((field, json.dumps(value)) for field, value in mapping.items())
+
+    def hgetall(self, key):
+        with self._lock:
+            fields = dict(self._live(key) or {})
+        return {field: json.loads(value) for field, value in fields.items()}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._data)
+        stats["backend"] = "memory"
+        return stats
+
+class RedisStore:
+    """Redis-backed store shared by every worker and node; needs the redis package"""
+    shared = True
+
+    def __init__(self, url=REDIS_URL, prefix=STATE_PREFIX, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("STATE_BACKEND=redis needs the redis package: pip install redis")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None, only_if_absent=False):
+        """Store a JSON value; with only_if_absent, return False if the key already exists"""
+        ex = None if ttl is None else int(ttl)
+        return bool(self.client.set(self._key(key), json.dumps(value), ex=ex, nx=only_if_absent))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self._key(key) for key in keys))
+
+    def expire(self, key, ttl):
+        self.client.expire(self._key(key), int(ttl))
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add to an integer counter; ttl is only applied when the counter is created"""
+        pipe = self.client.pipeline()
+        pipe.incrby(self._key(key), amount)
+        if ttl is not None:
+            pipe.expire(self._key(key), int(ttl), nx=True)
+        return pipe.execute()[0]
+
+    def rpush(self, key, *values):
+        return self.client.rpush(self._key(key), *(json.dumps(value) for value in values))
+
+    def lpop(self, key):
+        value = self.client.lpop(self._key(key))
+        return None if value is None else json.loads(value)
+
+    def llen(self, key):
+        return self.client.llen(self._key(key))
+
+    def sadd(self, key, *members):
+        if members:
+            self.client.sadd(self._key(key), *members)
+
+    def sismember(self, key, member):
+        return bool(self.client.sismember(self._key(key), member))
+
+    def smembers(self, key):
+        return set(self.client.smembers(self._key(key)))
+
+    def scard(self, key):
+        return self.client.scard(self._key(key))
+
+    def hset(self, key, mapping):
+        if mapping:
+            self.client.hset(self._key(key), mapping={field: json.dumps(value) for field, value in mapping.items()})
+
+    def hgetall(self, key):
+        return {field: json.loads(value) for field, value in self.client.hgetall(self._key(key)).items()}
+
+    def stats(self):
+        return {"backend": "redis", "keys": self.client.dbsize()}
+
+def create_store(backend=STATE_BACKEND):
+    """Build the store selected by STATE_BACKEND"""
+    if backend == "redis":
+        return RedisStore()
+    if backend == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown STATE_BACKEND {backend!r}; use 'memory' or 'redis'")
+
+store = create_store()
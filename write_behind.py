@@ -0,0 +1,242 @@
+"""
+Write-behind buffer for Maths Generator App
+Batches Performance, QuestionHistory and other inserts so requests do not wait for a commit
+"""
+
+import os
+import atexit
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Performance, QuestionHistory
+from aggregates import apply_performance_rows
+from instrumentation import get_logger, errors_total, timer
+
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "1") == "1"
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 100))
+WRITE_FLUSH_MS = int(os.environ.get("WRITE_FLUSH_MS", 200))
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", 10000))
+WRITE_BACKPRESSURE_SECONDS = float(os.environ.get("WRITE_BACKPRESSURE_SECONDS", 2))
+WRITE_MAX_RETRIES = 3
+
+# Models are written in this order so foreign keys are satisfied within a batch
+WRITE_ORDER = [QuestionHistory, Performance]
+
+def question_history_row(topic, difficulty, item, user_id=None):
+    """Build a complete QuestionHistory row for enqueue(); the item keeps the row id for grading"""
+    return {
+        "id": item.setdefault("id", str(uuid.uuid4())),
+        "topic": topic,
+        "difficulty": difficulty,
+        "question_text": item["question"],
+        "options": item["options"],
+        "correct_answer": item["correct_answer"],
+        "generated_at": datetime.utcnow(),
+        "generated_by_user_id": user_id,
+        "quarantined": item.get("quarantined", False)
+    }
+
+log = get_logger("write_behind")
+
+class WriteBehindQueue:
+    """Bounded queue of pending inserts flushed every N rows or T milliseconds"""
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_ms=WRITE_FLUSH_MS, max_size=WRITE_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self._queue = queue.Queue(maxsize=max_size)
+        self._app = None
+        self._thread = None
+        self._appliers = {}
+        self._listeners = {}
+        self._stopping = threading.Event()
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "dropped": 0,
+            "row_fallbacks": 0,
+            "backpressure_waits": 0,
+            "sync_writes": 0,
+            "flush_seconds_last": 0.0,
+            "flush_seconds_total": 0.0
+        }
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def start(self, app):
+        """Start the flusher thread and flush any remainder at exit"""
+        self._app = app
+        if not WRITE_BEHIND_ENABLED or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def register_applier(self, model, apply_rows):
+        """Write rows for model with apply_rows(rows) instead of a plain insert"""
+        self._appliers[model] = apply_rows
+
+    def on_commit(self, model, callback):
+        """Call callback(rows) after rows for model have been committed"""
+        self._listeners.setdefault(model, []).append(callback)
+
+    def enqueue(self, model, row):
+        """Queue a row (a dict with every column set) for insertion"""
+        self._count("enqueued")
+        if self._thread is None:
+            self._write([(model, row)])
+            self._count("sync_writes")
+            return
+
+        try:
+            self._queue.put_nowait((model, row))
+            return
+        except queue.Full:
+            self._count("backpressure_waits")
+
+        # Slow the producer down while the flusher catches up
+        try:
+            self._queue.put((model, row), timeout=WRITE_BACKPRESSURE_SECONDS)
+        except queue.Full:
+            self._write([(model, row)])
+            self._count("sync_writes")
+
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._flush_batch(self._drain(first))
+
+    def _flush_batch(self, batch):
+        for attempt in range(WRITE_MAX_RETRIES):
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                self._count("flush_errors")
+                log.warning("Write-behind flush failed (%d rows, attempt %d): %s", len(batch), attempt + 1, e)
+                errors_total.inc(where="write_behind")
+                time.sleep(0.1 * 2 ** attempt)
+        if len(batch) == 1:
+            model, row = batch[0]
+            log.error("Write-behind dropped a %s row %s", model.__name__, row.get("id"))
+            self._count("dropped")
+            return
+        # One bad row must not cost the other students their rows, so write them one at a time
+        self._count("row_fallbacks")
+        for item in sorted(batch, key=lambda item: WRITE_ORDER.index(item[0]) if item[0] in WRITE_ORDER else len(WRITE_ORDER)):
+            try:
+                self._write([item])
+            except Exception as e:
+                model, row = item
+                log.error("Write-behind dropped a %s row %s: %s", model.__name__, row.get("id"), e)
+                errors_total.inc(where="write_behind")
+                self._count("dropped")
+
+    def _write(self, batch):
+        """Insert a batch with one executemany per model in a single transaction"""
+        started = time.perf_counter()
+        rows = {model: [] for model in WRITE_ORDER}
+        for model, row in batch:
+            rows.setdefault(model, []).append(row)
+
+        with self._write_lock, self._app.app_context():
+            for attempt in range(2):
+                try:
+                    for model in WRITE_ORDER:
+                        if rows[model]:
+                            db.session.execute(insert(model), rows[model])
+                    if rows[Performance]:
+                        apply_performance_rows(rows[Performance])
+                    for model, apply_rows in self._appliers.items():
+                        if rows.get(model):
+                            apply_rows(rows[model])
+                    with timer("db_commit"):
+                        db.session.commit()
+                    break
+                except IntegrityError:
+                    # Another process created an aggregate row first; retry as an update
+                    db.session.rollback()
+                    if attempt:
+                        raise
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+        for model, callbacks in self._listeners.items():
+            if not rows.get(model):
+                continue
+            for callback in callbacks:
+                try:
+                    callback(rows[model])
+                except Exception as e:
+                    log.warning("Write-behind commit listener failed: %s", e)
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats["written"] += len(batch)
+            self._stats["flushes"] += 1
+            self._stats["flush_seconds_last"] = elapsed
+            self._stats["flush_seconds_total"] += elapsed
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush_batch(batch)
+
+    def stop(self):
+        """Stop the flusher thread and write what is left"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._app is not None:
+            self.flush()
+
+    def stats(self):
+        """Return queue depth, row counters and flush latency"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["flush_seconds_avg"] = (
+            stats["flush_seconds_total"] / stats["flushes"] if stats["flushes"] else 0.0
+        )
+        return stats
+
+writer = WriteBehindQueue()